@@ -0,0 +1,278 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+#    Licensed under the Apache License,  Version 2.0(the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing,  software
+#    distributed under the License is distributed on an "AS IS" BASIS,  WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND,  either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+"""
+usage: qaStressAnalyze.py [-h] [-out OUT] [-interval SECS] [-late SECS]
+                          events [events ...]
+
+Reads the -events files of a qaStressTest run in one pass and writes:
+  OUT/timeline.csv     actions,  errors and error rate of each action
+                       per interval
+  OUT/latency.csv      latency percentiles of each action and kind
+  OUT/attachments.csv  attach requests per server
+  OUT/ramp.csv         the capacity curve of a -ramp run
+  OUT/summary.json     the totals,  latencies and attachments together
+
+The files of the agents of one run can be given together,  they are
+merged by time.  Memory does not grow with the length of the run: the
+timeline rows are written as soon as no event can still fall in them,
+and latencies are kept in LatencyHistograms.
+"""
+
+import argparse
+import csv
+import heapq
+import json
+import os
+
+from qaStressMetrics import PERCENTILES, LatencyHistogram
+
+# seconds of events kept open for events that arrive out of order
+LATE = 60
+
+
+def read_events(path, index=0, skipped=None):
+    """
+    Yield (ts, index, line number, event) for each event in path.
+    Lines that are not JSON are counted in skipped[path].
+    """
+    with open(path) as f:
+        for number, line in enumerate(f):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                event = json.loads(line)
+            except ValueError:
+                # the last line of a crashed run may be cut short
+                if skipped is not None:
+                    skipped[path] = skipped.get(path, 0) + 1
+                continue
+            yield event["ts"], index, number, event
+
+
+def merge_events(paths, skipped=None):
+    """
+    Yield the events of every path in time order
+    """
+    streams = [read_events(path, index, skipped)
+               for index, path in enumerate(paths)]
+    for ts, index, number, event in heapq.merge(*streams):
+        yield event
+
+
+class Timeline(object):
+    """
+    Counts actions and errors per action and interval,  and writes an
+    interval out once the events have moved late seconds past it.
+    """
+
+    def __init__(self, out, interval, late):
+        self.out = out
+        self.interval = interval
+        self.late = late
+        self.start = None
+        # interval -> action -> [actions, errors]
+        self.open = {}
+        self.latest = 0
+        # last interval written
+        self.written = -1
+        # events for intervals already written
+        self.dropped = 0
+
+    def add(self, ts, action, actions, errors):
+        if self.start is None:
+            self.start = ts
+        slot = int((ts - self.start) / self.interval)
+        if slot <= self.written:
+            self.dropped += 1
+            return
+        counts = self.open.setdefault(slot, {}).setdefault(action, [0, 0])
+        counts[0] += actions
+        counts[1] += errors
+        if ts - self.start > self.latest:
+            self.latest = ts - self.start
+            self._flush(self.latest - self.late)
+
+    def _flush(self, until):
+        for slot in sorted(self.open):
+            if (slot + 1) * self.interval > until:
+                break
+            self.written = slot
+            for action, (actions, errors) in sorted(
+                    self.open.pop(slot).items()):
+                rate = 0.0
+                if actions + errors:
+                    rate = float(errors) / (actions + errors)
+                self.out.writerow([slot * self.interval, action, actions,
+                                   errors, "%.4f" % (rate)])
+
+    def close(self):
+        self._flush(float("inf"))
+
+
+class Analysis(object):
+    """
+    Everything the reports are made of,  built one event at a time
+    """
+
+    def __init__(self, timeline):
+        self.timeline = timeline
+        self.events = 0
+        self.first = None
+        self.last = None
+        # action -> count
+        self.actions = {}
+        self.errors = {}
+        self.outcomes = {}
+        # (action, kind) -> LatencyHistogram
+        self.latencies = {}
+        # server id -> attach requests
+        self.attachments = {}
+        # the ramp steps,  a handful at most
+        self.ramp = []
+
+    def add(self, event):
+        self.events += 1
+        ts = event["ts"]
+        if self.first is None:
+            self.first = ts
+        self.last = ts
+        kind = event["event"]
+        action = event.get("action")
+        if kind == "log" and action and event.get("count"):
+            if event["level"] == "error":
+                self.errors[action] = \
+                    self.errors.get(action, 0) + event["count"]
+                self.timeline.add(ts, action, 0, event["count"])
+            else:
+                self.actions[action] = \
+                    self.actions.get(action, 0) + event["count"]
+                self.timeline.add(ts, action, event["count"], 0)
+        elif kind in ("api", "confirm"):
+            key = (action, kind)
+            if key not in self.latencies:
+                self.latencies[key] = LatencyHistogram()
+            self.latencies[key].record(event["latency"])
+            outcome = "%s %s %s" % (action, kind, event["outcome"])
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+        elif kind == "placement":
+            server = event["server"]
+            self.attachments[server] = self.attachments.get(server, 0) + 1
+        elif kind == "ramp":
+            self.ramp.append(event)
+
+    def latency_rows(self):
+        for (action, kind), hist in sorted(self.latencies.items()):
+            yield [action, kind, hist.count, "%.6f" % (hist.mean())] + \
+                ["%.6f" % (hist.percentile(p)) for p in PERCENTILES] + \
+                ["%.6f" % (hist.max / 1000000.0)]
+
+    def summary(self):
+        latencies = {}
+        for (action, kind), hist in self.latencies.items():
+            entry = {"count": hist.count, "mean": hist.mean(),
+                     "max": hist.max / 1000000.0}
+            for percent in PERCENTILES:
+                entry["p%s" % (percent)] = hist.percentile(percent)
+            latencies.setdefault(action, {})[kind] = entry
+        return {"events": self.events, "first": self.first,
+                "last": self.last,
+                "elapsed": (self.last or 0) - (self.first or 0),
+                "actions": self.actions, "errors": self.errors,
+                "outcomes": self.outcomes, "latencies": latencies,
+                "attachments": self.attachments, "ramp": self.ramp,
+                "lateEvents": self.timeline.dropped}
+
+
+def analyze(paths, out_dir, interval=1, late=LATE):
+    """
+    Write the reports of the events in paths to out_dir,  return the summary
+    """
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+
+    with open(os.path.join(out_dir, "timeline.csv"), "wb") as f:
+        out = csv.writer(f)
+        out.writerow(["second", "action", "actions", "errors", "errorRate"])
+        timeline = Timeline(out, interval, late)
+        analysis = Analysis(timeline)
+        # path -> lines that could not be read
+        skipped = {}
+        for event in merge_events(paths, skipped):
+            analysis.add(event)
+        timeline.close()
+
+    with open(os.path.join(out_dir, "latency.csv"), "wb") as f:
+        out = csv.writer(f)
+        out.writerow(["action", "kind", "count", "mean"] +
+                     ["p%s" % (p) for p in PERCENTILES] + ["max"])
+        for row in analysis.latency_rows():
+            out.writerow(row)
+
+    with open(os.path.join(out_dir, "attachments.csv"), "wb") as f:
+        out = csv.writer(f)
+        out.writerow(["server", "attachments"])
+        for server, count in sorted(analysis.attachments.items()):
+            out.writerow([server, count])
+
+    if analysis.ramp:
+        with open(os.path.join(out_dir, "ramp.csv"), "wb") as f:
+            out = csv.writer(f)
+            out.writerow(["step", "rate", "throughput", "p99", "errors",
+                          "error_rate", "shed"])
+            for point in analysis.ramp:
+                out.writerow([point["step"], point["rate"],
+                              "%.3f" % (point["throughput"]),
+                              "%.6f" % (point["p99"]), point["errors"],
+                              "%.6f" % (point.get("error_rate", 0)),
+                              point["shed"]])
+
+    summary = analysis.summary()
+    summary["skippedLines"] = sum(skipped.values())
+    with open(os.path.join(out_dir, "summary.json"), "w") as f:
+        json.dump(summary, f, indent=2, sort_keys=True)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Stress Test Run Analyzer")
+    parser.add_argument("events",  nargs="+",
+                        help="event files written with qaStressTest "
+                             "-events")
+    parser.add_argument("-out",  dest="out",
+                        help="directory for the reports,  default is "
+                             "analysis",  default="analysis")
+    parser.add_argument("-interval",  dest="interval",  type=float,
+                        help="seconds per timeline row,  default is 1",
+                        default=1)
+    parser.add_argument("-late",  dest="late",  type=float,
+                        help="seconds an event may arrive out of order,  "
+                             "default is %s" % (LATE),  default=LATE)
+    args = parser.parse_args()
+
+    summary = analyze(args.events, args.out, args.interval, args.late)
+    print("%d events over %.1f seconds,  reports in %s" %
+          (summary["events"], summary["elapsed"], args.out))
+    if summary["lateEvents"]:
+        print("%d events arrived too late for the timeline" %
+              (summary["lateEvents"]))
+    if summary["skippedLines"]:
+        print("%d lines were not JSON and were skipped" %
+              (summary["skippedLines"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,481 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+#    Licensed under the Apache License,  Version 2.0(the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing,  software
+#    distributed under the License is distributed on an "AS IS" BASIS,  WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND,  either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+"""
+In-process fake of the parts of cinder and nova that qaStressTest uses.
+
+The fake keeps volumes,  snapshots and servers in memory and moves them
+through the same states as the real services,  each transition taking a
+time drawn from a configurable distribution.  Quotas raise
+RequestEntityTooLarge like the real APIs do,  and so does going over the
+"rate" quota,  a limit on requests per second to each API,  with a
+Retry-After.  It lets the harness be run,  benchmarked and profiled
+without an OpenStack controller.
+
+Latency specs are strings,  read by qaStressMetrics.parse_latency:
+  "0.5"             constant 0.5 seconds
+  "exp:2"           exponential with a mean of 2 seconds
+  "uniform:1:5"     uniform between 1 and 5 seconds
+  "normal:3:1"      normal with mean 3 and deviation 1,  never below 0
+"""
+
+import copy
+import random
+import re
+import threading
+import time
+import uuid
+
+from cinderclient import exceptions as cinderex
+from novaclient import exceptions as novaex
+
+from qaStressMetrics import parse_latency
+
+
+class FakeResource(object):
+    """
+    A volume,  snapshot or server as handed out by the fake clients
+    """
+
+    def __init__(self, info):
+        self._info = info
+        for key, value in info.items():
+            setattr(self, key, value)
+
+    def __repr__(self):
+        return "<FakeResource %s>" % (self._info)
+
+
+class FakeCloud(object):
+    """
+    The state shared by every fake client
+    """
+
+    def __init__(self, transition="uniform:1:3", api="0", quotas=None,
+                 seed=None):
+        self.lock = threading.Lock()
+        self.rng = random.Random(seed)
+        self.transition = parse_latency(transition)
+        self.api = parse_latency(api)
+        self.quotas = quotas or {}
+
+        # kind -> {id: info dict}
+        self.resources = {"volume": {}, "snapshot": {}, "server": {}}
+        # id -> list of (due time, changes),  None changes mean removal
+        self.pending = {}
+        # (service, call) -> number of calls
+        self.calls = {}
+        # (service, call) -> times of the calls in the last second
+        self.recent = {}
+
+    def cinder_client(self):
+        return FakeCinderClient(self)
+
+    def nova_client(self):
+        return FakeNovaClient(self)
+
+    def _call(self, service, name, overlimit):
+        # caller does not hold the lock
+        self.lock.acquire()
+        try:
+            key = "%s.%s" % (service, name)
+            self.calls[key] = self.calls.get(key, 0) + 1
+            self._check_rate(key, overlimit)
+            delay = self.api(self.rng)
+        finally:
+            self.lock.release()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _check_rate(self, key, overlimit):
+        # caller holds the lock
+        limit = self.quotas.get("rate")
+        if limit is None:
+            return
+        now = time.time()
+        recent = [t for t in self.recent.get(key, []) if t > now - 1]
+        if len(recent) >= limit:
+            self.recent[key] = recent
+            ex = overlimit(413, "rate limit of %s requests per second "
+                           "exceeded" % (limit))
+            ex.retry_after = 1
+            raise ex
+        recent.append(now)
+        self.recent[key] = recent
+
+    def _schedule(self, kind, resource_id, changes, delay=None):
+        # caller holds the lock
+        if delay is None:
+            delay = self.transition(self.rng)
+        due = time.time() + delay
+        self.pending.setdefault(resource_id, []).append((due, kind, changes))
+
+    def _advance(self, resource_id):
+        # caller holds the lock
+        pending = self.pending.get(resource_id)
+        if not pending:
+            return
+        now = time.time()
+        while pending and pending[0][0] <= now:
+            due, kind, changes = pending.pop(0)
+            if changes is None:
+                self.resources[kind].pop(resource_id, None)
+            elif resource_id in self.resources[kind]:
+                self.resources[kind][resource_id].update(changes)
+        if not pending:
+            del self.pending[resource_id]
+
+    def _find(self, kind, resource_id, notfound):
+        # caller holds the lock
+        self._advance(resource_id)
+        info = self.resources[kind].get(resource_id)
+        if info is None:
+            raise notfound(404, "%s %s could not be found" %
+                           (kind, resource_id))
+        return info
+
+    def _check_quota(self, kind, overlimit, size=0):
+        # caller holds the lock
+        limit = self.quotas.get(kind + "s")
+        if limit is not None and len(self.resources[kind]) >= limit:
+            raise overlimit(413, "%s quota exceeded" % (kind))
+        limit = self.quotas.get("gigabytes")
+        if kind == "volume" and limit is not None:
+            used = sum(v["size"] for v in self.resources["volume"].values())
+            if used + size > limit:
+                raise overlimit(413, "gigabytes quota exceeded")
+
+    def get(self, kind, resource_id, notfound):
+        self.lock.acquire()
+        try:
+            return FakeResource(copy.deepcopy(self._find(kind, resource_id,
+                                                         notfound)))
+        finally:
+            self.lock.release()
+
+    @staticmethod
+    def _matches(info, opts):
+        for key, value in opts.items():
+            if key == "metadata":
+                metadata = info.get("metadata", {})
+                if any(metadata.get(k) != v for k, v in value.items()):
+                    return False
+            elif key == "name":
+                # nova matches names as a regular expression
+                if not re.search(value, info.get("name", "")):
+                    return False
+            elif info.get(key) != value:
+                return False
+        return True
+
+    def list(self, kind, search_opts=None):
+        """
+        Return the resources matching search_opts: metadata,  name and
+        exact values like the real APIs,  ordered by id so that limit and
+        marker page through them
+        """
+        opts = dict(search_opts or {})
+        limit = opts.pop("limit", None)
+        marker = opts.pop("marker", None)
+        self.lock.acquire()
+        try:
+            result = []
+            for resource_id in sorted(self.resources[kind].keys()):
+                if marker is not None and resource_id <= marker:
+                    continue
+                self._advance(resource_id)
+                info = self.resources[kind].get(resource_id)
+                if info is not None and FakeCloud._matches(info, opts):
+                    result.append(FakeResource(copy.deepcopy(info)))
+                    if limit and len(result) >= int(limit):
+                        break
+            return result
+        finally:
+            self.lock.release()
+
+    def create_volume(self, size, name, description, volume_type,
+                      metadata=None):
+        self.lock.acquire()
+        try:
+            self._check_quota("volume", cinderex.RequestEntityTooLarge, size)
+            info = {"id": str(uuid.uuid4()), "size": size,
+                    "display_name": name, "display_description": description,
+                    "volume_type": volume_type, "status": "creating",
+                    "attachments": [], "metadata": dict(metadata or {})}
+            self.resources["volume"][info["id"]] = info
+            self._schedule("volume", info["id"], {"status": "available"})
+            return FakeResource(copy.deepcopy(info))
+        finally:
+            self.lock.release()
+
+    def delete_volume(self, volume_id):
+        self.lock.acquire()
+        try:
+            info = self._find("volume", volume_id, cinderex.NotFound)
+            if info["status"] not in ("available", "error"):
+                raise cinderex.BadRequest(400, "volume %s status must be "
+                                          "available or error" % (volume_id))
+            for sp in self.resources["snapshot"].values():
+                if sp["volume_id"] == volume_id:
+                    raise cinderex.BadRequest(400, "volume %s still has "
+                                              "snapshots" % (volume_id))
+            info["status"] = "deleting"
+            self._schedule("volume", volume_id, None)
+        finally:
+            self.lock.release()
+
+    def create_snapshot(self, volume_id, force, name, description):
+        self.lock.acquire()
+        try:
+            volume = self._find("volume", volume_id, cinderex.NotFound)
+            if volume["status"] != "available" and \
+               not (force and volume["status"] == "in-use"):
+                raise cinderex.BadRequest(400, "volume %s must be available"
+                                          % (volume_id))
+            self._check_quota("snapshot", cinderex.RequestEntityTooLarge)
+            info = {"id": str(uuid.uuid4()), "volume_id": volume_id,
+                    "size": volume["size"], "display_name": name,
+                    "display_description": description,
+                    "status": "creating", "metadata": {}}
+            self.resources["snapshot"][info["id"]] = info
+            self._schedule("snapshot", info["id"], {"status": "available"})
+            return FakeResource(copy.deepcopy(info))
+        finally:
+            self.lock.release()
+
+    def delete_snapshot(self, snapshot_id):
+        self.lock.acquire()
+        try:
+            info = self._find("snapshot", snapshot_id, cinderex.NotFound)
+            if info["status"] not in ("available", "error"):
+                raise cinderex.BadRequest(400, "snapshot %s status must be "
+                                          "available or error" %
+                                          (snapshot_id))
+            info["status"] = "deleting"
+            self._schedule("snapshot", snapshot_id, None)
+        finally:
+            self.lock.release()
+
+    def create_server(self, name):
+        self.lock.acquire()
+        try:
+            self._check_quota("server", novaex.RequestEntityTooLarge)
+            info = {"id": str(uuid.uuid4()), "name": name, "status": "BUILD",
+                    "OS-EXT-STS:task_state": "spawning", "metadata": {}}
+            self.resources["server"][info["id"]] = info
+            self._schedule("server", info["id"],
+                           {"status": "ACTIVE",
+                            "OS-EXT-STS:task_state": None})
+            return FakeResource(copy.deepcopy(info))
+        finally:
+            self.lock.release()
+
+    def delete_server(self, server_id):
+        self.lock.acquire()
+        try:
+            info = self._find("server", server_id, novaex.NotFound)
+            info["OS-EXT-STS:task_state"] = "deleting"
+            self._schedule("server", server_id, None)
+        finally:
+            self.lock.release()
+
+    def attach(self, server_id, volume_id, device):
+        self.lock.acquire()
+        try:
+            self._find("server", server_id, novaex.NotFound)
+            volume = self._find("volume", volume_id, novaex.NotFound)
+            if volume["status"] != "available":
+                raise novaex.BadRequest(400, "volume %s status must be "
+                                        "available" % (volume_id))
+            for other in self.resources["volume"].values():
+                for attachment in other["attachments"]:
+                    if attachment["server_id"] == server_id and \
+                       attachment["device"] == device:
+                        raise novaex.BadRequest(400, "device %s is in use "
+                                                "on server %s" %
+                                                (device, server_id))
+            volume["status"] = "attaching"
+            attachment = {"id": volume_id, "volume_id": volume_id,
+                          "server_id": server_id, "device": device}
+            self._schedule("volume", volume_id,
+                           {"status": "in-use", "attachments": [attachment]})
+            return FakeResource(copy.deepcopy(attachment))
+        finally:
+            self.lock.release()
+
+    def detach(self, server_id, volume_id):
+        self.lock.acquire()
+        try:
+            volume = self._find("volume", volume_id, novaex.NotFound)
+            if volume["status"] != "in-use":
+                raise novaex.BadRequest(400, "volume %s is not attached" %
+                                        (volume_id))
+            volume["status"] = "detaching"
+            self._schedule("volume", volume_id,
+                           {"status": "available", "attachments": []})
+        finally:
+            self.lock.release()
+
+
+class _Manager(object):
+
+    service = None
+    overlimit = None
+
+    def __init__(self, cloud):
+        self.cloud = cloud
+
+    def _call(self, name):
+        self.cloud._call(self.service, name, self.overlimit)
+
+
+def _resource_id(resource):
+    return getattr(resource, "id", resource)
+
+
+class FakeVolumeManager(_Manager):
+
+    service = "cinder"
+    overlimit = cinderex.RequestEntityTooLarge
+
+    def create(self, size, snapshot_id=None, source_volid=None,
+               display_name=None, display_description=None,
+               volume_type=None, user_id=None, project_id=None,
+               availability_zone=None, metadata=None, imageRef=None):
+        self._call("volumes.create")
+        return self.cloud.create_volume(size, display_name,
+                                        display_description, volume_type,
+                                        metadata)
+
+    def get(self, volume_id):
+        self._call("volumes.get")
+        return self.cloud.get("volume", volume_id, cinderex.NotFound)
+
+    def list(self, detailed=True, search_opts=None):
+        self._call("volumes.list")
+        return self.cloud.list("volume", search_opts)
+
+    def delete(self, volume):
+        self._call("volumes.delete")
+        self.cloud.delete_volume(_resource_id(volume))
+
+
+class FakeSnapshotManager(_Manager):
+
+    service = "cinder"
+    overlimit = cinderex.RequestEntityTooLarge
+
+    def create(self, volume_id, force=False, display_name=None,
+               display_description=None):
+        self._call("volume_snapshots.create")
+        return self.cloud.create_snapshot(volume_id, force, display_name,
+                                          display_description)
+
+    def get(self, snapshot_id):
+        self._call("volume_snapshots.get")
+        return self.cloud.get("snapshot", snapshot_id, cinderex.NotFound)
+
+    def list(self, detailed=True, search_opts=None):
+        self._call("volume_snapshots.list")
+        return self.cloud.list("snapshot", search_opts)
+
+    def delete(self, snapshot):
+        self._call("volume_snapshots.delete")
+        self.cloud.delete_snapshot(_resource_id(snapshot))
+
+
+class FakeVolumeTypeManager(_Manager):
+
+    service = "cinder"
+    overlimit = cinderex.RequestEntityTooLarge
+
+    def list(self):
+        self._call("volume_types.list")
+        return [FakeResource({"id": "1", "name": "fake-type"})]
+
+
+class FakeServerManager(_Manager):
+
+    service = "nova"
+    overlimit = novaex.RequestEntityTooLarge
+
+    def create(self, name, image, flavor, meta=None, files=None,
+               reservation_id=None, min_count=None, max_count=None, **kwargs):
+        self._call("servers.create")
+        return self.cloud.create_server(name)
+
+    def get(self, server_id):
+        self._call("servers.get")
+        return self.cloud.get("server", _resource_id(server_id),
+                              novaex.NotFound)
+
+    def list(self, detailed=True, search_opts=None):
+        self._call("servers.list")
+        return self.cloud.list("server", search_opts)
+
+    def delete(self, server):
+        self._call("servers.delete")
+        self.cloud.delete_server(_resource_id(server))
+
+
+class FakeServerVolumeManager(_Manager):
+
+    service = "nova"
+    overlimit = novaex.RequestEntityTooLarge
+
+    def create_server_volume(self, server_id, volume_id, device):
+        self._call("volumes.create_server_volume")
+        return self.cloud.attach(server_id, volume_id, device)
+
+    def delete_server_volume(self, server_id, attachment_id):
+        self._call("volumes.delete_server_volume")
+        self.cloud.detach(server_id, attachment_id)
+
+
+class FakeImageManager(_Manager):
+
+    service = "nova"
+    overlimit = novaex.RequestEntityTooLarge
+
+    def list(self, detailed=True):
+        self._call("images.list")
+        return [FakeResource({"id": "fake-image", "name": "fake-image"})]
+
+
+class FakeFlavorManager(_Manager):
+
+    service = "nova"
+    overlimit = novaex.RequestEntityTooLarge
+
+    def list(self, detailed=True):
+        self._call("flavors.list")
+        return [FakeResource({"id": "1", "name": "m1.tiny"}),
+                FakeResource({"id": "2", "name": "m1.small"})]
+
+
+class FakeCinderClient(object):
+
+    def __init__(self, cloud):
+        self.volumes = FakeVolumeManager(cloud)
+        self.volume_snapshots = FakeSnapshotManager(cloud)
+        self.volume_types = FakeVolumeTypeManager(cloud)
+
+
+class FakeNovaClient(object):
+
+    def __init__(self, cloud):
+        self.servers = FakeServerManager(cloud)
+        self.volumes = FakeServerVolumeManager(cloud)
+        self.images = FakeImageManager(cloud)
+        self.flavors = FakeFlavorManager(cloud)
@@ -0,0 +1,405 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+#    Licensed under the Apache License,  Version 2.0(the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing,  software
+#    distributed under the License is distributed on an "AS IS" BASIS,  WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND,  either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+"""
+Metrics shared by qaStressTest and the tools that read its output.
+Nothing in here talks to OpenStack,  so it can be imported anywhere.
+"""
+
+import threading
+
+# percentiles printed in the latency summaries
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class LatencyHistogram(object):
+    """
+    Log-linear latency histogram in the style of HdrHistogram.
+
+    Values are kept in microseconds.  Below 256us each bucket is 1us wide,
+    above that every power of two is split into 128 buckets,  so a bucket
+    is never more than 1% wide relative to its values.  Only buckets that
+    were hit are stored,  which bounds memory to a few thousand counts
+    whatever the number of values,  and two histograms merge by adding
+    their counts.
+    """
+
+    SUB_BITS = 7
+    SUB_COUNT = 1 << SUB_BITS
+
+    def __init__(self):
+        # bucket index -> count
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    @staticmethod
+    def _index(value):
+        sub = LatencyHistogram.SUB_COUNT
+        if value < 2 * sub:
+            return value
+        shift = value.bit_length() - LatencyHistogram.SUB_BITS - 1
+        return 2 * sub + (shift - 1) * sub + ((value >> shift) - sub)
+
+    @staticmethod
+    def _highest(index):
+        """
+        Return the highest value that falls in bucket index
+        """
+        sub = LatencyHistogram.SUB_COUNT
+        if index < 2 * sub:
+            return index
+        shift = (index - 2 * sub) // sub + 1
+        top = (index - 2 * sub) % sub + sub
+        return ((top + 1) << shift) - 1
+
+    def record(self, seconds):
+        value = max(0, int(seconds * 1000000))
+        index = LatencyHistogram._index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def subtract(self, earlier):
+        """
+        Return a new histogram of the values recorded since earlier,  a
+        copy of this histogram taken before.  The max is that of the
+        highest bucket left,  the exact one is not known any more.
+        """
+        hist = LatencyHistogram()
+        for index, count in self.counts.items():
+            count -= earlier.counts.get(index, 0)
+            if count > 0:
+                hist.counts[index] = count
+        hist.count = self.count - earlier.count
+        hist.total = self.total - earlier.total
+        if hist.counts:
+            hist.max = min(LatencyHistogram._highest(max(hist.counts)),
+                           self.max)
+        return hist
+
+    def percentile(self, percent):
+        """
+        Return the value in seconds below which percent of the values fall
+        """
+        if self.count == 0:
+            return 0.0
+        wanted = max(1, int(self.count * percent / 100.0 + 0.5))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= wanted:
+                return min(LatencyHistogram._highest(index),
+                           self.max) / 1000000.0
+        return self.max / 1000000.0
+
+    def mean(self):
+        if self.count == 0:
+            return 0.0
+        return self.total / 1000000.0 / self.count
+
+    def summary(self):
+        """
+        Return "count N,  p50 X,  ...,  max Y" with values in seconds
+        """
+        parts = ["count %d" % (self.count)]
+        for percent in PERCENTILES:
+            parts.append("p%s %.3f" % (percent, self.percentile(percent)))
+        parts.append("max %.3f" % (self.max / 1000000.0))
+        return ",  ".join(parts)
+
+    def to_dict(self):
+        return {"counts": dict((str(k), v) for k, v in self.counts.items()),
+                "count": self.count, "total": self.total, "max": self.max}
+
+    @staticmethod
+    def from_dict(data):
+        hist = LatencyHistogram()
+        hist.counts = dict((int(k), v) for k, v in data["counts"].items())
+        hist.count = data["count"]
+        hist.total = data["total"]
+        hist.max = data["max"]
+        return hist
+
+
+class MetricsShard(object):
+    """
+    Counters and latencies of one worker.
+
+    Only the worker that owns a shard writes to it,  so updates take no
+    lock.  Readers merge shards through MetricsRegistry.snapshot,  which
+    may see a worker half way through an update but never loses one.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.actions = 0
+        self.errors = 0
+        # action -> count
+        self.action_counts = {}
+        self.error_counts = {}
+        # action -> requests sent and not answered yet
+        self.inflight = {}
+        # (action, "api" or "confirm") -> LatencyHistogram
+        self.latencies = {}
+
+    def count_action(self, action, increment=1):
+        self.actions += increment
+        if action:
+            self.action_counts[action] = \
+                self.action_counts.get(action, 0) + increment
+
+    def count_error(self, action, increment=1):
+        self.errors += increment
+        if action:
+            self.error_counts[action] = \
+                self.error_counts.get(action, 0) + increment
+
+    def start(self, action):
+        self.inflight[action] = self.inflight.get(action, 0) + 1
+
+    def finish(self, action):
+        self.inflight[action] -= 1
+
+    def record(self, action, kind, seconds):
+        key = (action, kind)
+        if key not in self.latencies:
+            self.latencies[key] = LatencyHistogram()
+        self.latencies[key].record(seconds)
+
+    def merge(self, other):
+        self.actions += other.actions
+        self.errors += other.errors
+        for action, count in other.action_counts.items():
+            self.action_counts[action] = \
+                self.action_counts.get(action, 0) + count
+        for action, count in other.error_counts.items():
+            self.error_counts[action] = \
+                self.error_counts.get(action, 0) + count
+        for action, count in other.inflight.items():
+            self.inflight[action] = self.inflight.get(action, 0) + count
+        for key, hist in other.latencies.items():
+            if key not in self.latencies:
+                self.latencies[key] = LatencyHistogram()
+            self.latencies[key].merge(hist)
+
+    def subtract(self, earlier):
+        """
+        Return a new shard of what happened since earlier,  a snapshot
+        taken before.  In-flight requests are the current ones.
+        """
+        shard = MetricsShard(self.name)
+        shard.actions = self.actions - earlier.actions
+        shard.errors = self.errors - earlier.errors
+        for action, count in self.action_counts.items():
+            shard.action_counts[action] = \
+                count - earlier.action_counts.get(action, 0)
+        for action, count in self.error_counts.items():
+            shard.error_counts[action] = \
+                count - earlier.error_counts.get(action, 0)
+        shard.inflight = dict(self.inflight)
+        for key, hist in self.latencies.items():
+            if key in earlier.latencies:
+                hist = hist.subtract(earlier.latencies[key])
+            else:
+                hist = hist.subtract(LatencyHistogram())
+            if hist.count:
+                shard.latencies[key] = hist
+        return shard
+
+    def to_dict(self):
+        return {"name": self.name, "actions": self.actions,
+                "errors": self.errors, "actionCounts": self.action_counts,
+                "errorCounts": self.error_counts,
+                "latencies": [[action, kind, hist.to_dict()] for
+                              (action, kind), hist in self.latencies.items()]}
+
+    @staticmethod
+    def from_dict(data):
+        shard = MetricsShard(data["name"])
+        shard.actions = data["actions"]
+        shard.errors = data["errors"]
+        shard.action_counts = dict(data["actionCounts"])
+        shard.error_counts = dict(data["errorCounts"])
+        for action, kind, hist in data["latencies"]:
+            shard.latencies[(action, kind)] = LatencyHistogram.from_dict(hist)
+        return shard
+
+
+class MetricsRegistry(object):
+    """
+    Hands out one MetricsShard per worker and merges them on demand.
+
+    The lock only guards the list of shards,  which changes when a worker
+    starts,  so the workers never contend on it while they run.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._shards = []
+
+    def shard(self, name):
+        shard = MetricsShard(name)
+        self.add(shard)
+        return shard
+
+    def add(self, shard):
+        """
+        Add a shard built elsewhere,  such as one an agent reported
+        """
+        with self._lock:
+            self._shards.append(shard)
+
+    def snapshot(self):
+        """
+        Return a new MetricsShard holding the sum of every shard so far
+        """
+        with self._lock:
+            shards = list(self._shards)
+        total = MetricsShard("total")
+        for shard in shards:
+            total.merge(shard)
+        return total
+
+
+def prometheus_text(total, elapsed, rates):
+    """
+    Return total,  a merged MetricsShard,  in the Prometheus text format.
+    elapsed is the run time in seconds and rates maps an action to its
+    completions per second over the last interval.
+    """
+    lines = []
+
+    def family(name, kind, text):
+        lines.append("# HELP %s %s" % (name, text))
+        lines.append("# TYPE %s %s" % (name, kind))
+
+    family("qastress_elapsed_seconds", "gauge", "Seconds since the start")
+    lines.append("qastress_elapsed_seconds %.3f" % (elapsed))
+
+    family("qastress_actions_total", "counter", "Actions performed")
+    lines.append("qastress_actions_total{action=\"all\"} %d" %
+                 (total.actions))
+    for action, count in sorted(total.action_counts.items()):
+        lines.append("qastress_actions_total{action=\"%s\"} %d" %
+                     (action, count))
+
+    family("qastress_errors_total", "counter", "Errors observed")
+    lines.append("qastress_errors_total{action=\"all\"} %d" %
+                 (total.errors))
+    for action, count in sorted(total.error_counts.items()):
+        lines.append("qastress_errors_total{action=\"%s\"} %d" %
+                     (action, count))
+
+    family("qastress_inflight", "gauge", "API requests waiting for a reply")
+    for action, count in sorted(total.inflight.items()):
+        lines.append("qastress_inflight{action=\"%s\"} %d" %
+                     (action, count))
+
+    family("qastress_action_rate", "gauge",
+           "Actions per second since the previous scrape")
+    for action, rate in sorted(rates.items()):
+        lines.append("qastress_action_rate{action=\"%s\"} %.3f" %
+                     (action, rate))
+
+    family("qastress_latency_seconds", "summary",
+           "Request (api) and time to status (confirm) latencies")
+    for (action, kind), hist in sorted(total.latencies.items()):
+        labels = "action=\"%s\",kind=\"%s\"" % (action, kind)
+        for percent in PERCENTILES:
+            lines.append("qastress_latency_seconds{%s,quantile=\"%s\"} "
+                         "%.6f" % (labels, percent / 100.0,
+                                   hist.percentile(percent)))
+        lines.append("qastress_latency_seconds_sum{%s} %.6f" %
+                     (labels, hist.total / 1000000.0))
+        lines.append("qastress_latency_seconds_count{%s} %d" %
+                     (labels, hist.count))
+
+    return "\n".join(lines) + "\n"
+
+
+def parse_latency(spec):
+    """
+    Return a function drawing a latency in seconds from spec,  which is
+    "0.5",  "exp:MEAN",  "uniform:LOW:HIGH" or "normal:MEAN:DEVIATION"
+    """
+    parts = str(spec).split(":")
+    kind = parts[0]
+    try:
+        if len(parts) == 1:
+            value = float(kind)
+            return lambda rng: value
+        values = [float(p) for p in parts[1:]]
+    except ValueError:
+        raise ValueError("bad latency spec %s" % (spec))
+
+    if kind == "exp":
+        return lambda rng: rng.expovariate(1.0 / values[0])
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "normal":
+        return lambda rng: max(0.0, rng.normalvariate(values[0], values[1]))
+    raise ValueError("unknown latency distribution %s" % (kind))
+
+
+def parse_ramp(spec):
+    try:
+        start, step, top = [float(value) for value in spec.split(":")]
+    except ValueError:
+        raise ValueError("bad ramp %s,  not START:STEP:MAX" % (spec))
+    if start <= 0 or step <= 0 or top < start:
+        raise ValueError("bad ramp %s,  rates must go up from above 0" %
+                         (spec))
+    rates = []
+    while start <= top + 1e-9:
+        rates.append(start)
+        start += step
+    return rates
+
+
+def parse_guards(spec):
+    """
+    Return [(name, limit, action)] of a -guard spec
+    """
+    guards = []
+    for item in spec.split(","):
+        if not item:
+            continue
+        try:
+            name, value = item.split("=")
+            limit, action = (value.split(":") + ["stop"])[:2]
+            limit = float(limit)
+        except ValueError:
+            raise ValueError("bad guardrail %s,  not NAME=LIMIT[:ACTION]" %
+                             (item))
+        name = name.strip()
+        if name not in ("errors", "stuck") and not \
+                (name.startswith("p") and name[1:].replace(".", "").isdigit()):
+            raise ValueError("unknown guardrail %s,  not errors,  pNN or "
+                             "stuck" % (name))
+        if action not in ("stop", "shed"):
+            raise ValueError("unknown guardrail action %s,  not stop or "
+                             "shed" % (action))
+        guards.append((name, limit, action))
+    return guards
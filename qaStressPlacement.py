@@ -0,0 +1,128 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+#    Licensed under the Apache License,  Version 2.0(the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing,  software
+#    distributed under the License is distributed on an "AS IS" BASIS,  WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND,  either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+"""
+Placement of the volumes qaStressTest attaches on its servers.
+Nothing in here talks to OpenStack,  so it can be imported anywhere.
+"""
+
+import heapq
+import threading
+
+
+def device_name(index):
+    """
+    Return the /dev/vdX name of device slot index,  1 is /dev/vdb
+    """
+    deviceName = ""
+    num = index
+    while num >= 26:
+        q = num // 26
+        deviceName = chr(97+q) + deviceName
+        num = num - 26 * q
+    return "/dev/vd" + deviceName + chr(97+num)
+
+
+class Placement(object):
+    """
+    Picks the server with the fewest volumes attached and a free device
+    name on it,  both under one lock.
+
+    Servers sit in a min-heap keyed by how many volumes they hold.  An
+    attach or detach pushes a new entry for the server and leaves the old
+    one behind,  to be skipped when it comes out,  so placing a volume is
+    O(log n).  Each server's free device slots are a heap too,  so the
+    lowest free name is handed out and a released one is reused.  The
+    slot is kept by volume,  nova may name the device differently,  and
+    released by volume once the harness is done with the attachment.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.servers = {}
+        # (attached,  sequence,  server id)
+        self.heap = []
+        self.sequence = 0
+        # server id -> volumes attached now
+        self.attached = {}
+        # server id -> heap of free device slots
+        self.free = {}
+        # volume id -> (server id,  slot) reserved for it
+        self.held = {}
+        # server id -> attachments made over the whole run
+        self.attach_counts = {}
+
+    def _push(self, server_id):
+        # caller holds the lock
+        self.sequence += 1
+        heapq.heappush(self.heap, (self.attached[server_id], self.sequence,
+                                   server_id))
+        if len(self.heap) > 4 * len(self.servers) + 16:
+            # drop the stale entries
+            self.heap = [(self.attached[sid], i, sid)
+                         for i, sid in enumerate(self.servers)]
+            heapq.heapify(self.heap)
+
+    def add_server(self, server):
+        with self.lock:
+            if server.id in self.servers:
+                return
+            self.servers[server.id] = server
+            self.attached[server.id] = 0
+            self.free[server.id] = list(range(1, self.limit + 1))
+            self.attach_counts.setdefault(server.id, 0)
+            self._push(server.id)
+
+    def acquire(self, volume_id):
+        """
+        Reserve a device on the least loaded server for volume_id.
+        Returns (server,  device name),  or None if every server is full.
+        """
+        with self.lock:
+            while self.heap:
+                attached, seq, server_id = self.heap[0]
+                if attached != self.attached[server_id]:
+                    heapq.heappop(self.heap)
+                    continue
+                if attached >= self.limit:
+                    return None
+                heapq.heappop(self.heap)
+                slot = heapq.heappop(self.free[server_id])
+                device = device_name(slot)
+                self.held[volume_id] = (server_id, slot)
+                self.attached[server_id] += 1
+                self.attach_counts[server_id] += 1
+                self._push(server_id)
+                return self.servers[server_id], device
+            return None
+
+    def release(self, volume_id):
+        """
+        Give back the device acquire() reserved for volume_id,  if any
+        """
+        with self.lock:
+            held = self.held.pop(volume_id, None)
+            if held is None:
+                return
+            server_id, slot = held
+            heapq.heappush(self.free[server_id], slot)
+            self.attached[server_id] -= 1
+            self._push(server_id)
+
+    def merge_attach_counts(self, attach_counts):
+        with self.lock:
+            for server_id, count in attach_counts.items():
+                self.attach_counts[server_id] = \
+                    self.attach_counts.get(server_id, 0) + count
@@ -0,0 +1,146 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+#    Licensed under the Apache License,  Version 2.0(the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing,  software
+#    distributed under the License is distributed on an "AS IS" BASIS,  WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND,  either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+"""
+Scenario files for qaStressTest -scenario.
+
+A scenario is a JSON object,  or the same in YAML when PyYAML is
+installed and the file ends in .yaml or .yml:
+
+  {
+    "threads": 10,              worker threads,  overrides -threads
+    "volumes": 8,               most volumes a thread holds at a time,
+                                overrides -volumes
+    "duration": 600,            seconds to run for,  overrides -duration
+    "mix": {                    weight of each operation,  an operation
+      "create_volume": 4,       is only picked when it can be done,  for
+      "create_snapshot": 2,     example detach_volume needs an attached
+      "attach_volume": 3,       volume,  missing operations are never
+      "detach_volume": 3,       picked
+      "delete_snapshot": 2,
+      "delete_volume": 4
+    },
+    "sizes": {"1": 6, "10": 3, "100": 1},    weight of each size in GB
+    "types": {"ssd": 1, "": 3},              weight of each volume type,
+                                             "" is no type
+    "think": "exp:2"            pause after each operation,  in the
+                                forms of qaStressMetrics.parse_latency
+  }
+
+Every key is optional.  The default mix weighs every operation the
+same,  the default sizes are 1 to 5 GB,  and without types the volume
+types follow -voltype.
+"""
+
+import json
+
+from qaStressMetrics import parse_latency
+
+OPERATIONS = ("create_volume", "create_snapshot", "attach_volume",
+              "detach_volume", "delete_snapshot", "delete_volume")
+
+KEYS = ("threads", "volumes", "duration", "mix", "sizes", "types", "think")
+
+
+def _weights(name, data, convert=str):
+    """
+    Return [(value, weight)] of a {value: weight} mapping
+    """
+    if not isinstance(data, dict):
+        raise ValueError("%s must map each value to a weight" % (name))
+    weights = []
+    for value, weight in sorted(data.items()):
+        try:
+            weights.append((convert(value), float(weight)))
+        except ValueError:
+            raise ValueError("bad %s entry %s: %s" % (name, value, weight))
+    if weights and sum(weight for value, weight in weights) <= 0:
+        raise ValueError("%s weights add up to nothing" % (name))
+    return weights
+
+
+def pick(rng, weights):
+    """
+    Return a value of [(value, weight)] drawn by weight,  None if empty
+    """
+    total = sum(weight for value, weight in weights)
+    if total <= 0:
+        return None
+    point = rng.uniform(0, total)
+    for value, weight in weights:
+        point -= weight
+        if point < 0:
+            return value
+    return weights[-1][0]
+
+
+class Scenario(object):
+    """
+    The workload of a scenario file,  see the module docstring
+    """
+
+    def __init__(self, data):
+        unknown = set(data) - set(KEYS)
+        if unknown:
+            raise ValueError("unknown scenario keys %s" %
+                             (", ".join(sorted(unknown))))
+        self.threads = data.get("threads")
+        self.volumes = data.get("volumes")
+        self.duration = data.get("duration")
+
+        self.mix = _weights("mix", data.get("mix",
+                                            dict.fromkeys(OPERATIONS, 1)))
+        for operation, weight in self.mix:
+            if operation not in OPERATIONS:
+                raise ValueError("unknown operation %s,  not one of %s" %
+                                 (operation, ", ".join(OPERATIONS)))
+        self.sizes = _weights("sizes", data.get("sizes",
+                                                dict.fromkeys(range(1, 6),
+                                                              1)), int)
+        if not self.sizes:
+            raise ValueError("sizes has no sizes")
+        self.types = None
+        if "types" in data:
+            self.types = [(value or None, weight) for value, weight in
+                          _weights("types", data["types"])]
+        self.think = parse_latency(data.get("think", 0))
+
+    def operation(self, rng, possible):
+        """
+        Draw the next operation out of the possible ones
+        """
+        return pick(rng, [(operation, weight) for operation, weight in
+                          self.mix if operation in possible])
+
+    def size(self, rng):
+        return pick(rng, self.sizes)
+
+    def volume_type(self, rng):
+        return pick(rng, self.types)
+
+
+def load_scenario(path):
+    """
+    Read a Scenario from a JSON or YAML file,  ValueError if it is bad
+    """
+    with open(path) as f:
+        if path.endswith((".yaml", ".yml")):
+            # only YAML scenarios need PyYAML
+            import yaml
+            data = yaml.safe_load(f)
+        else:
+            data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError("%s does not hold a scenario object" % (path))
+    return Scenario(data)
@@ -18,7 +18,21 @@
 """
 usage: qaStressTest.py [-h] [-threads THREADS] [-servers SERVERS]
                        [-volumes VOLUMES] [-logfile LOGFILE]
-                       [-keepvm] [-noconfirm]
+                       [-keepvm] [-noconfirm] [-engine {thread,eventlet}]
+                       [-processes PROCESSES] [-agents AGENTS] [-agent PORT]
+                       [-pipeline] [-rate RATE] [-arrival {poisson,constant}]
+                       [-duration DURATION] [-inflight INFLIGHT]
+                       [-metrics-port PORT] [-backend {openstack,fake}]
+                       [-fake-latency SPEC] [-fake-api-latency SPEC]
+                       [-fake-quota QUOTAS] [-api-rate RATE]
+                       [-cleanup-workers N] [-events FILE]
+                       [-console-rate N] [-seed SEED] [-record FILE]
+                       [-replay FILE] [-replay-speed X] [-scenario FILE]
+                       [-soak SECS] [-soak-window SECS]
+                       [-ramp START:STEP:MAX] [-ramp-step SECS]
+                       [-guard GUARDS] [-guard-window SECS]
+                       [-ledger FILE] [-cleanup-from FILE] [-resume FILE]
+                       [-tag TAG]
                        host
 
 positional arguments:
@@ -33,28 +47,87 @@ optional arguments:
   -keepvm           keep the servers
   -noconfirm        do not confirm action before continuing
   -voltype          include volume types in the tests
+  -engine ENGINE    run workers as OS threads or eventlet green threads
+  -processes N      split the threads across N local agent processes
+  -agents AGENTS    split the threads across remote host:port agents
+  -agent PORT       run as an agent for a coordinator
+  -pipeline         run each volume through its lifecycle without barriers
+  -rate RATE        open loop volume lifecycle arrivals per second
+  -arrival ARRIVAL  poisson or constant open loop inter-arrival times
+  -duration SECS    seconds to generate open loop arrivals for
+  -inflight N       most open loop lifecycles in flight
+  -metrics-port PORT  serve live metrics for Prometheus on PORT
+  -backend BACKEND  openstack or the in-process fake cinder and nova
+  -fake-latency SPEC  fake status transition time distribution
+  -fake-api-latency SPEC  fake API request time distribution
+  -fake-quota QUOTAS  fake quotas,  e.g. volumes=50,gigabytes=200
+  -api-rate RATE    most requests per second to each API
+  -cleanup-workers N  most cleanup calls in flight
+  -events FILE      write every event as a line of JSON to FILE
+  -console-rate N   most info lines per second on the console
+  -seed SEED        seed that determines the generated workload
+  -record FILE      record the volume lifecycles started to FILE
+  -replay FILE      start the lifecycles recorded in FILE at their times
+  -replay-speed X   replay X times as fast as recorded
+  -scenario FILE    run the operation mix of a JSON or YAML scenario
+  -soak SECS        keep replacing each thread's volumes for SECS seconds
+  -soak-window SECS  seconds per soak metrics window
+  -ramp START:STEP:MAX  raise the open loop rate in steps up to the knee
+  -ramp-step SECS   seconds per ramp step
+  -guard GUARDS     stop or shed load on errors=RATE,  pNN=SECS,  stuck=N
+  -guard-window SECS  seconds of metrics the guardrails look at
+  -ledger FILE      append every resource created and state reached to FILE
+  -cleanup-from FILE  delete only the resources left in a ledger and exit
+  -resume FILE      finish the lifecycles of the volumes left in a ledger
+  -tag TAG          metadata value that marks the volumes of this run
 """
 
 
+import argparse
+
+# the eventlet engine must patch the standard library before the modules
+# below take their references to socket,  threading and time,  and before
+# any client,  lock or thread gets created,  so -engine is read up front
+_engine_parser = argparse.ArgumentParser(add_help=False)
+_engine_parser.add_argument("-engine",  dest="engine")
+if _engine_parser.parse_known_args()[0].engine == "eventlet":
+    import eventlet
+    eventlet.monkey_patch()
+
 #import pydevd
 #pydevd.settrace('127.0.0.1', suspend=False,
 #                stdoutToServer=True, stderrToServer=True)
 import threading
 #threading.settrace(pydevd.GetGlobalDebugger().trace_dispatch)
 import pprint
+import random
 from random import randint
 import time as mytime
 from datetime import timedelta as mytimedelta
+from datetime import datetime
+import calendar
 import traceback
+import resource
 
-import argparse
 from sys import path
 import os
 import sys
+import json
+import socket
+import subprocess
+import Queue
+import collections
+import BaseHTTPServer
+import urlparse
 
 import logging
 
 # import cinder
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3 import connectionpool
+
+import cinderclient.client
 from cinderclient import exceptions as cinderex
 # import cinderclient
 from cinderclient.v1.client import Client as cinder
@@ -63,17 +136,81 @@ from novaclient.v1_1.client import Client as nova
 # from nova import exception as novaex
 from novaclient import exceptions as novaex
 
+from qaStressMetrics import LatencyHistogram, MetricsRegistry, MetricsShard
+from qaStressMetrics import parse_guards, parse_ramp, prometheus_text
+from qaStressPlacement import Placement
+from qaStressScenario import load_scenario
+
 ATTACHMENT_LIMIT = 26
 
 # wait time in minutes
 WAIT_TIME = 5
 
-# wait retry time in seconds
+# longest over limit backoff in seconds
 WAIT_RETRY = 60
 
+# first over limit backoff in seconds,  doubled on each retry
+BACKOFF_BASE = 2
+
+# slowest an over limit API is throttled to,  in requests per second
+MIN_API_RATE = 0.05
+
 # confirm wait time in seconds
 WAIT_CONFIRM = 300
 
+# status watcher poll interval in seconds,  the longest when the lists
+# are slow and the shortest while resources are waited on
+WATCH_INTERVAL = 5
+WATCH_MIN_INTERVAL = 0.5
+
+# most events the event writer takes off its queue per write
+EVENT_BATCH = 500
+
+# a ramp step that adds less than this fraction of throughput,  whose
+# p99 is this many times that of the first step,  or whose errors per
+# action are this much over those of the first step,  is past the knee
+RAMP_GAIN = 0.05
+RAMP_P99 = 3
+RAMP_ERRORS = 0.05
+
+# how often the guardrails are checked,  in seconds
+GUARD_INTERVAL = 5
+
+# fewest actions and errors in the window before the error rate counts,
+# and fewest confirms before a latency percentile does
+GUARD_MIN_SAMPLES = 10
+
+# exit status of a run a guardrail stopped
+GUARD_EXIT = 3
+
+# most ledger entries the ledger writer takes off its queue per fsync
+LEDGER_BATCH = 500
+
+# action -> (kind,  state once requested,  state once confirmed) in the
+# ledger,  "detached" tells a detached volume from one never attached
+LEDGER_STATES = {
+    "create_volume": ("volume", "creating", "available"),
+    "attach_volume": ("volume", "attaching", "in-use"),
+    "detach_volume": ("volume", "detaching", "detached"),
+    "delete_volume": ("volume", "deleting", "deleted"),
+    "create_snapshot": ("snapshot", "creating", "available"),
+    "delete_snapshot": ("snapshot", "deleting", "deleted"),
+    "create_server": ("server", "creating", "active"),
+    "delete_server": ("server", "deleting", "deleted")}
+
+# metadata key whose value,  -tag,  marks the volumes of a run
+TAG_KEY = "qaStressTest"
+
+# most resources asked for per list call,  no more than the osapi_max_limit
+# of cinder and nova,  1000 by default,  or the lists stop after one page
+LIST_PAGE = 1000
+
+# how often an open loop worker looks for new arrivals, in seconds
+ARRIVAL_POLL = 0.5
+
+# renew the shared keystone token this many seconds before it expires
+TOKEN_REFRESH = 300
+
 parser = argparse.ArgumentParser(description="Stress Test Tool")
 parser.add_argument("host",  type=str,
                     help='The IP for the openstack controller')
@@ -103,31 +240,674 @@ parser.add_argument("-noconfirm",  dest="confirm",
                     help="do not confirm action before continuing, "
                          "default is do confirmation",
                     action="store_false",  default=True)
+# note that the eventlet engine runs the workers as green threads,
+# the blocking client calls become non-blocking once eventlet patches
+# the standard library, so one process can drive many more workers
+parser.add_argument("-engine",  dest="engine",
+                    help="worker engine,  thread or eventlet,  "
+                         "default is thread",
+                    choices=["thread", "eventlet"],  default="thread")
+# note that with -processes or -agents this process only coordinates,
+# the threads are split across the agents which report their totals back
+parser.add_argument("-processes",  dest="processes",  type=int,
+                    help="number of local agent processes to split the "
+                         "threads across,  default is 0",  default=0)
+parser.add_argument("-agents",  dest="agents",
+                    help="comma separated host:port list of remote agents "
+                         "to split the threads across")
+parser.add_argument("-agent",  dest="agent",  type=int,
+                    help="run as an agent listening on the given port,  "
+                         "0 picks a free port")
+# note that -pipeline moves each volume to its next step as soon as
+# the previous one is confirmed instead of waiting for the whole phase
+parser.add_argument("-pipeline",  dest="pipeline",
+                    help="run each volume through its own lifecycle,  "
+                         "default is False",
+                    action="store_true",  default=False)
+# note that -rate switches to open loop load: lifecycles arrive at the
+# given rate whether or not the backend keeps up,  so a slow backend
+# shows up as a shortfall instead of as a lower offered load
+parser.add_argument("-rate",  dest="rate",  type=float,
+                    help="open loop volume lifecycle arrivals per second,  "
+                         "default is 0 for closed loop threads",  default=0)
+parser.add_argument("-arrival",  dest="arrival",
+                    help="open loop inter-arrival times,  poisson or "
+                         "constant,  default is poisson",
+                    choices=["poisson", "constant"],  default="poisson")
+parser.add_argument("-duration",  dest="duration",  type=int,
+                    help="seconds to generate open loop arrivals for,  "
+                         "default is 300",  default=300)
+parser.add_argument("-inflight",  dest="inflight",  type=int,
+                    help="most open loop lifecycles in flight,  default is "
+                         "threads times volumes,  or no limit with -ramp")
+parser.add_argument("-cleanup-workers",  dest="cleanup_workers",  type=int,
+                    help="most cleanup calls in flight,  default is 10",
+                    default=10)
+# note that the limiter also adapts by itself: an API that answers over
+# limit has its rate halved,  and each success raises it again
+parser.add_argument("-api-rate",  dest="api_rate",  type=float,
+                    help="most requests per second to each API,  default "
+                         "is 0 for no limit until the API answers over "
+                         "limit",  default=0)
+# note that the threads only queue their events,  one writer thread formats
+# them for the console and the log file and writes them to the -events file
+parser.add_argument("-events",  dest="events",
+                    help="write every event as a line of JSON to this "
+                         "file,  default is off")
+parser.add_argument("-console-rate",  dest="console_rate",  type=int,
+                    help="most info lines per second on the console,  "
+                         "errors are always shown,  default is 0 for no "
+                         "limit",  default=0)
+# note that the seed fixes the volume sizes and open loop arrivals,  and
+# with -backend fake the fake's timings,  but not the thread scheduling
+parser.add_argument("-seed",  dest="seed",  type=int,
+                    help="seed for the generated workload,  default is "
+                         "a random seed that is logged")
+# note that a replay runs open loop: each recorded lifecycle starts at its
+# recorded time with its recorded size and type,  the steps after the
+# create follow the backend like any pipelined lifecycle
+parser.add_argument("-record",  dest="record",
+                    help="record the volume lifecycles started,  with "
+                         "their times and parameters,  to this file")
+parser.add_argument("-replay",  dest="replay",
+                    help="replay the lifecycles of a -record file")
+parser.add_argument("-replay-speed",  dest="replay_speed",  type=float,
+                    help="replay this many times as fast as recorded,  "
+                         "default is 1",  default=1)
+# note that a scenario replaces the fixed lifecycle of each thread with
+# operations drawn from its weighted mix until its duration is up,  see
+# qaStressScenario for the file format
+parser.add_argument("-scenario",  dest="scenario",
+                    help="JSON or YAML scenario file with the operation "
+                         "mix,  sizes,  volume types and think time")
+# note that a soak runs the pipelined lifecycle and starts a new lifecycle
+# each time one finishes,  so each thread keeps -volumes volumes with their
+# snapshots and attachments churning,  and logs the metrics of each window
+parser.add_argument("-soak",  dest="soak",  type=int,
+                    help="seconds to keep replacing each thread's "
+                         "volumes for,  default is 0 for one pass",
+                    default=0)
+parser.add_argument("-soak-window",  dest="soak_window",  type=int,
+                    help="seconds per soak metrics window,  default is "
+                         "300",  default=300)
+# note that a ramp is open loop: the arrival rate starts at START and goes
+# up by STEP every -ramp-step seconds,  up to MAX,  and the ramp stops at
+# the first step where the throughput stops growing or the p99 blows up
+parser.add_argument("-ramp",  dest="ramp",
+                    help="open loop lifecycle arrival rates as "
+                         "START:STEP:MAX,  default is off")
+parser.add_argument("-ramp-step",  dest="ramp_step",  type=int,
+                    help="seconds per ramp step,  default is 120",
+                    default=120)
+# note that each guardrail is NAME=LIMIT[:ACTION] over the last
+# -guard-window seconds,  NAME is errors (errors per action and error),
+# pNN (confirm latency percentile in seconds) or stuck (resources waited
+# on for longer than the window),  ACTION is stop,  which ends the run and
+# goes to the cleanup,  or shed,  which holds back new work while breached
+parser.add_argument("-guard",  dest="guard",
+                    help="comma separated guardrails,  e.g. "
+                         "errors=0.2,p99=120:shed,stuck=10,  default is "
+                         "none",  default="")
+parser.add_argument("-guard-window",  dest="guard_window",  type=int,
+                    help="seconds of metrics the guardrails look at,  "
+                         "default is 120",  default=120)
+# note that the ledger is appended to,  never rewritten: one line of JSON
+# per resource created and per state it reaches,  fsynced in batches,  so
+# after a crash -cleanup-from and -resume know exactly what is left
+# without listing the tenant; with a ledger the end of run cleanup also
+# only looks at its resources
+parser.add_argument("-ledger",  dest="ledger",
+                    help="append the resources created and the states "
+                         "they reach to this file,  default is off")
+parser.add_argument("-cleanup-from",  dest="cleanup_from",
+                    help="delete the resources a ledger still has and "
+                         "exit,  appending their deletion to it")
+parser.add_argument("-resume",  dest="resume",
+                    help="run the volumes a ledger still has through the "
+                         "rest of their pipelined lifecycle,  appending "
+                         "to it")
+# note that the volumes get the tag as metadata when they are created,  so
+# the watcher and the cleanup ask the server for this run's volumes only;
+# with "" they list every volume and match the names here,  as before
+parser.add_argument("-tag",  dest="tag",
+                    help="metadata value that marks the volumes of this "
+                         "run,  default is a new one per run,  or for "
+                         "-resume and -cleanup-from that of the ledger")
+# note that the endpoint only reads the merged metrics when it is scraped,
+# the threads do not do anything extra for it
+parser.add_argument("-metrics-port",  dest="metrics_port",  type=int,
+                    help="serve live metrics in the Prometheus text format "
+                         "on this port,  default is off")
+# note that the fake backend runs cinder and nova inside this process,  so
+# it measures the harness itself; host and the OS_* vars are not used
+parser.add_argument("-backend",  dest="backend",
+                    help="openstack or an in-process fake,  default is "
+                         "openstack",
+                    choices=["openstack", "fake"],  default="openstack")
+parser.add_argument("-fake-latency",  dest="fake_latency",
+                    help="fake status transition time,  seconds or "
+                         "exp:MEAN,  uniform:LOW:HIGH,  normal:MEAN:DEV,  "
+                         "default is uniform:1:3",  default="uniform:1:3")
+parser.add_argument("-fake-api-latency",  dest="fake_api_latency",
+                    help="fake API request time,  same forms as "
+                         "-fake-latency,  default is 0",  default="0")
+parser.add_argument("-fake-quota",  dest="fake_quota",
+                    help="fake quotas as volumes=N,snapshots=N,servers=N,"
+                         "gigabytes=N,rate=N,  rate is requests per second "
+                         "to each API,  default is unlimited",  default="")
 
 args = parser.parse_args()
 
 auth_url = "http://%s:35357/v2.0" % args.host
 
-novacl = nova(os.environ['OS_USERNAME'],
-              os.environ['OS_PASSWORD'],
-              os.environ['OS_TENANT_NAME'],
-              auth_url,
-              True,  None,  None,
-              None,  None,
-              'publicURL',  None,
-              'compute',  None,
-              None,  False,
-              None,  True,
-              False,  'keystone')
-
-cindercl = cinder(os.environ['OS_USERNAME'],
+if args.seed is None and args.replay:
+    # the fake backend and the backoff then behave as they were recorded
+    with open(args.replay) as f:
+        args.seed = json.loads(f.readline())["seed"]
+if args.seed is None:
+    args.seed = random.SystemRandom().randint(0, 2 ** 31 - 1)
+# the backoff jitter,  the rest has its own generators seeded from args.seed
+random.seed(args.seed)
+
+# set with -scenario,  its threads,  volumes and duration win over the options
+scenario = None
+if args.scenario:
+    if args.rate or args.replay:
+        print("### -scenario cannot be combined with -rate or -replay")
+        sys.exit(1)
+    try:
+        scenario = load_scenario(args.scenario)
+    except (IOError, ImportError, ValueError), e:
+        print("### Bad scenario %s: %s" % (args.scenario, e))
+        sys.exit(1)
+    if scenario.threads is not None:
+        args.threads = scenario.threads
+    if scenario.volumes is not None:
+        args.volumes = scenario.volumes
+    if scenario.duration is not None:
+        args.duration = scenario.duration
+
+if args.soak and (args.rate or args.replay or args.scenario):
+    print("### -soak cannot be combined with -rate,  -replay or -scenario")
+    sys.exit(1)
+
+try:
+    guards = parse_guards(args.guard)
+except ValueError, e:
+    print("### %s" % (e))
+    sys.exit(1)
+
+ramp_rates = None
+if args.ramp:
+    if args.rate or args.replay or args.scenario or args.soak or \
+            args.processes or args.agents:
+        print("### -ramp cannot be combined with -rate,  -replay,  "
+              "-scenario,  -soak or agents")
+        sys.exit(1)
+    try:
+        ramp_rates = parse_ramp(args.ramp)
+    except ValueError, e:
+        print("### %s" % (e))
+        sys.exit(1)
+
+if args.resume and (args.rate or args.replay or args.scenario or
+                    args.soak or args.ramp or args.processes or args.agents):
+    print("### -resume cannot be combined with -rate,  -replay,  "
+          "-scenario,  -soak,  -ramp or agents")
+    sys.exit(1)
+
+if args.cleanup_from and args.resume:
+    print("### -cleanup-from and -resume cannot be combined")
+    sys.exit(1)
+
+if args.replay and (args.processes or args.agents):
+    print("### -replay runs in this process,  it cannot be split across "
+          "agents")
+    sys.exit(1)
+
+
+class KeystoneSession(object):
+    """
+    One keystone token shared by every nova and cinder client.
+
+    The first client that needs a token authenticates for real,  the
+    others borrow its token and service catalog and look their own
+    endpoint up in it.  The token is renewed TOKEN_REFRESH seconds
+    before it expires,  or when a service rejects it,  so keystone sees
+    the same few authentications whatever the number of threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.token = None
+        self.catalog = None
+        self.expires = None
+        self.auth_calls = 0
+
+    def attach(self, client):
+        """
+        Make client get its token from this session and return it
+        """
+        http = client.client
+        http.shared_token = None
+        authenticate = http.authenticate
+        cs_request = http._cs_request
+
+        def shared_authenticate():
+            self._authenticate(http, authenticate)
+
+        def shared_cs_request(url, method, **kwargs):
+            if http.auth_token != self.token or self._expiring():
+                self._authenticate(http, authenticate)
+            return cs_request(url, method, **kwargs)
+
+        http.authenticate = shared_authenticate
+        http._cs_request = shared_cs_request
+        return client
+
+    def _expiring(self):
+        return self.expires is not None and \
+            mytime.time() > self.expires - TOKEN_REFRESH
+
+    def _authenticate(self, http, authenticate):
+        with self.lock:
+            # a client that lost the token we gave it had it rejected
+            rejected = not http.auth_token and \
+                http.shared_token is not None and \
+                http.shared_token == self.token
+            if self.token is None or rejected or self._expiring():
+                http.auth_token = None
+                http.management_url = None
+                authenticate()
+                self.auth_calls += 1
+                self.token = http.auth_token
+                self.catalog = http.service_catalog
+                self.expires = KeystoneSession._expiry(self.catalog)
+            else:
+                http.auth_token = self.token
+                http.service_catalog = self.catalog
+                http.management_url = self.catalog.url_for(
+                    attr='region',
+                    filter_value=http.region_name,
+                    endpoint_type=http.endpoint_type,
+                    service_type=http.service_type,
+                    service_name=http.service_name,
+                    volume_service_name=http.volume_service_name).rstrip('/')
+            http.shared_token = self.token
+
+    @staticmethod
+    def _expiry(catalog):
+        """
+        Return when the token in catalog expires,  or None if unknown
+        """
+        try:
+            expires = catalog.catalog['access']['token']['expires']
+        except (AttributeError, KeyError, TypeError):
+            return None
+        for form in ("%Y-%m-%dT%H:%M:%SZ", "%Y-%m-%dT%H:%M:%S.%fZ"):
+            try:
+                return calendar.timegm(datetime.strptime(expires,
+                                                         form).timetuple())
+            except ValueError:
+                pass
+        return None
+
+
+# every openstack client borrows its token from here
+keystone = KeystoneSession()
+
+
+class _CountingPool(object):
+    """
+    Mixed into urllib3's connection pools to count connections made and
+    reused and the time spent waiting for a free one
+    """
+
+    stats = None
+
+    def _new_conn(self):
+        self.stats["created"] += 1
+        return super(_CountingPool, self)._new_conn()
+
+    def _get_conn(self, timeout=None):
+        w_time = mytime.time()
+        conn = super(_CountingPool, self)._get_conn(timeout)
+        waited = mytime.time() - w_time
+        self.stats["gets"] += 1
+        self.stats["wait_total"] += waited
+        self.stats["wait_max"] = max(self.stats["wait_max"], waited)
+        return conn
+
+
+class _PooledAdapter(HTTPAdapter):
+
+    def __init__(self, stats, size):
+        self.stats = stats
+        HTTPAdapter.__init__(self, pool_connections=1, pool_maxsize=size,
+                             pool_block=True)
+
+    def init_poolmanager(self, *args, **kwargs):
+        HTTPAdapter.init_poolmanager(self, *args, **kwargs)
+        classes = {}
+        for scheme, cls in (("http", connectionpool.HTTPConnectionPool),
+                            ("https", connectionpool.HTTPSConnectionPool)):
+            classes[scheme] = type("Counting" + cls.__name__,
+                                   (_CountingPool, cls),
+                                   {"stats": self.stats})
+        self.poolmanager.pool_classes_by_scheme = classes
+
+
+class ConnectionPools(object):
+    """
+    Keep-alive HTTP connections shared by every client,  one pool per
+    endpoint,  each holding as many connections as there are threads
+    that can use it.  A thread that finds the pool empty waits for a
+    connection instead of opening another one.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        # scheme://host:port -> requests.Session
+        self.sessions = {}
+        # scheme://host:port -> counters
+        self.stats = {}
+
+    def session(self, url):
+        parts = urlparse.urlsplit(url)
+        endpoint = "%s://%s" % (parts.scheme, parts.netloc)
+        with self.lock:
+            if endpoint not in self.sessions:
+                stats = {"created": 0, "gets": 0, "wait_total": 0.0,
+                         "wait_max": 0.0}
+                session = requests.Session()
+                session.mount(endpoint, _PooledAdapter(stats, self.size))
+                self.sessions[endpoint] = session
+                self.stats[endpoint] = stats
+            return self.sessions[endpoint]
+
+    def request(self, method, url, **kwargs):
+        return self.session(url).request(method, url, **kwargs)
+
+    def attach(self, client):
+        """
+        Make client send its requests through the shared pools
+        """
+        http = client.client
+        if hasattr(http, "http"):
+            # novaclient picks its requests session through http()
+            http.http = self.session
+        return client
+
+    def install(self):
+        """
+        Route cinderclient's module level requests.request calls here
+        """
+        pools = self
+
+        class PooledRequests(object):
+            def __getattr__(self, name):
+                return getattr(requests, name)
+
+            def request(self, method, url, **kwargs):
+                return pools.request(method, url, **kwargs)
+
+        cinderclient.client.requests = PooledRequests()
+
+    def log_stats(self):
+        with self.lock:
+            stats = sorted(self.stats.items())
+        for endpoint, counts in stats:
+            OpenStackThread.log_message("HTTP pool %s: %d connections "
+                                        "created,  %d reused,  wait for a "
+                                        "connection total %.3f max %.3f "
+                                        "seconds" %
+                                        (endpoint, counts["created"],
+                                         counts["gets"] - counts["created"],
+                                         counts["wait_total"],
+                                         counts["wait_max"]))
+
+
+# the worker threads,  the status watcher and the main thread share these,
+# and so do the cleanup and fetch workers,  of which there can be more
+http_pools = ConnectionPools(max(args.threads, args.cleanup_workers) + 2)
+
+
+def rate_limited(ex):
+    """
+    Return True if the over limit answer ex is a rate limit,  which passes
+    with time,  and not a quota,  which does not.  Rate limits come with
+    a Retry-After or say so in the message.
+    """
+    if getattr(ex, "retry_after", 0):
+        return True
+    message = str(getattr(ex, "message", "") or ex).lower()
+    return "rate limit" in message or "rate-limit" in message
+
+
+def backoff_delay(attempt, ex=None):
+    """
+    Return how long to wait before retry attempt (0 based) after an over
+    limit answer: a random time up to BACKOFF_BASE * 2 ** attempt,  capped
+    at WAIT_RETRY,  but never less than the Retry-After the API sent
+    """
+    delay = random.uniform(0, min(WAIT_RETRY, BACKOFF_BASE * 2 ** attempt))
+    try:
+        retry_after = float(getattr(ex, "retry_after", 0) or 0)
+    except (TypeError, ValueError):
+        retry_after = 0
+    return max(delay, retry_after)
+
+
+class TokenBucket(object):
+    """
+    Client side rate limit for one API,  adjusted AIMD style.
+
+    The bucket starts at the ceiling,  or unlimited without one.  An over
+    limit answer halves the rate,  at most once per second,  and empties
+    the bucket for the Retry-After time.  Each success adds 1/rate,  which
+    raises the rate by about one request per second every second.  The
+    threads queue for tokens in the order they asked,  so they do not all
+    retry together.
+    """
+
+    def __init__(self, name, ceiling=0):
+        self.name = name
+        self.ceiling = ceiling or None
+        self.rate = self.ceiling
+        self.tokens = 1.0
+        self.last = mytime.time()
+        self.last_decrease = 0
+        self.lock = threading.Lock()
+        # successes in the last second,  to start from when first limited
+        self.recent = collections.deque()
+        self.throttles = 0
+        self.wait_total = 0.0
+
+    def _refill(self, now):
+        # caller holds the lock
+        burst = max(1.0, self.rate)
+        self.tokens = min(burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def acquire(self):
+        with self.lock:
+            if self.rate is None:
+                return
+            now = mytime.time()
+            self._refill(now)
+            self.tokens -= 1
+            wait = 0
+            if self.tokens < 0:
+                wait = -self.tokens / self.rate
+            self.wait_total += wait
+        if wait:
+            mytime.sleep(wait)
+
+    def succeeded(self):
+        with self.lock:
+            now = mytime.time()
+            if self.rate is None:
+                self.recent.append(now)
+                while self.recent and self.recent[0] < now - 1:
+                    self.recent.popleft()
+                return
+            self._refill(now)
+            self.rate += 1.0 / self.rate
+            if self.ceiling is not None:
+                self.rate = min(self.rate, self.ceiling)
+
+    def throttled(self, ex=None):
+        with self.lock:
+            self.throttles += 1
+            now = mytime.time()
+            if now - self.last_decrease < 1:
+                return
+            self.last_decrease = now
+            if self.rate is None:
+                # start from what got through in the last second
+                self.rate = len(self.recent) or 1.0
+                self.recent.clear()
+                self.last = now
+            else:
+                self._refill(now)
+            self.rate = max(MIN_API_RATE, self.rate / 2)
+            try:
+                retry_after = float(getattr(ex, "retry_after", 0) or 0)
+            except (TypeError, ValueError):
+                retry_after = 0
+            self.tokens = min(self.tokens, -retry_after * self.rate)
+
+
+class RateLimiters(object):
+    """
+    One TokenBucket per API,  shared by every thread
+    """
+
+    def __init__(self, ceiling=0):
+        self.ceiling = ceiling
+        self.lock = threading.Lock()
+        self.buckets = {}
+
+    def bucket(self, api):
+        with self.lock:
+            if api not in self.buckets:
+                self.buckets[api] = TokenBucket(api, self.ceiling)
+            return self.buckets[api]
+
+    def call(self, api, call, *args, **kwargs):
+        """
+        Make call once the api's bucket allows it and tell the bucket
+        whether it was rate limited.  A quota says nothing about the rate.
+        """
+        bucket = self.bucket(api)
+        bucket.acquire()
+        try:
+            result = call(*args, **kwargs)
+        except (cinderex.RequestEntityTooLarge,
+                novaex.RequestEntityTooLarge) as ex:
+            if rate_limited(ex):
+                bucket.throttled(ex)
+            raise
+        bucket.succeeded()
+        return result
+
+    def retry(self, api, call, *args, **kwargs):
+        """
+        Make call like call() does,  sleeping and retrying while the api
+        rate limits it.  A quota is raised at once.
+        """
+        attempt = 0
+        while True:
+            try:
+                return self.call(api, call, *args, **kwargs)
+            except (cinderex.RequestEntityTooLarge,
+                    novaex.RequestEntityTooLarge) as ex:
+                if not rate_limited(ex):
+                    raise
+                mytime.sleep(backoff_delay(attempt, ex))
+                attempt += 1
+
+    def log_stats(self):
+        with self.lock:
+            buckets = sorted(self.buckets.items())
+        for api, bucket in buckets:
+            if bucket.rate is None and not bucket.throttles:
+                continue
+            OpenStackThread.log_message("API rate %s: %d over limit,  "
+                                        "final rate %.2f/s,  waited %.3f "
+                                        "seconds for tokens" %
+                                        (api, bucket.throttles,
+                                         bucket.rate or 0,
+                                         bucket.wait_total))
+
+
+rate_limiters = RateLimiters(args.api_rate)
+
+# set to the shared qaStressFake.FakeCloud with -backend fake
+fake_cloud = None
+
+
+def create_nova_client():
+    if fake_cloud is not None:
+        return fake_cloud.nova_client()
+    novacl = nova(os.environ['OS_USERNAME'],
                   os.environ['OS_PASSWORD'],
                   os.environ['OS_TENANT_NAME'],
                   auth_url,
                   True,  None,  None,
-                  None,  None,  None,
+                  None,  None,
                   'publicURL',  None,
-                  'volume',  None,  None)
+                  'compute',  None,
+                  None,  False,
+                  None,  True,
+                  False,  'keystone')
+    return keystone.attach(http_pools.attach(novacl))
+
+
+def create_cinder_client():
+    if fake_cloud is not None:
+        return fake_cloud.cinder_client()
+    cindercl = cinder(os.environ['OS_USERNAME'],
+                      os.environ['OS_PASSWORD'],
+                      os.environ['OS_TENANT_NAME'],
+                      auth_url,
+                      True,  None,  None,
+                      None,  None,  None,
+                      'publicURL',  None,
+                      'volume',  None,  None)
+    return keystone.attach(http_pools.attach(cindercl))
+
+
+def parse_quotas(spec):
+    quotas = {}
+    for item in spec.split(","):
+        if item:
+            name, value = item.split("=")
+            quotas[name.strip()] = int(value)
+    return quotas
+
+
+if args.backend == "fake":
+    import qaStressFake
+    try:
+        fake_cloud = qaStressFake.FakeCloud(args.fake_latency,
+                                            args.fake_api_latency,
+                                            parse_quotas(args.fake_quota),
+                                            args.seed)
+    except ValueError, e:
+        print("### Bad fake backend option: %s" % (e))
+        sys.exit(-1)
+else:
+    http_pools.install()
+    #make sure we have the OS_* environ vars we need
+    for name in ('OS_USERNAME', 'OS_PASSWORD', 'OS_TENANT_NAME'):
+        if not os.environ.get(name):
+            print("Must have %s environ var set" % (name))
+            sys.exit(-1)
+
+novacl = create_nova_client()
+cindercl = create_cinder_client()
 
 if args.threads * args.volumes > args.servers * ATTACHMENT_LIMIT:
     print("### Too many volumes which cannot all be used to attach to servers")
@@ -137,23 +917,11 @@ if args.threads * args.volumes > args.servers * ATTACHMENT_LIMIT:
           str(args.servers*ATTACHMENT_LIMIT))
     sys.exit(1)
 
-#make sure we have the OS_* environ vars we need
-if not os.environ['OS_USERNAME']:
-    print "Must have OS_USERNAME environ var set"
-    sys.exit(-1)
-
-if not os.environ['OS_PASSWORD']:
-    print "Must have OS_PASSWORD environ var set"
-    sys.exit(-1)
-
-if not os.environ['OS_TENANT_NAME']:
-    print("Must have OS_TENANT_NAME environ var set")
-    sys.exit(-1)
-
 volume_types = []
 
 if(args.voltype):
-    volume_types_list = cindercl.volume_types.list()
+    volume_types_list = rate_limiters.retry("list_volume_type",
+                                            cindercl.volume_types.list)
     if len(volume_types_list) < 1:
         print("Must have at least 1 Volume Type created")
         sys.exit(-1)
@@ -163,21 +931,1265 @@ if(args.voltype):
             volume_types.append(s.name)
         volume_types.append(None)
 
-totalRunActions = 0
-totalRunAction_create = 0
-totalRunAction_delete = 0
-totalRunAction_create_sp = 0
-totalRunAction_delete_sp = 0
-totalRunAction_attach = 0
-totalRunAction_detach = 0
+# the actions the threads count,  with the label used in the reports
+ACTIONS = (("create_volume", "create volume"),
+           ("create_snapshot", "create snapshot"),
+           ("attach_volume", "attach volume"),
+           ("detach_volume", "detach volume"),
+           ("delete_snapshot", "delete snapshot"),
+           ("delete_volume", "delete volume"))
+
+# every thread counts into its own shard,  merged when reporting
+metrics = MetricsRegistry()
+
+# set by the guardrails: stop_run ends the run early,  with the breach in
+# stop_reason,  and new work waits while shed_load is set
+stop_run = threading.Event()
+stop_reason = {}
+shed_load = threading.Event()
+
+
+# the attachments of every thread are placed through here
+placement = Placement(ATTACHMENT_LIMIT)
+
+
+class SnapshotIndex(object):
+    """
+    Maps a volume id to the ids of the snapshots taken from it.
+
+    Fed by the snapshots the threads create and by the watcher's snapshot
+    lists, so checking whether a volume still has a snapshot does not cost
+    any API call.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # volume id -> set of snapshot ids
+        self.volumes = {}
+        # snapshot id -> (volume id, time it was added)
+        self.snapshots = {}
+
+    def _add(self, snapshot_id, volume_id, when):
+        self.snapshots[snapshot_id] = (volume_id, when)
+        self.volumes.setdefault(volume_id, set()).add(snapshot_id)
+
+    def _discard(self, snapshot_id):
+        volume_id, when = self.snapshots.pop(snapshot_id)
+        deps = self.volumes[volume_id]
+        deps.discard(snapshot_id)
+        if not deps:
+            del self.volumes[volume_id]
+
+    def add(self, snapshot):
+        self.lock.acquire()
+        try:
+            if snapshot.id not in self.snapshots:
+                self._add(snapshot.id, snapshot.volume_id, mytime.time())
+        finally:
+            self.lock.release()
+
+    def discard(self, snapshot_id):
+        self.lock.acquire()
+        try:
+            if snapshot_id in self.snapshots:
+                self._discard(snapshot_id)
+        finally:
+            self.lock.release()
+
+    def update(self, snapshots, started):
+        """
+        Sync with a full snapshot list requested at time started.
+        Snapshots added after that are kept even if the list missed them.
+        """
+        self.lock.acquire()
+        try:
+            listed = set()
+            for sp in snapshots:
+                if sp.status == "deleted":
+                    continue
+                listed.add(sp.id)
+                if sp.id not in self.snapshots:
+                    self._add(sp.id, sp.volume_id, started)
+            for snapshot_id, (volume_id, when) in self.snapshots.items():
+                if snapshot_id not in listed and when < started:
+                    self._discard(snapshot_id)
+        finally:
+            self.lock.release()
+
+    def has(self, volume_id):
+        return bool(self.volumes.get(volume_id))
+
+    def get(self, volume_id):
+        self.lock.acquire()
+        try:
+            return list(self.volumes.get(volume_id, ()))
+        finally:
+            self.lock.release()
+
+
+class StatusWatcher(threading.Thread):
+    """
+    Background poller shared by all the worker threads.
+
+    Workers register the volume,  snapshot or server they are waiting on
+    and block until a detailed list shows it in the wanted state.  Each
+    tick does one list per resource kind that has waiters, so the number
+    of API calls stays flat no matter how many resources are being
+    confirmed.  The lists only hold this run's resources,  see list_ours.
+    A resource missing from the list is reported as "deleted".
+
+    A tick is as long as its lists took,  between WATCH_MIN_INTERVAL and
+    interval,  and a status is taken to be reached when the list that
+    saw it was sent,  so confirm latencies are not rounded up to a tick.
+    """
+
+    KINDS = ("volume", "snapshot", "server")
+
+    def __init__(self, client, nova_client, interval=WATCH_INTERVAL):
+        threading.Thread.__init__(self)
+        self.name = "qaStressTest-watcher"
+        self.daemon = True
+
+        self.client = client
+        self.nova_client = nova_client
+        self.interval = interval
+        self.cond = threading.Condition()
+
+        # kind -> {resource id: number of waiters}
+        self.waiting = dict((kind, {}) for kind in StatusWatcher.KINDS)
+        # (kind,  resource id) -> time it was first waited on
+        self.since = {}
+        # set once the run is stopped,  waits return at once
+        self.stopped = False
+        # kind -> {resource id: resource} from the latest list
+        self.resources = dict((kind, {}) for kind in StatusWatcher.KINDS)
+        # kind -> number of completed lists, and whether one is running
+        self.generation = dict((kind, 0) for kind in StatusWatcher.KINDS)
+        # kind -> time the latest completed list was sent
+        self.sent = dict((kind, None) for kind in StatusWatcher.KINDS)
+        self.listing = dict((kind, False) for kind in StatusWatcher.KINDS)
+        # kind -> callbacks given each list and the time it was requested
+        self.subscribers = dict((kind, []) for kind in StatusWatcher.KINDS)
+
+    def subscribe(self, kind, callback):
+        self.subscribers[kind].append(callback)
+
+    def _list(self, kind):
+        if kind == "volume":
+            return list_ours(self.client.volumes, kind)
+        if kind == "server":
+            return list_ours(self.nova_client.servers, kind)
+        return list_ours(self.client.volume_snapshots, kind)
+
+    def run(self):
+        while True:
+            self.cond.acquire()
+            try:
+                while not any(self.waiting.values()):
+                    self.cond.wait()
+                kinds = [k for k in StatusWatcher.KINDS if self.waiting[k]]
+                for kind in kinds:
+                    self.listing[kind] = True
+            finally:
+                self.cond.release()
+
+            found = {}
+            sent = {}
+            tick_start = mytime.time()
+            for kind in kinds:
+                try:
+                    started = mytime.time()
+                    found[kind] = dict((r.id, r) for r in self._list(kind))
+                    sent[kind] = started
+                    for callback in self.subscribers[kind]:
+                        callback(found[kind].values(), started)
+                except:
+                    OpenStackThread.log_message("### Watcher failed to list "
+                                                "%ss: %s" %
+                                                (kind, traceback.format_exc()))
+
+            self.cond.acquire()
+            try:
+                for kind in kinds:
+                    self.listing[kind] = False
+                    if kind in found:
+                        self.resources[kind] = found[kind]
+                        self.sent[kind] = sent[kind]
+                        self.generation[kind] += 1
+                self.cond.notify_all()
+            finally:
+                self.cond.release()
+
+            took = mytime.time() - tick_start
+            mytime.sleep(min(self.interval, max(WATCH_MIN_INTERVAL, took)))
+
+    def get(self, kind, resource_id):
+        """
+        Return the resource as seen by the latest list, or None
+        """
+        return self.resources[kind].get(resource_id)
+
+    def elapsed(self, kind, w_time):
+        """
+        Return the seconds from w_time until the latest list of kind
+        was sent,  how long a status it returned took to be reached
+        """
+        sent = self.sent[kind]
+        if sent is None:
+            return mytime.time() - w_time
+        return max(sent - w_time, 0.0)
+
+    def _status(self, kind, resource_id):
+        resource = self.resources[kind].get(resource_id)
+        if resource is None:
+            return "deleted"
+        return resource.status
+
+    def _register(self, kind, resource_id):
+        # caller holds self.cond
+        waiters = self.waiting[kind]
+        waiters[resource_id] = waiters.get(resource_id, 0) + 1
+        if waiters[resource_id] == 1:
+            self.since[(kind, resource_id)] = mytime.time()
+        self.cond.notify_all()
+
+        # only trust a list that was started after we registered
+        return self.generation[kind] + (2 if self.listing[kind] else 1)
+
+    def _unregister(self, kind, resource_id):
+        # caller holds self.cond
+        waiters = self.waiting[kind]
+        waiters[resource_id] -= 1
+        if waiters[resource_id] == 0:
+            del waiters[resource_id]
+            del self.since[(kind, resource_id)]
+
+    def _wait(self, kind, resource_id, done, timeout):
+        w_time = mytime.time()
+        self.cond.acquire()
+        try:
+            seen = self._register(kind, resource_id)
+            status = None
+            while True:
+                if self.generation[kind] >= seen:
+                    seen = self.generation[kind] + 1
+                    status = self._status(kind, resource_id)
+                    if done(status):
+                        return status
+                remaining = timeout - (mytime.time() - w_time)
+                if remaining <= 0 or self.stopped:
+                    return status
+                self.cond.wait(remaining)
+        finally:
+            self._unregister(kind, resource_id)
+            self.cond.release()
+
+    def stuck(self, age):
+        """
+        Return how many resources have been waited on for over age seconds
+        """
+        oldest = mytime.time() - age
+        self.cond.acquire()
+        try:
+            return len([t for t in self.since.values() if t < oldest])
+        finally:
+            self.cond.release()
+
+    def stop(self):
+        """
+        Make every current and later wait return at once
+        """
+        self.cond.acquire()
+        try:
+            self.stopped = True
+            self.cond.notify_all()
+        finally:
+            self.cond.release()
+
+    def watch(self, kind, resource_id):
+        """
+        Keep the resource in the lists until unwatch() is called.
+        Returns the mark to give to poll().
+        """
+        self.cond.acquire()
+        try:
+            return self._register(kind, resource_id)
+        finally:
+            self.cond.release()
+
+    def unwatch(self, kind, resource_id):
+        self.cond.acquire()
+        try:
+            self._unregister(kind, resource_id)
+        finally:
+            self.cond.release()
+
+    def poll(self, kind, resource_id, mark):
+        """
+        Return the status of a watched resource without blocking,
+        None if no list started after watch() has completed yet.
+        """
+        if self.generation[kind] < mark:
+            return None
+        return self._status(kind, resource_id)
+
+    def wait_tick(self, timeout):
+        """
+        Block until the next list completes, or timeout
+        """
+        self.cond.acquire()
+        try:
+            seen = sum(self.generation.values())
+            w_time = mytime.time()
+            while sum(self.generation.values()) == seen:
+                remaining = timeout - (mytime.time() - w_time)
+                if remaining <= 0:
+                    return
+                self.cond.wait(remaining)
+        finally:
+            self.cond.release()
+
+    def wait_for(self, kind, resource_id, statuses, timeout):
+        """
+        Wait until the resource reaches one of statuses, or timeout.
+        Returns the last status seen, None if no list completed in time.
+        """
+        return self._wait(kind, resource_id, lambda s: s in statuses,
+                          timeout)
+
+    def wait_while(self, kind, resource_id, statuses, timeout):
+        """
+        Wait as long as the resource is in one of statuses, or timeout.
+        Returns the last status seen, None if no list completed in time.
+        """
+        return self._wait(kind, resource_id, lambda s: s not in statuses,
+                          timeout)
+
+
+class OpenLoopGenerator(threading.Thread):
+    """
+    Issues volume lifecycle arrivals at a target rate for a duration.
+
+    Arrivals are scheduled on an absolute timeline so a slow backend does
+    not lower the offered load.  An arrival that finds max_inflight
+    lifecycles already running is shed and counted instead of queued.
+    """
+
+    def __init__(self, rate, duration, arrival, max_inflight, seed=None):
+        threading.Thread.__init__(self)
+        self.name = "qaStressTest-arrivals"
+        self.daemon = True
+
+        self.rate = rate
+        self.duration = duration
+        self.arrival = arrival
+        self.max_inflight = max_inflight
+        self.rng = random.Random(seed)
+
+        self.queue = Queue.Queue()
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.inflight = 0
+
+        self.clock_start = None
+        # seconds the arrivals were generated for
+        self.window = None
+        self.offered = 0
+        self.started = 0
+        self.shed = 0
+        self.finished_count = 0
+        # time from the scheduled arrival to the create request
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+
+    def _gap(self):
+        if self.arrival == "constant":
+            return 1.0 / self.rate
+        return self.rng.expovariate(self.rate)
+
+    def run(self):
+        self.clock_start = mytime.time()
+        next_time = self.clock_start
+        while True:
+            next_time += self._gap()
+            if next_time - self.clock_start > self.duration:
+                break
+            if not self._offer(next_time, None):
+                break
+        self._generated()
+
+    def _generated(self):
+        """
+        Mark every arrival handed out.  They were generated over the
+        duration,  unless a guardrail stopped the run first.
+        """
+        self.window = self.duration
+        if stop_run.is_set():
+            self.window = min(self.duration,
+                              mytime.time() - self.clock_start)
+        self.done.set()
+
+    def _offer(self, next_time, entry):
+        """
+        Hand out an arrival at next_time unless it has to be shed.
+        Returns False once a guardrail stopped the run.
+        """
+        delay = next_time - mytime.time()
+        if delay > 0 and stop_run.wait(delay):
+            return False
+        if stop_run.is_set():
+            return False
+
+        self.lock.acquire()
+        try:
+            self.offered += 1
+            if self.inflight >= self.max_inflight or shed_load.is_set():
+                self.shed += 1
+                return True
+            self.inflight += 1
+        finally:
+            self.lock.release()
+        self.queue.put((next_time, entry))
+        return True
+
+    def take(self, timeout):
+        """
+        Return (scheduled time,  recorded entry or None) of the next
+        arrival,  or None
+        """
+        try:
+            if timeout:
+                return self.queue.get(True, timeout)
+            return self.queue.get_nowait()
+        except Queue.Empty:
+            return None
+
+    def started_one(self, scheduled):
+        lag = mytime.time() - scheduled
+        self.lock.acquire()
+        self.started += 1
+        self.lag_total += lag
+        self.lag_max = max(self.lag_max, lag)
+        self.lock.release()
+
+    def finished_one(self):
+        self.lock.acquire()
+        self.inflight -= 1
+        self.finished_count += 1
+        self.lock.release()
+
+    def finished(self):
+        return self.done.is_set() and self.queue.empty()
+
+    def stats(self):
+        return {"offered": self.offered, "started": self.started,
+                "shed": self.shed, "finished": self.finished_count,
+                "lag_total": self.lag_total, "lag_max": self.lag_max,
+                "window": self.window}
+
+
+class RampGenerator(OpenLoopGenerator):
+    """
+    Open loop arrivals whose rate goes up a step at a time.
+
+    After each step the actions done and the confirm latencies of the
+    step are taken from the difference of two registry snapshots.  The
+    ramp stops at the knee,  the first step whose throughput grows less
+    than RAMP_GAIN over the best so far,  whose p99 is over RAMP_P99
+    times that of the first step or whose errors per action are over
+    those of the first step by RAMP_ERRORS.  The throughput only counts
+    confirmed actions,  and the best before the knee is the estimated
+    capacity.  A step that shed arrivals also stops the
+    ramp,  but its knee is the harness's and is reported as such.
+    """
+
+    def __init__(self, rates, step, arrival, max_inflight, registry,
+                 seed=None):
+        OpenLoopGenerator.__init__(self, rates[0], step * len(rates),
+                                   arrival, max_inflight, seed)
+        self.rates = rates
+        self.step = step
+        self.registry = registry
+        # one dict per step done
+        self.curve = []
+        self.knee = None
+        self.best = None
 
-totalRunErrors = 0
-totalRunError_create = 0
-totalRunError_delete = 0
-totalRunError_create_sp = 0
-totalRunError_delete_sp = 0
-totalRunError_attach = 0
-totalRunError_detach = 0
+    @staticmethod
+    def _p99(shard):
+        hist = LatencyHistogram()
+        for (action, kind), step_hist in shard.latencies.items():
+            if kind == "confirm":
+                hist.merge(step_hist)
+        return hist.percentile(99)
+
+    @staticmethod
+    def _confirmed(shard):
+        return sum(hist.count for (action, kind), hist in
+                   shard.latencies.items() if kind == "confirm")
+
+    def _measure(self, number, rate, shard, shed):
+        point = {"step": number, "rate": rate,
+                 "throughput": self._confirmed(shard) / float(self.step),
+                 "errors": shard.errors,
+                 "error_rate": shard.errors / float(max(shard.actions, 1)),
+                 "p99": self._p99(shard), "shed": shed}
+        self.curve.append(point)
+        OpenStackThread.log_message("Ramp step %d: %.3f lifecycles/s "
+                                    "offered,  %.3f confirmed actions/s,  "
+                                    "confirm p99 %.3f,  %d errors,  %d shed"
+                                    % (number, rate, point["throughput"],
+                                       point["p99"], point["errors"], shed))
+        OpenStackThread.events.emit(dict(point, event="ramp"))
+
+        first = self.curve[0]
+        cause = None
+        if shed:
+            # the step's load was not all offered,  the backend was not
+            # what held it back
+            cause = "shed"
+        elif self.best is not None and point["error_rate"] > \
+                first["error_rate"] + RAMP_ERRORS:
+            cause = "errors"
+        elif self.best is not None and point["p99"] > first["p99"] * \
+                RAMP_P99 > 0:
+            cause = "p99"
+        elif self.best is not None and point["throughput"] < \
+                self.best["throughput"] * (1 + RAMP_GAIN):
+            cause = "throughput"
+        if cause is not None:
+            point["cause"] = cause
+            self.knee = point
+            return True
+        if self.best is None or point["throughput"] > \
+                self.best["throughput"]:
+            self.best = point
+        return False
+
+    def run(self):
+        self.clock_start = mytime.time()
+        next_time = self.clock_start
+        last = self.registry.snapshot()
+        for number, rate in enumerate(self.rates, 1):
+            self.rate = rate
+            step_end = next_time + self.step
+            shed = self.shed
+            while True:
+                next_time += self._gap()
+                if next_time > step_end or not self._offer(next_time, None):
+                    break
+            delay = step_end - mytime.time()
+            if stop_run.is_set() or (delay > 0 and stop_run.wait(delay)):
+                break
+            next_time = step_end
+
+            total = self.registry.snapshot()
+            if self._measure(number, rate, total.subtract(last),
+                             self.shed - shed):
+                break
+            last = total
+        self.done.set()
+
+
+class TraceRecorder(object):
+    """
+    Writes each volume lifecycle as it starts to a -record file,  one line
+    of JSON with its time,  thread,  size and type.  The first line holds
+    the seed of the run.
+    """
+
+    def __init__(self, path, seed):
+        self.lock = threading.Lock()
+        self.clock_start = mytime.time()
+        self.count = 0
+        self.out = open(path, "w")
+        self.out.write(json.dumps({"seed": seed,
+                                   "start": self.clock_start}) + "\n")
+
+    def record(self, threadid, index, size, volume_type):
+        line = json.dumps({"at": mytime.time() - self.clock_start,
+                           "thread": threadid, "index": index,
+                           "size": size, "type": volume_type})
+        with self.lock:
+            self.out.write(line + "\n")
+            self.count += 1
+
+    def close(self):
+        with self.lock:
+            self.out.close()
+
+
+class TraceReplay(OpenLoopGenerator):
+    """
+    Open loop arrivals taken from a -record file instead of generated.
+
+    Each recorded lifecycle arrives at its recorded offset from the first
+    one,  divided by speed,  and carries its recorded size and type.
+    """
+
+    def __init__(self, path, speed, max_inflight):
+        with open(path) as f:
+            lines = [json.loads(line) for line in f if line.strip()]
+        self.header = lines[0]
+        self.entries = sorted(lines[1:], key=lambda entry: entry["at"])
+        if not self.entries:
+            raise ValueError("%s has no recorded lifecycles" % (path))
+        self.speed = speed
+        span = (self.entries[-1]["at"] - self.entries[0]["at"]) / speed
+        # a single arrival still takes a moment
+        span = max(span, 1.0 / speed)
+        OpenLoopGenerator.__init__(self, len(self.entries) / span, span,
+                                   "replayed", max_inflight)
+
+    def run(self):
+        self.clock_start = mytime.time()
+        first = self.entries[0]["at"]
+        for entry in self.entries:
+            if not self._offer(self.clock_start +
+                               (entry["at"] - first) / self.speed, entry):
+                break
+        self._generated()
+
+
+def run_filter(kind):
+    """
+    Return the search options that narrow a list of kind down to the
+    resources of this run on the server
+    """
+    if kind == "volume" and args.tag:
+        return {"metadata": {TAG_KEY: args.tag}}
+    if kind == "server":
+        # nova matches names as a regular expression
+        return {"name": "^" + OpenStackThread.SERVERS_NAME}
+    # the snapshot API here takes neither metadata nor partial names
+    return {}
+
+
+def list_paged(manager, search_opts=None, api="list"):
+    """
+    Yield the detailed resources of manager matching search_opts,  one
+    page of LIST_PAGE at a time,  each page starting after the last one.
+    The pages are asked for through the api's rate limiter.  Raises
+    RuntimeError if the API ignores the marker and has more than one
+    page,  as the rest of the list cannot be had.
+    """
+    def page(opts):
+        return rate_limiters.retry(api, manager.list, True, search_opts=opts)
+
+    opts = dict(search_opts or {}, limit=LIST_PAGE)
+    resources = page(opts)
+    first = set(resource.id for resource in resources)
+    while resources:
+        for resource in resources:
+            yield resource
+        if len(resources) < LIST_PAGE:
+            return
+        opts["marker"] = resources[-1].id
+        resources = page(opts)
+        if resources and resources[0].id in first:
+            # the API ignores the marker,  take the rest from a full list,
+            # which the server cuts off at its osapi_max_limit
+            resources = page(search_opts)
+            if len(resources) >= LIST_PAGE:
+                raise RuntimeError("%s ignores the marker and has more than "
+                                   "%d resources,  the list is incomplete" %
+                                   (api, LIST_PAGE))
+            for resource in resources:
+                if resource.id not in first:
+                    yield resource
+            return
+
+
+def list_ours(manager, kind, search_opts=None):
+    """
+    Yield the resources of kind of this run: run_filter() narrows the list
+    on the server and the names are matched here as the pages come in,  so
+    only ours are kept
+    """
+    opts = run_filter(kind)
+    opts.update(search_opts or {})
+    if kind == "volume":
+        name, attr = OpenStackThread.VOLUME_NAME, "display_name"
+    elif kind == "snapshot":
+        name, attr = OpenStackThread.SNAPSHOT_NAME, "display_name"
+    else:
+        name, attr = OpenStackThread.SERVERS_NAME, "name"
+    for resource in list_paged(manager, opts, "list_" + kind):
+        if name in (getattr(resource, attr) or ""):
+            yield resource
+
+
+def _ledger_merge(live, entry):
+    """
+    Fold one ledger entry into live,  the last entry of each resource not
+    deleted yet
+    """
+    key = (entry["kind"], entry["id"])
+    if entry["state"] == "deleted":
+        live.pop(key, None)
+    elif key in live:
+        live[key].update(entry)
+    else:
+        live[key] = dict(entry)
+
+
+def read_ledger(path):
+    """
+    Return the last entry of each resource of a ledger file not deleted
+    yet,  in the order they were created
+    """
+    live = collections.OrderedDict()
+    if not os.path.exists(path):
+        return live
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # the last line of a crashed run may be cut short
+                continue
+            _ledger_merge(live, entry)
+    return live
+
+
+class Ledger(threading.Thread):
+    """
+    Append-only record of the resources a run creates and the states they
+    reach,  see -ledger.
+
+    record() keeps the last entry of each resource in memory and queues
+    the entry.  This thread appends the queued entries to the file and
+    fsyncs once per batch,  so a crash loses at most one batch and the
+    workers never wait on the disk.
+    """
+
+    def __init__(self, path):
+        threading.Thread.__init__(self)
+        self.name = "qaStressTest-ledger"
+        self.daemon = True
+        self.path = path
+        self.lock = threading.Lock()
+        # what an earlier run left in the file counts as ours too
+        self.live = read_ledger(path)
+        self.queue = Queue.Queue()
+        self.out = open(path, "a")
+        # end the line a crashed run cut short before appending to it
+        if os.path.getsize(path):
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != "\n":
+                    self.out.write("\n")
+        self.written = 0
+        # set when resources of the run may be missing,  such as those of
+        # an agent that did not report its ledger
+        self.partial = False
+
+    def _add(self, entry):
+        with self.lock:
+            _ledger_merge(self.live, entry)
+        self.queue.put(entry)
+
+    def record(self, kind, resource_id, state, **extra):
+        extra.update({"ts": mytime.time(), "kind": kind, "id": resource_id,
+                      "state": state})
+        self._add(extra)
+
+    def adopt(self, entries):
+        """
+        Add the entries of another ledger,  such as an agent's
+        """
+        for entry in entries:
+            self._add(dict(entry))
+
+    def entries(self):
+        """
+        Return the last entry of each resource not deleted yet
+        """
+        with self.lock:
+            return [dict(entry) for entry in self.live.values()]
+
+    def run(self):
+        while True:
+            entry = self.queue.get()
+            batch = []
+            while entry is not None:
+                batch.append(json.dumps(entry) + "\n")
+                if len(batch) >= LEDGER_BATCH:
+                    break
+                try:
+                    entry = self.queue.get_nowait()
+                except Queue.Empty:
+                    break
+            if batch:
+                self.out.write("".join(batch))
+                self.out.flush()
+                os.fsync(self.out.fileno())
+                self.written += len(batch)
+            if entry is None:
+                break
+
+    def close(self):
+        """
+        Write what is still queued and stop
+        """
+        self.queue.put(None)
+        self.join()
+        self.out.close()
+
+
+def ledger_record(action, resource_id, confirmed=False, **extra):
+    """
+    Note in the ledger,  if there is one,  the state action took
+    resource_id to
+    """
+    if ledger is None or resource_id is None or \
+            action not in LEDGER_STATES:
+        return
+    kind, requested, reached = LEDGER_STATES[action]
+    ledger.record(kind, resource_id, reached if confirmed else requested,
+                  **extra)
+
+
+def fetch_resources(entries):
+    """
+    Get each resource of the ledger entries by its id,  with up to
+    -cleanup-workers gets in flight.  Returns {(kind, id): resource} of
+    the ones that are still there,  those that are gone are noted in the
+    ledger as deleted.
+    """
+    getters = {"volume": cindercl.volumes.get,
+               "snapshot": cindercl.volume_snapshots.get,
+               "server": novacl.servers.get}
+    todo = Queue.Queue()
+    for entry in entries:
+        todo.put(entry)
+    found = {}
+
+    def work():
+        while True:
+            try:
+                entry = todo.get_nowait()
+            except Queue.Empty:
+                return
+            kind = entry["kind"]
+            attempt = 0
+            while True:
+                try:
+                    found[(kind, entry["id"])] = rate_limiters.call(
+                        "get_" + kind, getters[kind], entry["id"])
+                    break
+                except (cinderex.NotFound, novaex.NotFound):
+                    ledger.record(kind, entry["id"], "deleted")
+                    break
+                except (cinderex.RequestEntityTooLarge,
+                        novaex.RequestEntityTooLarge) as ex:
+                    mytime.sleep(backoff_delay(attempt, ex))
+                    attempt += 1
+                except:
+                    OpenStackThread.log_message("### Unable to get %s %s: "
+                                                "%s" % (kind, entry["id"],
+                                                traceback.format_exc()))
+                    break
+
+    threads = []
+    for x in xrange(min(args.cleanup_workers, len(entries))):
+        t = threading.Thread(target=work)
+        t.daemon = True
+        t.start()
+        threads.append(t)
+    for t in threads:
+        t.join()
+    return found
+
+
+class Guardrails(threading.Thread):
+    """
+    Checks the guardrails against the metrics of a sliding window.
+
+    Every GUARD_INTERVAL seconds the registry is snapshotted and the
+    window is the latest snapshot minus the oldest one still inside it.
+    A breached stop guardrail sets stop_run and records why in
+    stop_reason,  a breached shed guardrail sets shed_load until none is
+    breached any more.
+    """
+
+    def __init__(self, registry, guards, window):
+        threading.Thread.__init__(self)
+        self.name = "qaStressTest-guardrails"
+        self.daemon = True
+        self.registry = registry
+        self.guards = guards
+        self.window = window
+        self.finished = threading.Event()
+
+    def _value(self, name, shard):
+        if name == "errors":
+            samples = shard.actions + shard.errors
+            if samples < GUARD_MIN_SAMPLES:
+                return None
+            return float(shard.errors) / samples
+        if name == "stuck":
+            return watcher.stuck(self.window)
+        hist = LatencyHistogram()
+        for (action, kind), action_hist in shard.latencies.items():
+            if kind == "confirm":
+                hist.merge(action_hist)
+        if hist.count < GUARD_MIN_SAMPLES:
+            return None
+        return hist.percentile(float(name[1:]))
+
+    def _breach(self, name, value, limit, action):
+        reason = {"guard": name, "value": value, "limit": limit,
+                  "action": action, "window": self.window,
+                  "elapsed": mytime.time() - self.clock_start}
+        OpenStackThread.events.emit(dict(reason, event="guardrail"))
+        return reason
+
+    def run(self):
+        self.clock_start = mytime.time()
+        history = [(self.clock_start, self.registry.snapshot())]
+        while not self.finished.wait(GUARD_INTERVAL):
+            now = mytime.time()
+            total = self.registry.snapshot()
+            history.append((now, total))
+            while len(history) > 2 and history[1][0] <= now - self.window:
+                history.pop(0)
+            shard = total.subtract(history[0][1])
+
+            shedding = []
+            for name, limit, action in self.guards:
+                value = self._value(name, shard)
+                if value is None or value <= limit:
+                    continue
+                reason = self._breach(name, value, limit, action)
+                if action == "stop":
+                    stop_reason.update(reason)
+                    OpenStackThread.log_message("### Guardrail %s is %.3f,  "
+                                                "over %s,  stopping the run: "
+                                                "%s" % (name, value, limit,
+                                                        json.dumps(reason)))
+                    stop_run.set()
+                    watcher.stop()
+                    return
+                shedding.append("%s is %.3f,  over %s" % (name, value, limit))
+
+            if shedding and not shed_load.is_set():
+                OpenStackThread.log_message("### Guardrail shedding load,  "
+                                            "%s" % (",  ".join(shedding)))
+                shed_load.set()
+            elif not shedding and shed_load.is_set():
+                OpenStackThread.log_message("Guardrails back within limits,"
+                                            "  no longer shedding load")
+                shed_load.clear()
+
+    def stop(self):
+        self.finished.set()
+        self.join()
+
+
+def guard_pause():
+    """
+    Hold back new work while a guardrail sheds load.
+    Returns True if the run was stopped.
+    """
+    while shed_load.is_set() and not stop_run.is_set():
+        stop_run.wait(1)
+    return stop_run.is_set()
+
+
+class SoakReporter(threading.Thread):
+    """
+    Logs the throughput,  errors and latencies of each window of a soak.
+
+    Each window is the difference between two registry snapshots,  so
+    nothing is kept per window and the drift from the first window
+    shows how the backend held up over the run.  The first window is the
+    first one lifecycles finished in,  before that the windows only hold
+    the ramp up of the first lifecycles and are reported without drift.
+    """
+
+    def __init__(self, registry, window):
+        threading.Thread.__init__(self)
+        self.name = "qaStressTest-soak"
+        self.daemon = True
+        self.registry = registry
+        self.window = window
+        self.stopped = threading.Event()
+        self.number = 0
+        # (window number,  action -> rate) of the first window lifecycles
+        # finished in
+        self.first = None
+
+    def _report(self, shard, seconds):
+        self.number += 1
+        rates = {}
+        for action, label in ACTIONS:
+            rates[action] = shard.action_counts.get(action, 0) / seconds
+        if self.first is None and rates["delete_volume"]:
+            # each lifecycle ends deleting its volume
+            self.first = (self.number, rates)
+        memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        OpenStackThread.log_message("Soak window %d: %d actions,  %d "
+                                    "errors in %.0f seconds,  harness "
+                                    "peak memory %d KB" %
+                                    (self.number, shard.actions,
+                                     shard.errors, seconds, memory))
+        for action, label in ACTIONS:
+            drift = ""
+            if self.first is not None and self.first[0] < self.number and \
+                    self.first[1][action]:
+                number, rate = self.first[0], self.first[1][action]
+                drift = ",  %+.1f%% since window %d" % \
+                    (100.0 * (rates[action] / rate - 1), number)
+            hist = shard.latencies.get((action, "confirm"))
+            latency = ""
+            if hist is not None:
+                latency = ",  confirm p50 %.3f p99 %.3f" % \
+                    (hist.percentile(50), hist.percentile(99))
+            OpenStackThread.log_message("Soak window %d %s: %.3f/s%s,  %d "
+                                        "errors%s" %
+                                        (self.number, label, rates[action],
+                                         drift,
+                                         shard.error_counts.get(action, 0),
+                                         latency))
+        OpenStackThread.events.emit({"event": "window",
+                                     "window": self.number,
+                                     "seconds": seconds,
+                                     "metrics": shard.to_dict(),
+                                     "memory": memory})
+
+    def run(self):
+        last = self.registry.snapshot()
+        w_time = mytime.time()
+        while True:
+            self.stopped.wait(self.window)
+            now = mytime.time()
+            if self.stopped.is_set() and now - w_time < 1:
+                # too short a tail to say anything about the rates
+                break
+            total = self.registry.snapshot()
+            self._report(total.subtract(last), now - w_time)
+            last = total
+            w_time = now
+            if self.stopped.is_set():
+                break
+
+    def stop(self):
+        """
+        Report the last,  partial,  window and stop
+        """
+        self.stopped.set()
+        self.join()
+
+
+class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Serves GET /metrics from the metrics registry
+    """
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.exporter.render()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # scrapes would drown the test log
+        pass
+
+
+class MetricsExporter(threading.Thread):
+    """
+    Local HTTP endpoint with the live counters,  in-flight requests,
+    throughput and latency percentiles.
+
+    Everything is computed from a registry snapshot taken when the
+    endpoint is scraped.  The rates are the completions since the
+    previous scrape divided by the time between the two.
+    """
+
+    def __init__(self, port, registry):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.registry = registry
+        self.clock_start = mytime.time()
+        self.last_time = self.clock_start
+        self.last_counts = {}
+        self.lock = threading.Lock()
+        self.httpd = BaseHTTPServer.HTTPServer(("", port), MetricsHandler)
+        self.httpd.exporter = self
+
+    def render(self):
+        with self.lock:
+            total = self.registry.snapshot()
+            now = mytime.time()
+            interval = max(now - self.last_time, 0.001)
+            rates = {}
+            for action, count in total.action_counts.items():
+                rates[action] = (count - self.last_counts.get(action, 0)) / \
+                    interval
+            self.last_time = now
+            self.last_counts = dict(total.action_counts)
+        return prometheus_text(total, now - self.clock_start, rates)
+
+    def run(self):
+        self.httpd.serve_forever()
+
+
+class RateLimitedStreamHandler(logging.StreamHandler):
+    """
+    Console handler that shows at most rate info lines a second and
+    notes how many it held back.  Errors are always shown.
+    """
+
+    def __init__(self, rate):
+        logging.StreamHandler.__init__(self)
+        self.rate = rate
+        self.second = 0
+        self.shown = 0
+        self.suppressed = 0
+
+    def _note(self, created):
+        if self.suppressed:
+            logging.StreamHandler.emit(self, logging.makeLogRecord({
+                "msg": "(%d console lines suppressed)" % (self.suppressed),
+                "created": created,
+                "msecs": (created - int(created)) * 1000,
+                "levelno": logging.INFO, "levelname": "INFO"}))
+
+    def emit(self, record):
+        second = int(record.created)
+        if second != self.second:
+            self._note(record.created)
+            self.second = second
+            self.shown = 0
+            self.suppressed = 0
+        if record.levelno < logging.WARNING:
+            if self.shown >= self.rate:
+                self.suppressed += 1
+                return
+            self.shown += 1
+        logging.StreamHandler.emit(self, record)
+
+    def close(self):
+        self._note(mytime.time())
+        self.suppressed = 0
+        logging.StreamHandler.close(self)
+
+
+class EventLog(threading.Thread):
+    """
+    Structured events of every thread,  written off the worker hot path.
+
+    emit() only stamps the event and puts it on a queue.  This thread
+    takes the events off in batches,  writes each one as a line of JSON
+    to the events file,  with one flush per batch,  and turns the log
+    events into records for the console and the log file handlers.
+    """
+
+    def __init__(self, logger, path=None):
+        threading.Thread.__init__(self)
+        self.name = "qaStressTest-events"
+        self.daemon = True
+        self.logger = logger
+        self.queue = Queue.Queue()
+        self.out = None
+        if path:
+            self.out = open(path, "w")
+        self.written = 0
+
+    def emit(self, event):
+        event["ts"] = mytime.time()
+        self.queue.put(event)
+
+    def _record(self, event):
+        level = logging.INFO
+        if event.get("level") == "error":
+            level = logging.ERROR
+        msg = event["msg"]
+        if "actions" in event:
+            if level == logging.ERROR:
+                msg = "[A:%d,  E:%d] ### %s" % (event["actions"],
+                                                event["errors"], msg)
+            else:
+                msg = "[A:%d, E:%d] %s" % (event["actions"],
+                                           event["errors"], msg)
+        record = self.logger.makeRecord(self.logger.name, level, __file__,
+                                        0, msg, None, None)
+        record.created = event["ts"]
+        record.msecs = (event["ts"] - int(event["ts"])) * 1000
+        if event.get("exception"):
+            record.exc_text = event["exception"].rstrip("\n")
+        self.logger.handle(record)
+
+    def _write(self, batch):
+        for event in batch:
+            if self.out is not None:
+                self.out.write(json.dumps(event) + "\n")
+            if event["event"] == "log":
+                self._record(event)
+        if self.out is not None:
+            self.out.flush()
+        self.written += len(batch)
+
+    def run(self):
+        while True:
+            event = self.queue.get()
+            batch = []
+            while event is not None:
+                batch.append(event)
+                if len(batch) >= EVENT_BATCH:
+                    break
+                try:
+                    event = self.queue.get_nowait()
+                except Queue.Empty:
+                    break
+            self._write(batch)
+            if event is None:
+                break
+
+    def close(self):
+        """
+        Write what is still queued and stop
+        """
+        self.queue.put(None)
+        self.join()
+        if self.out is not None:
+            self.out.close()
+
+
+class VolumeLifecycle(object):
+    """
+    One volume going through the pipelined lifecycle: create,  snapshot,
+    attach,  detach,  delete snapshot and delete volume,  each step issued
+    as soon as the previous one is confirmed.
+    """
+
+    def __init__(self, index, selected_type, size=None):
+        self.index = index
+        self.selected_type = selected_type
+        # None picks a random size
+        self.size = size
+        self.volume = None
+        self.snapshot = None
+        self.done = False
+
+        # what the current step waits on: (kind, id, statuses, mark)
+        self.waiting = None
+        self.w_time = None
+        # text for the log and action charged if it is not confirmed
+        self.what = None
+        self.action = None
+        # next step once confirmed,  and if not confirmed in time
+        self.then = None
+        self.otherwise = None
+        # time the attached volume is held until before detaching
+        self.hold_until = None
 
 
 class OpenStackThread(threading.Thread):
@@ -189,8 +2201,8 @@ class OpenStackThread(threading.Thread):
 
     #static variable
     logger = None
+    events = None
     servers = []
-    attachCounters = {}
 
     lockit = threading.Lock()
 
@@ -205,8 +2217,6 @@ class OpenStackThread(threading.Thread):
 
         threading.Thread.__init__(self)
 
-        self.auth_url = "http://%s:35357/v2.0" % self.host
-
         if OpenStackThread.logger is None:
             OpenStackThread.setup_logging(logfile)
 
@@ -218,20 +2228,12 @@ class OpenStackThread(threading.Thread):
         self.volumes = []
         self.snapshots = []
 
-        self.total_actions = 0
-        self.action_create = 0
-        self.action_delete = 0
-        self.action_create_sp = 0
-        self.action_delete_sp = 0
-        self.action_attach = 0
-        self.action_detach = 0
-        self.total_errors = 0
-        self.error_delete = 0
-        self.error_create = 0
-        self.error_create_sp = 0
-        self.error_delete_sp = 0
-        self.error_attach = 0
-        self.error_detach = 0
+        # counters and latencies of this thread
+        self.stats = metrics.shard(threadid)
+        # the workload choices of this thread,  fixed by the seed
+        self.rng = random.Random("%s/%s" % (args.seed, threadid))
+        # set by resume(): (volume,  snapshots,  ledger state) to finish
+        self.resumed = None
 
         if len(OpenStackThread.servers) == 0:
             if not self.get_existing_servers():
@@ -247,7 +2249,10 @@ class OpenStackThread(threading.Thread):
                                       datefmt="[%Y-%m-%d][%H:%M:%S]")
 
         # create console handler and set level
-        ch = logging.StreamHandler()
+        if args.console_rate:
+            ch = RateLimitedStreamHandler(args.console_rate)
+        else:
+            ch = logging.StreamHandler()
         ch.setLevel(logging.INFO)
 
         # add formatter to ch
@@ -267,81 +2272,97 @@ class OpenStackThread(threading.Thread):
         urllib3_logger = logging.getLogger('urllib3')
         urllib3_logger.setLevel(logging.WARNING)
 
+        # only the event writer calls the handlers from now on
+        OpenStackThread.events = EventLog(OpenStackThread.logger,
+                                          args.events)
+        OpenStackThread.events.start()
+
     @staticmethod
     def log_message(msg):
-        OpenStackThread.logger.info(msg)
+        OpenStackThread.events.emit({"event": "log", "level": "info",
+                                     "msg": msg})
+
+    def _emit(self, event, action, resource, phase, outcome, latency,
+              **extra):
+        extra.update({"event": event, "thread": self.threadid,
+                      "action": action, "resource": resource,
+                      "phase": phase, "outcome": outcome,
+                      "latency": latency})
+        OpenStackThread.events.emit(extra)
+
+    def _confirmed(self, action, resource, seconds):
+        self.stats.record(action, "confirm", seconds)
+        self._emit("confirm", action, resource, "confirm", "ok", seconds)
+        ledger_record(action, resource, True)
+
+    def _api(self, action, resource, call, *args, **kwargs):
+        """
+        Make one API call and record how long it took under action.
+        resource is None for a create,  the new resource's id is used.
+        """
+        w_time = mytime.time()
+        outcome = "error"
+        self.stats.start(action)
+        try:
+            result = rate_limiters.call(action, call, *args, **kwargs)
+            outcome = "ok"
+            if resource is None:
+                resource = getattr(result, "id", None)
+            if action == "create_snapshot":
+                # -resume finds the volume of a snapshot through this
+                ledger_record(action, resource, thread=self.threadid,
+                              volume=result.volume_id)
+            elif action == "create_volume":
+                # and the watcher of -resume lists by this
+                ledger_record(action, resource, thread=self.threadid,
+                              tag=(result.metadata or {}).get(TAG_KEY, ""))
+            else:
+                ledger_record(action, resource, thread=self.threadid)
+            return result
+        except (cinderex.RequestEntityTooLarge,
+                novaex.RequestEntityTooLarge):
+            outcome = "overlimit"
+            raise
+        finally:
+            self.stats.finish(action)
+            latency = mytime.time() - w_time
+            self.stats.record(action, "api", latency)
+            self._emit("api", action, resource, "request", outcome, latency)
 
     def _log_message(self,  msg="",  actionIncrement=0,  action=None):
-        self.total_actions += actionIncrement
-
-        entry = "[A:%d, E:%d] %s" % (self.total_actions,
-                                     self.total_errors, msg)
-        OpenStackThread.logger.info(entry)
-
-        if action and action == "create_volume":
-            self.action_create += actionIncrement
-        elif action and action == "delete_volume":
-            self.action_delete += actionIncrement
-        elif action and action == "create_snapshot":
-            self.action_create_sp += actionIncrement
-        elif action and action == "delete_snapshot":
-            self.action_delete_sp += actionIncrement
-        elif action and action == "attach_volume":
-            self.action_attach += actionIncrement
-        elif action and action == "detach_volume":
-            self.action_detach += actionIncrement
+        self.stats.count_action(action, actionIncrement)
+
+        OpenStackThread.events.emit({"event": "log", "level": "info",
+                                     "thread": self.threadid,
+                                     "action": action,
+                                     "count": actionIncrement,
+                                     "actions": self.stats.actions,
+                                     "errors": self.stats.errors,
+                                     "msg": msg})
 
     def _log_error(self, msg="", errorIncrement=0, action=None,
                    exception=None):
-        self.total_errors += errorIncrement
-
-        entry = "[A:%d,  E:%d] ### %s" % (self.total_actions,
-                                          self.total_errors, msg)
-        OpenStackThread.logger.error(entry)
-
-        if action and action == "create_volume":
-            self.error_create += errorIncrement
-        elif action and action == "delete_volume":
-            self.error_delete += errorIncrement
-        elif action and action == "create_snapshot":
-            self.error_create_sp += errorIncrement
-        elif action and action == "delete_snapshot":
-            self.error_delete_sp += errorIncrement
-        elif action and action == "attach_volume":
-            self.error_attach += errorIncrement
-        elif action and action == "detach_volume":
-            self.error_detach += errorIncrement
+        self.stats.count_error(action, errorIncrement)
 
+        event = {"event": "log", "level": "error", "thread": self.threadid,
+                 "action": action, "count": errorIncrement,
+                 "actions": self.stats.actions, "errors": self.stats.errors,
+                 "msg": msg}
         if exception:
-            OpenStackThread.logger.exception(exception)
+            # the traceback is only at hand in this thread
+            event["exception"] = "%s\n%s" % (exception,
+                                             traceback.format_exc())
+        OpenStackThread.events.emit(event)
 
     def _create_nova_client(self):
-        novacl = nova(os.environ['OS_USERNAME'],
-                      os.environ['OS_PASSWORD'],
-                      os.environ['OS_TENANT_NAME'],
-                      self.auth_url,
-                      True,  None,  None,
-                      None,  None,
-                      'publicURL',  None,
-                      'compute',  None,
-                      None,  False,
-                      None,  True,
-                      False,  'keystone')
-
-        return novacl
+        return create_nova_client()
 
     def _create_cinder_client(self):
-        cindercl = cinder(os.environ['OS_USERNAME'],
-                          os.environ['OS_PASSWORD'],
-                          os.environ['OS_TENANT_NAME'],
-                          self.auth_url,  True,  None,  None,
-                          None,  None,  None,
-                          'publicURL',  None,  'volume',  None,  None)
-        return cindercl
+        return create_cinder_client()
 
     def get_volumes(self):
         try:
-            self.volumes = self.cindercl.volumes.list(True)
+            self.volumes = list(list_ours(self.cindercl.volumes, "volume"))
         except:
             self._log_error("Thread(%s) - %s" % (self.threadid,
                             traceback.format_exc()))
@@ -349,8 +2370,7 @@ class OpenStackThread(threading.Thread):
 
     def show_volumes(self):
         print "Show Volumes"
-        list_ = self.cindercl.volumes.list(True)
-        for volume in list_:
+        for volume in list_ours(self.cindercl.volumes, "volume"):
             pprint.pprint(volume)
 
     def _confirm_create_volume(self,  volume):
@@ -359,21 +2379,67 @@ class OpenStackThread(threading.Thread):
             self._log_message("Thread(%s) - confirming creation of volume %s" %
                               (self.threadid, volume.id))
             w_time = mytime.time()
-            volStatus = self.cindercl.volumes.get(volume.id).status
-            while mytime.time() - w_time < WAIT_CONFIRM:
-                if volStatus == "available":
-                    self._log_message("Thread(%s) - confirmed creation of "
-                                      "volume %s after %s seconds" %
-                                      (self.threadid, volume.id,
-                                       str(mytime.time() - w_time)))
-                    return
-                mytime.sleep(5)
-                volStatus = self.cindercl.volumes.get(volume.id).status
-            if volStatus != "available":
+            volStatus = watcher.wait_for("volume", volume.id, ("available",),
+                                         WAIT_CONFIRM)
+            if volStatus == "available":
+                self._confirmed("create_volume", volume.id,
+                                watcher.elapsed("volume", w_time))
+                self._log_message("Thread(%s) - confirmed creation of "
+                                  "volume %s after %s seconds" %
+                                  (self.threadid, volume.id,
+                                   str(mytime.time() - w_time)))
+            else:
                 self._log_error("Thread(%s) - Unable to confirm creation of "
                                 "volume %s after %s seconds" % (self.threadid,
                                 volume.id, str(mytime.time() - w_time)),
-                                1, "create-snapshot")
+                                1, "create_volume")
+
+    def _create_volume(self, a, selected_type, vol_size=None):
+        vol_name = OpenStackThread.VOLUME_NAME + "-" +\
+            str(self.threadid) + "-" + str(a)
+        vol_desc = "Created by qaStressTest thread-"+str(self.threadid)
+        if vol_size is None:
+            vol_size = self.rng.randint(1,  5)
+        if trace_recorder is not None:
+            trace_recorder.record(self.threadid, a, vol_size, selected_type)
+        vol_meta = None
+        if args.tag:
+            vol_meta = {TAG_KEY: args.tag}
+        attempt = 0
+        while True:
+            try:
+                vol = self._api("create_volume", None,
+                                self.cindercl.volumes.create, vol_size,
+                                display_name=vol_name,
+                                display_description=vol_desc,
+                                volume_type=selected_type, metadata=vol_meta)
+                self._log_message("Thread(%s)a - Creating volume(%s) %s " %
+                                  (self.threadid,  a,  vol.id),  1,
+                                  "create_volume")
+                break
+            except cinderex.NotFound:
+                # except cinderex.VolumeNotFound: deal with new sig for
+                # the method...VolumeNotFound doesn't work
+                vol = self._api("create_volume", None,
+                                self.cindercl.volumes.create, vol_size,
+                                display_name=vol_name,
+                                display_description=vol_desc,
+                                volume_type=selected_type, metadata=vol_meta)
+                self._log_message("Thread(%s)b - Created volume(%s) %s " %
+                                  (self.threadid, a, vol.id), 1,
+                                  "create_volume")
+                break
+            except cinderex.RequestEntityTooLarge as ex:
+                # a quota is for the caller to give up on
+                if not rate_limited(ex):
+                    raise
+                self._log_message("Thread(%s) - creating volume(%s) failed,"
+                                  "  overlimit; will sleep and retry" %
+                                  (self.threadid, a), 0, "create_volume")
+                mytime.sleep(backoff_delay(attempt, ex))
+                attempt += 1
+        self.volumes.append(vol)
+        return vol
 
     def create_volumes(self):
         self._log_message("Thread(%s) - Will create %s volumes" %
@@ -386,6 +2452,8 @@ class OpenStackThread(threading.Thread):
                 index = 0
 
             while a < self.num_volumes:
+                if guard_pause():
+                    break
                 if(self.volume_type_check):
                     if(index == len(volume_types)):
                         index = 0
@@ -395,39 +2463,11 @@ class OpenStackThread(threading.Thread):
                 else:
                     selected_type = None
 
-                vol_name = OpenStackThread.VOLUME_NAME + "-" +\
-                    str(self.threadid) + "-" + str(a)
-                vol_desc = "Created by qaStressTest thread-"+str(self.threadid)
-                vol_size = randint(1,  5)
-                try:
-                    vol = self.cindercl.volumes.\
-                        create(vol_size, display_name=vol_name,
-                               display_description=vol_desc,
-                               volume_type=selected_type)
-                    self._log_message("Thread(%s)a - Creating volume(%s) %s " %
-                                      (self.threadid,  a,  vol.id),  1,
-                                      "create_volume")
-                    self.volumes.append(vol)
-
-                    self._confirm_create_volume(vol)
-                    a = a + 1
-                    if(self.volume_type_check):
-                        index = index + 1
-                except cinderex.NotFound:
-                    # except cinderex.VolumeNotFound: deal with new sig for
-                    # the method...VolumeNotFound doesn't work
-                    vol = self.cindercl.volumes.\
-                        create(vol_size, display_name=vol_name,
-                               display_description=vol_desc,
-                               volume_type=selected_type)
-                    self._log_message("Thread(%s)b - Created volume(%s) %s " %
-                                      (self.threadid, a, vol.id), 1,
-                                      "create_volume")
-                    self.volumes.append(vol)
-                    self._confirm_create_volume(vol)
-                    a = a + 1
-                    if(self.volume_type_check):
-                        index = index + 1
+                vol = self._create_volume(a, selected_type)
+                self._confirm_create_volume(vol)
+                a = a + 1
+                if(self.volume_type_check):
+                    index = index + 1
         except cinderex.RequestEntityTooLarge as ex:
             self._log_error("Thread(%s) - Volume Quota reached. Giving up on "
                             "volume(%s)" % (self.threadid, a), 1,
@@ -447,23 +2487,26 @@ class OpenStackThread(threading.Thread):
                 self._log_message("Thread(%s) - confirming deletion of volume"
                                   " %s" % (self.threadid, volume.id))
                 w_time = mytime.time()
-                volStatus = self.cindercl.volumes.get(volume.id).status
-                while mytime.time() - w_time < WAIT_CONFIRM:
-                    if volStatus == "deleted":
-                        self._log_message("Thread(%s) - confirmed deletion of "
-                                          "volume %s after %s seconds" %
-                                          (self.threadid, volume.id, str
-                                           (mytime.time() - w_time)))
-                        return
-                    mytime.sleep(5)
-                    volStatus = self.cindercl.volumes.get(volume.id).status
-                if volStatus != "deleted":
+                volStatus = watcher.wait_for("volume", volume.id,
+                                             ("deleted",), WAIT_CONFIRM)
+                if volStatus == "deleted":
+                    placement.release(volume.id)
+                    self._confirmed("delete_volume", volume.id,
+                                    watcher.elapsed("volume", w_time))
+                    self._log_message("Thread(%s) - confirmed deletion of "
+                                      "volume %s after %s seconds" %
+                                      (self.threadid, volume.id, str
+                                       (mytime.time() - w_time)))
+                else:
                     self._log_error("Thread(%s) - Unable to confirm deletion "
                                     "of volume %s after %s seconds" %
                                     (self.threadid, volume.id,
                                      str(mytime.time() - w_time)),
                                     1, "delete_volume")
             except cinderex.NotFound:
+                    placement.release(volume.id)
+                    self._confirmed("delete_volume", volume.id,
+                                    watcher.elapsed("volume", w_time))
                     self._log_message("Thread(%s) - confirmed deletion of "
                                       "volume %s after %s seconds" %
                                       (self.threadid, volume.id,
@@ -478,10 +2521,12 @@ class OpenStackThread(threading.Thread):
 
     def _delete_volume(self, volume):
         #get latest and update
-        volume = self.cindercl.volumes.get(volume.id)
+        volume = rate_limiters.retry("get_volume",
+                                     self.cindercl.volumes.get, volume.id)
         if volume.status == 'available' or volume.status == "error":
             try:
-                self.cindercl.volumes.delete(volume)
+                self._api("delete_volume", volume.id,
+                          self.cindercl.volumes.delete, volume)
                 self._log_message("Thread(%s)a - deleting volume %s" %
                                   (self.threadid, volume.id), 1,
                                   "delete_volume")
@@ -504,21 +2549,19 @@ class OpenStackThread(threading.Thread):
                 self._detach_volumes(volume)
 
             #have a little bit wait,  just in case
-            w_time = mytime.time()
             self._log_message("Thread(%s) - trying to delete volume %s with "
                               "status %s, so sleep" % (self.threadid,
                                                        volume.id,
                                                        volume.status))
-            while((volume.status == 'creating' or volume.status == "in-use"
-                   or volume.status == 'detaching') and (mytime.time() -
-                                                         w_time < WAIT_TIME
-                                                         * 60)):
-                mytime.sleep(5)
-                volume = self.cindercl.volumes.get(volume.id)
+            watcher.wait_while("volume", volume.id,
+                               ("creating", "in-use", "detaching"),
+                               WAIT_TIME * 60)
+            volume = watcher.get("volume", volume.id) or volume
             #last try
             if volume.status == 'available' or volume.status == "error":
                 try:
-                    self.cindercl.volumes.delete(volume)
+                    self._api("delete_volume", volume.id,
+                              self.cindercl.volumes.delete, volume)
                     self._log_message("Thread(%s)b - deleting volume %s" %
                                       (self.threadid, volume.id), 1,
                                       "delete_volume")
@@ -540,6 +2583,8 @@ class OpenStackThread(threading.Thread):
                           (self.threadid,  len(self.volumes)))
 
         for volume in self.volumes:
+            if stop_run.is_set():
+                break
             if not self._has_dep(volume):
                 self._delete_volume(volume)
             else:
@@ -547,9 +2592,10 @@ class OpenStackThread(threading.Thread):
                 self._log_message("Thread(%s) - trying to delete volume %s "
                                   "with snapshot, so sleep" % (self.threadid,
                                   volume.id))
-                while(self._has_dep(volume) and
-                     (mytime.time() - w_time < WAIT_TIME * 60)):
-                    mytime.sleep(5)
+                for sid in snapshot_index.get(volume.id):
+                    watcher.wait_for("snapshot", sid, ("deleted",),
+                                     WAIT_TIME * 60 -
+                                     (mytime.time() - w_time))
                 if self._has_dep(volume):
                     self._log_error("Thread(%s) - volume %s has snapshot ,  "
                                     "will skip" % (self.threadid, volume.id),
@@ -559,49 +2605,46 @@ class OpenStackThread(threading.Thread):
 
         self.volumes = []
 
-    def _attach_volumes(self,  volume):
-        server = OpenStackThread.servers[randint(0,  self.num_servers-1)]
-
-        # if chosen server has met attachment limit, find next available server
-        if OpenStackThread.attachCounters[server.id] >= ATTACHMENT_LIMIT:
-            for item in OpenStackThread.servers:
-                if OpenStackThread.attachCounters[item.id] < ATTACHMENT_LIMIT:
-                    OpenStackThread.attachCounters[item.id] += 1
-                    server = item
-                    break
-        else:
-            OpenStackThread.attachCounters[server.id] += 1
-
-        # generate device name to use
-        deviceName = ""
-        num = OpenStackThread.attachCounters[server.id]
-        while num >= 26:
-            q = num / 26
-            deviceName = chr(97+q) + deviceName
-            num = num - 26 * q
-        deviceName = "/dev/vd" + deviceName + chr(97+num)
+    def _request_attach(self,  volume):
+        """
+        Pick a server and submit the attach request.
+        Returns (server,  deviceName),  or None if it could not be submitted
+        """
+        placed = placement.acquire(volume.id)
+        if placed is None:
+            self._log_error("Thread(%s) - cannot attach volume %s,  every "
+                            "server has %s volumes attached" %
+                            (self.threadid, volume.id, ATTACHMENT_LIMIT), 1,
+                            "attach_volume")
+            return None
+        server, deviceName = placed
 
+        attempt = 0
         while True:
             try:
                 self._log_message("Thread(%s) -  trying to attach volume %s to"
                                   " server %s using %s" % (self.threadid,
                                   volume.id, server.id, deviceName), 0,
                                   "attach_volume")
-                self.novacl.volumes.create_server_volume(server.id,
-                                                         volume.id,
-                                                         deviceName)
+                self._api("attach_volume", volume.id,
+                          self.novacl.volumes.create_server_volume,
+                          server.id, volume.id, deviceName)
                 self._log_message("Thread(%s) - attach request submitted -- "
                                   "attach volume %s to server %s using %s" %
                                   (self.threadid, volume.id, server.id,
                                   deviceName), 1, "attach_volume")
-                break
-            except novaex.RequestEntityTooLarge:
+                self._emit("placement", "attach_volume", volume.id,
+                           "request", "ok", None, server=server.id,
+                           device=deviceName)
+                return server, deviceName
+            except novaex.RequestEntityTooLarge as ex:
                 # wait and then retry
                 self._log_message("Thread(%s) - attaching volume %s to server "
                                   "%s using %s failed, overlimit; will sleep "
                                   "and retry" % (self.threadid, volume.id,
                                   server.id, deviceName), 0, "attach_volume")
-                mytime.sleep(WAIT_RETRY)
+                mytime.sleep(backoff_delay(attempt, ex))
+                attempt += 1
                 continue
             except:
                 self._log_error("Thread(%s) %s" % (self.threadid,
@@ -610,7 +2653,17 @@ class OpenStackThread(threading.Thread):
                                 "server %s using %s,  will skip " %
                                 (self.threadid, volume.id, server.id,
                                 deviceName),  1,  "attach_volume")
-                return
+                placement.release(volume.id)
+                return None
+
+    def _attach_volumes(self,  volume):
+        """
+        Attach volume,  return True once it is attached or submitted
+        """
+        attached = self._request_attach(volume)
+        if attached is None:
+            return False
+        server, deviceName = attached
 
         # if confirmation option is selected,
         # wait for attachment before continuing
@@ -619,23 +2672,26 @@ class OpenStackThread(threading.Thread):
                               " to server %s using %s" % (self.threadid,
                               volume.id,  server.id,  deviceName))
             w_time = mytime.time()
-            volStatus = self.cindercl.volumes.get(volume.id).status
-            while mytime.time() - w_time < WAIT_CONFIRM:
-                if volStatus == "in-use":
-                    self._log_message("Thread(%s) - confirmed attachment of "
-                                      "volume %s to server %s using %s after "
-                                      "%s seconds" % (self.threadid, volume.id,
-                                      server.id, deviceName,
-                                      str(mytime.time() - w_time)))
-                    return
-                mytime.sleep(5)
-                volStatus = self.cindercl.volumes.get(volume.id).status
+            volStatus = watcher.wait_for("volume", volume.id, ("in-use",),
+                                         WAIT_CONFIRM)
+            if volStatus == "in-use":
+                self._confirmed("attach_volume", volume.id,
+                                watcher.elapsed("volume", w_time))
+                self._log_message("Thread(%s) - confirmed attachment of "
+                                  "volume %s to server %s using %s after "
+                                  "%s seconds" % (self.threadid, volume.id,
+                                  server.id, deviceName,
+                                  str(mytime.time() - w_time)))
+                return True
 
             self._log_error("Thread(%s) - unable to confirm attachment of "
                             "volume %s to server %s using %s after %s seconds,"
                             "  status is %s" % (self.threadid, volume.id,
                             server.id, deviceName, str(mytime.time() - w_time),
                             volStatus), 1, "attach_volume")
+            placement.release(volume.id)
+            return False
+        return True
 
     def attach_volumes(self):
         self._log_message("Thread(%s) - will attach %s volumes" %
@@ -649,19 +2705,20 @@ class OpenStackThread(threading.Thread):
             raise
 
         for volume in self.volumes:
+            if stop_run.is_set():
+                break
             #get latest status and update
-            volume = self.cindercl.volumes.get(volume.id)
+            volume = rate_limiters.retry("get_volume",
+                                         self.cindercl.volumes.get, volume.id)
             if volume.status == "available":
                 self._attach_volumes(volume)
             else:
                 self._log_message("Thread(%s) - trying to attach volume %s "
                                   "not in available state,  need to wait" %
                                   (self.threadid, volume.id))
-                w_wait = mytime.time()
-                while volume.status != "available" and\
-                        mytime.time() - w_wait < WAIT_TIME * 60:
-                    mytime.sleep(10)
-                    volume = self.cindercl.volumes.get(volume.id)
+                watcher.wait_for("volume", volume.id, ("available",),
+                                 WAIT_TIME * 60)
+                volume = watcher.get("volume", volume.id) or volume
 
                 if volume.status == "available":
                     self._attach_volumes(volume)
@@ -671,28 +2728,38 @@ class OpenStackThread(threading.Thread):
                                     " skip " % (self.threadid, volume.id), 1,
                                     "attach_volume")
 
-    def _detach_volumes(self,  volume):
+    def _request_detach(self,  volume):
+        """
+        Submit the detach request.
+        Returns the server id,  or None if it could not be submitted
+        """
         serverId = volume.attachments[0]['server_id']
+        attempt = 0
         while True:
             try:
                 self._log_message("Thread(%s) -  trying to detach volume %s "
                                   "from server %s" % (self.threadid,
                                   volume.id, volume.attachments[0]
                                   ['server_id']), 0, "detach_volume")
-                self.novacl.volumes.delete_server_volume(serverId, volume.id)
+                self._api("detach_volume", volume.id,
+                          self.novacl.volumes.delete_server_volume,
+                          serverId, volume.id)
                 self._log_message("Thread(%s) -  detach requested submitted --"
                                   " detach volume %s from server %s" %
                                   (self.threadid, volume.id, serverId), 1,
                                   "detach_volume")
-                break
-            except novaex.RequestEntityTooLarge:
+                if args.confirm is False:
+                    placement.release(volume.id)
+                return serverId
+            except novaex.RequestEntityTooLarge as ex:
                 # wait and then retry
                 self._log_message("Thread(%s) -  detaching volume %s from "
                                   "server %s failed,  overlimit; will sleep "
                                   "and retry" % (self.threadid, volume.id,
                                   volume.attachments[0]['server_id']), 0,
                                   "detach_volume")
-                mytime.sleep(WAIT_RETRY)
+                mytime.sleep(backoff_delay(attempt, ex))
+                attempt += 1
                 continue
             except:
                 self._log_error("Thread(%s) %s" % (self.threadid,
@@ -700,7 +2767,15 @@ class OpenStackThread(threading.Thread):
                 self._log_error("Thread(%s) - cannot detach volume %s,  will "
                                 "skip " % (self.threadid, volume.id), 1,
                                 "detach_volume")
-                return
+                return None
+
+    def _detach_volumes(self,  volume):
+        """
+        Detach volume,  return True once it is detached or submitted
+        """
+        serverId = self._request_detach(volume)
+        if serverId is None:
+            return False
 
         # if confirmation option is selected,
         # wait for detachment before continuing
@@ -709,30 +2784,36 @@ class OpenStackThread(threading.Thread):
                               "%s from server %s" % (self.threadid, volume.id,
                               serverId))
             w_time = mytime.time()
-            volStatus = self.cindercl.volumes.get(volume.id).status
-            while mytime.time() - w_time < WAIT_CONFIRM:
-                if volStatus == "available":
-                    self._log_message("Thread(%s) - confirmed detachment of "
-                                      "volume %s from server %s after %s "
-                                      "seconds" % (self.threadid, volume.id,
-                                      serverId, str(mytime.time() - w_time)))
-                    return
-                mytime.sleep(5)
-                volStatus = self.cindercl.volumes.get(volume.id).status
+            volStatus = watcher.wait_for("volume", volume.id, ("available",),
+                                         WAIT_CONFIRM)
+            if volStatus == "available":
+                placement.release(volume.id)
+                self._confirmed("detach_volume", volume.id,
+                                watcher.elapsed("volume", w_time))
+                self._log_message("Thread(%s) - confirmed detachment of "
+                                  "volume %s from server %s after %s "
+                                  "seconds" % (self.threadid, volume.id,
+                                  serverId, str(mytime.time() - w_time)))
+                return True
 
             self._log_error("Thread(%s) - unable to confirm detachment of "
                             "volume %s from server %s after %s seconds,  "
                             "status is %s" % (self.threadid, volume.id,
                             serverId, str(mytime.time() - w_time), volStatus),
                             1, "detach_volume")
+            return False
+        return True
 
     def detach_volumes(self):
         self._log_message("Thread(%s) - will detach %s volumes" %
                           (self.threadid, len(self.volumes)))
 
         for volume in self.volumes:
+            if stop_run.is_set():
+                break
             #get latest status and update
-            volume = self.cindercl.volumes.get(volume.id)
+            volume = rate_limiters.retry("get_volume",
+                                         self.cindercl.volumes.get, volume.id)
             if volume.status == "in-use":
                 self._detach_volumes(volume)
             elif volume.status == "attaching":
@@ -740,11 +2821,9 @@ class OpenStackThread(threading.Thread):
                                   "in attaching state,  need to wait to go to"
                                   " in-use state" %
                                   (self.threadid, volume.id))
-                w_wait = mytime.time()
-                while volume.status == "attaching" and\
-                        mytime.time() - w_wait < WAIT_TIME * 60:
-                    mytime.sleep(10)
-                    volume = self.cindercl.volumes.get(volume.id)
+                watcher.wait_while("volume", volume.id, ("attaching",),
+                                   WAIT_TIME * 60)
+                volume = watcher.get("volume", volume.id) or volume
 
                 if volume.status == "in-use":
                     self._detach_volumes(volume)
@@ -772,17 +2851,7 @@ class OpenStackThread(threading.Thread):
 
     def _has_dep(self,  volume):
 
-        snapshots = self.get_snapshots()
-        for sp in snapshots:
-            try:
-                #get a fresh one
-                sp = self.cindercl.volume_snapshots.get(sp.id)
-                if sp.volume_id == volume.id:
-                    return True
-            except:
-                pass
-
-        return False
+        return snapshot_index.has(volume.id)
 
     """
     def show_dep(self,  info):
@@ -800,7 +2869,7 @@ class OpenStackThread(threading.Thread):
 
     def get_snapshots(self):
 
-        return self.cindercl.volume_snapshots.list(True)
+        return list(list_ours(self.cindercl.volume_snapshots, "snapshot"))
 
     def _confirm_create_snapshot(self,  snapshot):
         # confirm that snapshot was created
@@ -808,23 +2877,50 @@ class OpenStackThread(threading.Thread):
             self._log_message("Thread(%s) - confirming creation of snapshot"
                               " %s" % (self.threadid, snapshot.id))
             w_time = mytime.time()
-            volStatus = self.cindercl.volume_snapshots.get(snapshot.id).status
-            while mytime.time() - w_time < WAIT_CONFIRM:
-                if volStatus == "available":
-                    self._log_message("Thread(%s) - confirmed creation of "
-                                      "snapshot %s after %s seconds" %
-                                      (self.threadid, snapshot.id,
-                                      str(mytime.time() - w_time)))
-                    return
-                mytime.sleep(5)
-                snapshot = self.cindercl.volume_snapshots.get(snapshot.id)
-                volStatus = snapshot.status
-            if volStatus != "available":
+            volStatus = watcher.wait_for("snapshot", snapshot.id,
+                                         ("available",), WAIT_CONFIRM)
+            if volStatus == "available":
+                self._confirmed("create_snapshot", snapshot.id,
+                                watcher.elapsed("snapshot", w_time))
+                self._log_message("Thread(%s) - confirmed creation of "
+                                  "snapshot %s after %s seconds" %
+                                  (self.threadid, snapshot.id,
+                                  str(mytime.time() - w_time)))
+            else:
                 self._log_error("Thread(%s) - Unable to confirm creation of "
                                 "snapshot %s after %s seconds" %
                                 (self.threadid, snapshot.id, str(mytime.time()
                                 - w_time)),  1,  "create_snapshot")
 
+    def _create_snapshot(self,  volume,  tag=""):
+        tname = OpenStackThread.SNAPSHOT_NAME
+        sid = str(self.threadid)
+        vname = volume.display_name
+        sp_name = tname + "-" + sid + "-" + vname
+        sp_desc = "Created by qaStessTest thread-" + str(self.threadid)
+        attempt = 0
+        while True:
+            try:
+                sp = self._api("create_snapshot", None,
+                               self.cindercl.volume_snapshots.create,
+                               volume.id,  False,  sp_name,  sp_desc)
+                break
+            except cinderex.RequestEntityTooLarge as ex:
+                if not rate_limited(ex):
+                    raise
+                self._log_message("Thread(%s) - creating snapshot for volume"
+                                  " %s failed,  overlimit; will sleep and "
+                                  "retry" % (self.threadid, volume.id), 0,
+                                  "create_snapshot")
+                mytime.sleep(backoff_delay(attempt, ex))
+                attempt += 1
+        self._log_message("Thread(%s)%s - creating snapshot for volume %s " %
+                          (self.threadid,  tag,  volume.id),  1,
+                          "create_snapshot")
+        self.snapshots.append(sp)
+        snapshot_index.add(sp)
+        return sp
+
     def create_snapshots(self):
         self._log_message("Thread(%s) - Will create %s snapshots" %
                           (self.threadid, self.num_snapshots))
@@ -832,23 +2928,15 @@ class OpenStackThread(threading.Thread):
         sp = None
         try:
             for volume in self.volumes:
-                tname = OpenStackThread.SNAPSHOT_NAME
-                sid = str(self.threadid)
-                vname = volume.display_name
-                sp_name = tname + "-" + sid + "-" + vname
-                sp_desc = "Created by qaStessTest thread-" + str(self.threadid)
+                if stop_run.is_set():
+                    break
                 #get updaed status
-                volume = self.cindercl.volumes.get(volume.id)
+                volume = rate_limiters.retry("get_volume",
+                                             self.cindercl.volumes.get,
+                                             volume.id)
                 if volume.status == 'available':
                     try:
-                        sp = self.cindercl.volume_snapshots.create(volume.id,
-                                                                   False,
-                                                                   sp_name,
-                                                                   sp_desc)
-                        self._log_message("Thread(%s)a - creating snapshot "
-                                          "for volume %s " % (self.threadid,
-                                          volume.id),  1,  "create_snapshot")
-                        self.snapshots.append(sp)
+                        sp = self._create_snapshot(volume, "a")
                         self._confirm_create_snapshot(sp)
                     except:
                         self._log_error("Thread(%s)a - %s" %
@@ -858,27 +2946,16 @@ class OpenStackThread(threading.Thread):
                                         " for volume %s" % (self.threadid,
                                         volume.id),  1,  "create_snapshot")
                 elif volume.status == 'creating':
-                    w_time = mytime.time()
                     self._log_message("Thread(%s) - creating snapshot for "
                                       "volume %s in creating, so sleep" %
                                       (self.threadid, volume.id))
-                    while(volume.status == "creating" and
-                          (mytime.time() - w_time < WAIT_TIME * 60)):
-                        mytime.sleep(5)
-                        volume = self.cindercl.volumes.get(volume.id)
+                    watcher.wait_while("volume", volume.id, ("creating",),
+                                       WAIT_TIME * 60)
+                    volume = watcher.get("volume", volume.id) or volume
                     if volume.status is 'available' or\
                        volume.status is "in-use":
                         try:
-                            vid = volume.id
-                            sp = self.cindercl.volume_snapshots.create(vid,
-                                                                       False,
-                                                                       sp_name,
-                                                                       sp_desc)
-                            self._log_message("Thread(%s)b - Created snapshot "
-                                              "for volume  %s " %
-                                              (self.threadid, volume.id), 1,
-                                              "create_snapshot")
-                            self.snapshots.append(sp)
+                            sp = self._create_snapshot(volume, "b")
                             self._confirm_create_snapshot(sp)
                         except:
                             self._log_error("Thread(%s)b - %s" %
@@ -908,25 +2985,24 @@ class OpenStackThread(threading.Thread):
                 self._log_message("Thread(%s) - confirming deletion of "
                                   "snapshot %s" % (self.threadid, snapshot.id))
                 w_time = mytime.time()
-                snapshot = self.cindercl.volume_snapshots.get(snapshot.id)
-                volStatus = snapshot.status
-                while mytime.time() - w_time < WAIT_CONFIRM:
-                    if volStatus == "deleted":
-                        self._log_message("Thread(%s) - confirmed deletion of"
-                                          " snapshot %s after %s seconds" %
-                                          (self.threadid, snapshot.id,
-                                          str(mytime.time() - w_time)))
-                        return
-                    mytime.sleep(5)
-                    snapshot = self.cindercl.volume_snapshots.get(snapshot.id)
-                    volStatus = snapshot.status
-                if volStatus != "deleted":
+                volStatus = watcher.wait_for("snapshot", snapshot.id,
+                                             ("deleted",), WAIT_CONFIRM)
+                if volStatus == "deleted":
+                    self._confirmed("delete_snapshot", snapshot.id,
+                                    watcher.elapsed("snapshot", w_time))
+                    self._log_message("Thread(%s) - confirmed deletion of"
+                                      " snapshot %s after %s seconds" %
+                                      (self.threadid, snapshot.id,
+                                      str(mytime.time() - w_time)))
+                else:
                     self._log_error("Thread(%s) - Unable to confirm deletion "
                                     "of snapshot %s after %s seconds" %
                                     (self.threadid, snapshot.id,
                                     str(mytime.time() - w_time)), 1,
                                     "delete_volume")
             except cinderex.NotFound:
+                    self._confirmed("delete_snapshot", snapshot.id,
+                                    watcher.elapsed("snapshot", w_time))
                     self._log_message("Thread(%s) - confirmed deletion of "
                                       "snapshot %s after %s seconds" %
                                       (self.threadid, snapshot.id,
@@ -939,10 +3015,13 @@ class OpenStackThread(threading.Thread):
                                 snapshot.id, volStatus), 1, "delete_snapshot")
 
     def _delete_snapshot(self,  snapshot):
-        snapshot = self.cindercl.volume_snapshots.get(snapshot.id)
+        snapshot = rate_limiters.retry("get_snapshot",
+                                       self.cindercl.volume_snapshots.get,
+                                       snapshot.id)
         if snapshot.status == 'available' or snapshot.status == "error":
             try:
-                self.cindercl.volume_snapshots.delete(snapshot)
+                self._api("delete_snapshot", snapshot.id,
+                          self.cindercl.volume_snapshots.delete,  snapshot)
                 self._log_message("Thread(%s)a - deleting snapshot %s - %s "
                                   % (self.threadid, snapshot.id,
                                   snapshot.display_name), 1,
@@ -957,14 +3036,14 @@ class OpenStackThread(threading.Thread):
         elif snapshot.status == 'creating':
             self._log_message("Thread(%s) - deleting snapshot %s in creating"
                               "...so sleep" % (self.threadid, snapshot.id))
-            w_time = mytime.time()
-            while(snapshot.status == "creating" and (mytime.time() -
-                  w_time < WAIT_TIME * 60)):
-                mytime.sleep(5)
-                snapshot = self.cindercl.volume_snapshots.get(snapshot.id)
+            watcher.wait_while("snapshot", snapshot.id, ("creating",),
+                               WAIT_TIME * 60)
+            snapshot = watcher.get("snapshot", snapshot.id) or snapshot
             if snapshot.status == 'available' or snapshot.status == "error":
                 try:
-                    self.cindercl.volume_snapshots.delete(snapshot)
+                    self._api("delete_snapshot", snapshot.id,
+                              self.cindercl.volume_snapshots.delete,
+                              snapshot)
                     self._log_message("Thread(%s)b - deleted snapshot %s - "
                                       "%s " % (self.threadid, snapshot.id,
                                       snapshot.display_name), 1,
@@ -988,25 +3067,21 @@ class OpenStackThread(threading.Thread):
                           (self.threadid, len(self.snapshots)))
 
         for sp in self.snapshots:
+            if stop_run.is_set():
+                break
             self._delete_snapshot(sp)
 
         self.snapshots = []
 
-    def _test_server(self,  server):
+    @staticmethod
+    def _server_ready(server):
         """
         Check the server status and current task state
         if status is Active and task is None then it is available
         """
-        server = self.novacl.servers.get(server.id)
         task = server._info.get("OS-EXT-STS:task_state")
         status = server._info.get("status")
-
-        self._log_message("Testing server %s - %s,  %s" %
-                          (server.name, task, status))
-
-        if(task is None and status == "ACTIVE"):
-            return True
-        return False
+        return task is None and status == "ACTIVE"
 
     def create_servers(self):
 
@@ -1018,50 +3093,551 @@ class OpenStackThread(threading.Thread):
         self._log_message("Create  %s VirtualMachines" % need)
 
         # get list of images and use the first one in the list
-        images = self.novacl.images.list()
+        images = rate_limiters.retry("list_image", self.novacl.images.list)
         if images and len(images) > 0:
             image = images[0]
 
         # get list of flavors and use the tiny one
-        flavors = self.novacl.flavors.list()
+        flavors = rate_limiters.retry("list_flavor", self.novacl.flavors.list)
         tinyFlavor = None
         for flav in flavors:
             if flav.name == "m1.small":
                 tinyFlavor = flav
                 break
 
-        #  create the needed servers to run the test
+        # boot them all before waiting,  so they spawn side by side
+        booting = {}
+        stamp = mytime.strftime("-%Y%m%d-%H%M%S-")
         for i in range(need):
-            server = self.novacl.servers.create(OpenStackThread.
-                                                SERVERS_NAME+mytime.strftime
-                                                ("-%Y%m%d-%H%M%S-")+str(i),
-                                                image,  tinyFlavor,
-                                                None,  None,  None,  1)
+            attempt = 0
+            while True:
+                try:
+                    server = rate_limiters.call(
+                        "create_server", self.novacl.servers.create,
+                        OpenStackThread.SERVERS_NAME + stamp + str(i),
+                        image,  tinyFlavor,  None,  None,  None,  1)
+                    break
+                except novaex.RequestEntityTooLarge as ex:
+                    if not rate_limited(ex):
+                        raise
+                    self._log_message("Creating server %s failed,  "
+                                      "overlimit; will sleep and retry" %
+                                      (i))
+                    mytime.sleep(backoff_delay(attempt, ex))
+                    attempt += 1
+            ledger_record("create_server", server.id)
+            booting[server.id] = (server, watcher.watch("server", server.id))
             self._log_message("Waiting for server %s with ID %s to get spawned"
                               % (server.name, server.id))
 
-            while True:
-                if self._test_server(server):
-                    OpenStackThread.servers.append(server)
-                    OpenStackThread.attachCounters[server.id] = 0
-                    break
-                mytime.sleep(5)
+        # one server list per watcher tick covers all of them
+        w_time = mytime.time()
+        while booting:
+            if mytime.time() - w_time > WAIT_TIME * 60:
+                for server, mark in booting.values():
+                    watcher.unwatch("server", server.id)
+                    self._log_error("Server %s with ID %s is not ACTIVE "
+                                    "after %s seconds" %
+                                    (server.name, server.id,
+                                     str(mytime.time() - w_time)))
+                break
+            watcher.wait_tick(WATCH_INTERVAL * 2)
+            for server_id, (server, mark) in booting.items():
+                status = watcher.poll("server", server_id, mark)
+                listed = watcher.get("server", server_id)
+                if status is None or listed is None:
+                    continue
+                if status == "ERROR":
+                    self._log_error("Server %s with ID %s went to ERROR" %
+                                    (server.name, server_id))
+                elif not OpenStackThread._server_ready(listed):
+                    continue
+                else:
+                    self._log_message("Server %s with ID %s is ACTIVE after "
+                                      "%s seconds" % (server.name, server_id,
+                                      str(mytime.time() - w_time)))
+                    OpenStackThread.servers.append(listed)
+                    placement.add_server(listed)
+                    ledger_record("create_server", server_id, True)
+                watcher.unwatch("server", server_id)
+                del booting[server_id]
 
     def get_existing_servers(self):
-        servers = self.novacl.servers.list()
+        # no more pages are asked for once there are enough
+        servers = list_ours(self.novacl.servers, "server",
+                            {"status": "ACTIVE"})
 
         ctr = 0
         for server in servers:
-            if OpenStackThread.SERVERS_NAME in server.name:
-                if self._test_server(server):
-                    OpenStackThread.servers.append(server)
-                    OpenStackThread.attachCounters[server.id] = 0
-                    ctr += 1
-                    if ctr >= self.num_servers:
-                        return True
+            if OpenStackThread._server_ready(server):
+                OpenStackThread.servers.append(server)
+                placement.add_server(server)
+                # the run uses it,  so its cleanup deletes it
+                ledger_record("create_server", server.id, True)
+                ctr += 1
+                if ctr >= self.num_servers:
+                    return True
 
         return False
 
+    def _pipe_wait(self, lc, kind, resource_id, statuses, what, action,
+                   then, otherwise):
+        lc.waiting = (kind, resource_id, statuses,
+                      watcher.watch(kind, resource_id))
+        lc.w_time = mytime.time()
+        lc.what = what
+        lc.action = action
+        lc.then = then
+        lc.otherwise = otherwise
+
+    def _pipe_check(self, lc):
+        """
+        Move the lifecycle on if the step it waits on is done
+        """
+        if lc.hold_until is not None:
+            if mytime.time() >= lc.hold_until:
+                lc.hold_until = None
+                lc.then(lc)
+            return
+
+        kind, resource_id, statuses, mark = lc.waiting
+        status = watcher.poll(kind, resource_id, mark)
+        elapsed = mytime.time() - lc.w_time
+        if status in statuses:
+            watcher.unwatch(kind, resource_id)
+            lc.waiting = None
+            elapsed = watcher.elapsed(kind, lc.w_time)
+            self._confirmed(lc.action, resource_id, elapsed)
+            self._log_message("Thread(%s) - confirmed %s after %s seconds" %
+                              (self.threadid, lc.what, str(elapsed)))
+            lc.then(lc)
+        elif elapsed > WAIT_CONFIRM:
+            watcher.unwatch(kind, resource_id)
+            lc.waiting = None
+            self._log_error("Thread(%s) - unable to confirm %s after %s "
+                            "seconds,  status is %s" % (self.threadid,
+                            lc.what, str(elapsed), status), 1, lc.action)
+            lc.otherwise(lc)
+
+    def _pipe_create(self, lc):
+        try:
+            lc.volume = self._create_volume(lc.index, lc.selected_type,
+                                            lc.size)
+        except cinderex.RequestEntityTooLarge as ex:
+            self._log_error("Thread(%s) - Volume Quota reached. Giving up on "
+                            "volume(%s)" % (self.threadid, lc.index), 1,
+                            "create_volume", ex)
+            lc.done = True
+            return
+        except Exception as ex:
+            self._log_error("Thread(%s) - Create Volume failed. Giving up on "
+                            "volume(%s)" % (self.threadid, lc.index), 1,
+                            "create_volume", ex)
+            lc.done = True
+            return
+
+        self._pipe_wait(lc, "volume", lc.volume.id, ("available",),
+                        "creation of volume %s" % (lc.volume.id),
+                        "create_volume", self._pipe_snapshot,
+                        self._pipe_delete_volume)
+
+    def _pipe_snapshot(self, lc):
+        try:
+            lc.snapshot = self._create_snapshot(lc.volume)
+        except:
+            self._log_error("Thread(%s) - %s" % (self.threadid,
+                            traceback.format_exc()))
+            self._log_error("Thread(%s) - cannot create snapshot for volume "
+                            "%s" % (self.threadid, lc.volume.id), 1,
+                            "create_snapshot")
+            self._pipe_attach(lc)
+            return
+
+        self._pipe_wait(lc, "snapshot", lc.snapshot.id, ("available",),
+                        "creation of snapshot %s" % (lc.snapshot.id),
+                        "create_snapshot", self._pipe_attach,
+                        self._pipe_attach)
+
+    def _pipe_attach(self, lc):
+        attached = self._request_attach(lc.volume)
+        if attached is None:
+            self._pipe_delete_snapshot(lc)
+            return
+
+        server, deviceName = attached
+        self._pipe_wait(lc, "volume", lc.volume.id, ("in-use",),
+                        "attachment of volume %s to server %s using %s" %
+                        (lc.volume.id, server.id, deviceName),
+                        "attach_volume", self._pipe_hold, self._pipe_detach)
+
+    def _pipe_hold(self, lc):
+        self._log_message("Thread(%s) - holding volume %s for 30 seconds "
+                          "before detach" % (self.threadid, lc.volume.id))
+        lc.hold_until = mytime.time() + 30
+        lc.then = self._pipe_detach
+
+    def _pipe_detach(self, lc):
+        volume = watcher.get("volume", lc.volume.id) or lc.volume
+        if not volume.attachments:
+            self._log_error("Thread(%s) - detach for an attach that never "
+                            "happened for volume %s,  status %s" %
+                            (self.threadid, volume.id, volume.status), 1,
+                            "detach_volume")
+            placement.release(volume.id)
+            self._pipe_delete_snapshot(lc)
+            return
+
+        serverId = self._request_detach(volume)
+        if serverId is None:
+            self._pipe_delete_snapshot(lc)
+            return
+
+        self._pipe_wait(lc, "volume", volume.id, ("available",),
+                        "detachment of volume %s from server %s" %
+                        (volume.id, serverId), "detach_volume",
+                        self._pipe_detached, self._pipe_delete_snapshot)
+
+    def _pipe_detached(self, lc):
+        placement.release(lc.volume.id)
+        self._pipe_delete_snapshot(lc)
+
+    def _pipe_delete_snapshot(self, lc):
+        sp = lc.snapshot
+        if sp is None:
+            self._pipe_delete_volume(lc)
+            return
+
+        lc.snapshot = None
+        try:
+            self._api("delete_snapshot", sp.id,
+                      self.cindercl.volume_snapshots.delete,  sp)
+            self._log_message("Thread(%s) - deleting snapshot %s - %s " %
+                              (self.threadid, sp.id, sp.display_name), 1,
+                              "delete_snapshot")
+        except Exception as ex:
+            self._log_error("Thread(%s) - failed to delete snapshot %s - %s" %
+                            (self.threadid, sp.id, sp.display_name), 1,
+                            "delete_snapshot", ex)
+            self._pipe_delete_volume(lc)
+            return
+
+        self._pipe_wait(lc, "snapshot", sp.id, ("deleted",),
+                        "deletion of snapshot %s" % (sp.id),
+                        "delete_snapshot", self._pipe_delete_volume,
+                        self._pipe_delete_volume)
+
+    def _pipe_delete_volume(self, lc):
+        try:
+            self._api("delete_volume", lc.volume.id,
+                      self.cindercl.volumes.delete,  lc.volume)
+            self._log_message("Thread(%s) - deleting volume %s" %
+                              (self.threadid, lc.volume.id), 1,
+                              "delete_volume")
+        except:
+            self._log_error("Thread(%s) %s" % (self.threadid,
+                            traceback.format_exc()))
+            self._log_error("Thread(%s) - failed to delete volume %s" %
+                            (self.threadid, lc.volume.id), 1,
+                            "delete_volume")
+            lc.done = True
+            return
+
+        self._pipe_wait(lc, "volume", lc.volume.id, ("deleted",),
+                        "deletion of volume %s" % (lc.volume.id),
+                        "delete_volume", self._pipe_deleted, self._pipe_finish)
+
+    def _pipe_deleted(self, lc):
+        # a volume whose detach was not confirmed held its device till now
+        placement.release(lc.volume.id)
+        self._pipe_finish(lc)
+
+    def _pipe_finish(self, lc):
+        lc.done = True
+
+    def run_pipelined(self):
+        """
+        Run every volume through its own lifecycle instead of doing each
+        phase for all volumes before starting the next one.  The steps
+        always wait for their status,  the next step depends on it.
+        """
+        self._log_message("Thread(%s) - Will run %s volumes through a "
+                          "pipelined lifecycle" % (self.threadid,
+                          self.num_volumes))
+
+        if len(OpenStackThread.servers) < self.num_servers:
+            self._log_error("Thread(%s) - cannot attach volumes since not "
+                            "enough servers " % (self.threadid), 1,
+                            "attach_volume")
+            return
+
+        lifecycles = []
+        for a in xrange(self.num_volumes):
+            if guard_pause():
+                break
+            lifecycles.append(self._pipe_start(a))
+
+        # a soak replaces each finished lifecycle until its end
+        deadline = None
+        if args.soak:
+            deadline = mytime.time() + args.soak
+        self._pipe_loop(lifecycles, deadline, self.num_volumes)
+
+    def _pipe_loop(self, lifecycles, deadline=None, a=0):
+        """
+        Check the lifecycles after each watcher tick until they are done,
+        starting new ones numbered from a until deadline
+        """
+        while True:
+            for lc in lifecycles:
+                if lc.done:
+                    self._pipe_forget(lc)
+            lifecycles = [lc for lc in lifecycles if not lc.done]
+            while deadline is not None and mytime.time() < deadline and \
+                    len(lifecycles) < self.num_volumes and \
+                    not shed_load.is_set():
+                lifecycles.append(self._pipe_start(a))
+                a += 1
+            if not lifecycles or stop_run.is_set():
+                # the cleanup takes care of what is left
+                break
+            watcher.wait_tick(WATCH_INTERVAL)
+            for lc in lifecycles:
+                if not lc.done:
+                    self._pipe_check(lc)
+
+        self.volumes = []
+        self.snapshots = []
+
+    def run_resumed(self):
+        """
+        Run the volumes an earlier run left behind,  see resume(),
+        through the rest of their pipelined lifecycle
+        """
+        self._log_message("Thread(%s) - Will resume %s volumes" %
+                          (self.threadid, len(self.resumed)))
+
+        if len(OpenStackThread.servers) < self.num_servers:
+            self._log_error("Thread(%s) - cannot attach volumes since not "
+                            "enough servers " % (self.threadid), 1,
+                            "attach_volume")
+            return
+
+        lifecycles = []
+        for a, (volume, snapshots, state) in enumerate(self.resumed):
+            lc = VolumeLifecycle(a, None)
+            lc.volume = volume
+            if snapshots:
+                lc.snapshot = snapshots[0]
+            self._pipe_resume(lc, state)
+            lifecycles.append(lc)
+        self._pipe_loop(lifecycles)
+
+    def _pipe_resume(self, lc, state):
+        """
+        Enter the lifecycle at the step that follows the volume's status,
+        state is the last one the ledger has for it
+        """
+        volume = lc.volume
+        self._log_message("Thread(%s) - resuming volume %s,  %s and %s in "
+                          "the ledger" % (self.threadid, volume.id,
+                                          volume.status, state))
+        if volume.status == "creating":
+            self._pipe_wait(lc, "volume", volume.id, ("available",),
+                            "creation of volume %s" % (volume.id),
+                            "create_volume", self._pipe_snapshot,
+                            self._pipe_delete_volume)
+        elif volume.status == "attaching":
+            self._pipe_wait(lc, "volume", volume.id, ("in-use",),
+                            "attachment of volume %s" % (volume.id),
+                            "attach_volume", self._pipe_hold,
+                            self._pipe_detach)
+        elif volume.status == "in-use":
+            self._pipe_hold(lc)
+        elif volume.status == "detaching":
+            self._pipe_wait(lc, "volume", volume.id, ("available",),
+                            "detachment of volume %s" % (volume.id),
+                            "detach_volume", self._pipe_delete_snapshot,
+                            self._pipe_delete_snapshot)
+        elif volume.status == "deleting":
+            self._pipe_wait(lc, "volume", volume.id, ("deleted",),
+                            "deletion of volume %s" % (volume.id),
+                            "delete_volume", self._pipe_finish,
+                            self._pipe_finish)
+        elif volume.status == "available" and \
+                state not in ("detaching", "detached"):
+            if lc.snapshot is None:
+                self._pipe_snapshot(lc)
+            else:
+                self._pipe_attach(lc)
+        else:
+            # detached already,  or in error
+            self._pipe_delete_snapshot(lc)
+
+    def _pipe_start(self, a):
+        selected_type = None
+        if self.volume_type_check:
+            selected_type = volume_types[a % len(volume_types)]
+        lc = VolumeLifecycle(a, selected_type)
+        self._pipe_create(lc)
+        return lc
+
+    def _pipe_forget(self, lc):
+        """
+        Drop a finished lifecycle's volume and snapshot from the thread's
+        lists,  which would otherwise grow for as long as a soak runs
+        """
+        if lc.volume is None:
+            return
+        if lc.volume in self.volumes:
+            self.volumes.remove(lc.volume)
+        self.snapshots = [sp for sp in self.snapshots
+                          if sp.volume_id != lc.volume.id]
+
+    def run_open_loop(self):
+        """
+        Start a pipelined lifecycle for every arrival the generator hands
+        out,  until it stops and all our lifecycles are done.
+        """
+        self._log_message("Thread(%s) - Will take open loop arrivals" %
+                          (self.threadid))
+
+        lifecycles = []
+        a = 0
+        while True:
+            arrival = open_loop.take(ARRIVAL_POLL)
+            while arrival is not None:
+                scheduled, entry = arrival
+                if entry is not None:
+                    lc = VolumeLifecycle(a, entry["type"], entry["size"])
+                else:
+                    selected_type = None
+                    if self.volume_type_check:
+                        selected_type = volume_types[a % len(volume_types)]
+                    lc = VolumeLifecycle(a, selected_type)
+                a += 1
+                open_loop.started_one(scheduled)
+                self._pipe_create(lc)
+                lifecycles.append(lc)
+                arrival = open_loop.take(0)
+
+            for lc in lifecycles:
+                if not lc.done:
+                    self._pipe_check(lc)
+            for lc in lifecycles:
+                if lc.done:
+                    open_loop.finished_one()
+            lifecycles = [lc for lc in lifecycles if not lc.done]
+
+            if not lifecycles and open_loop.finished() or stop_run.is_set():
+                break
+
+        self.volumes = []
+        self.snapshots = []
+
+    def _scenario_step(self, operation, attached, a):
+        """
+        Do one scenario operation,  return the next volume index
+        """
+        detached = [v for v in self.volumes if v not in attached]
+        if operation == "create_volume":
+            if scenario.types is not None:
+                selected_type = scenario.volume_type(self.rng)
+            elif self.volume_type_check:
+                selected_type = volume_types[a % len(volume_types)]
+            else:
+                selected_type = None
+            vol = self._create_volume(a, selected_type,
+                                      scenario.size(self.rng))
+            self._confirm_create_volume(vol)
+            return a + 1
+        if operation == "create_snapshot":
+            sp = self._create_snapshot(self.rng.choice(detached))
+            self._confirm_create_snapshot(sp)
+        elif operation == "attach_volume":
+            volume = self.rng.choice(detached)
+            if self._attach_volumes(volume):
+                attached.append(volume)
+        elif operation == "detach_volume":
+            volume = self.rng.choice(attached)
+            # the volume as attached,  the one held has no attachments yet
+            current = rate_limiters.retry("get_volume",
+                                          self.cindercl.volumes.get, volume.id)
+            if current.status == "attaching":
+                watcher.wait_while("volume", volume.id, ("attaching",),
+                                   WAIT_TIME * 60)
+                current = watcher.get("volume", volume.id) or current
+            if not current.attachments:
+                attached.remove(volume)
+                self._log_error("Thread(%s) - detach for an attach that "
+                                "never happened for volume %s,  status %s" %
+                                (self.threadid, volume.id, current.status),
+                                1, "detach_volume")
+            elif self._detach_volumes(current):
+                attached.remove(volume)
+        elif operation == "delete_snapshot":
+            sp = self.rng.choice(self.snapshots)
+            self.snapshots.remove(sp)
+            self._delete_snapshot(sp)
+        elif operation == "delete_volume":
+            volume = self.rng.choice(self._bare(detached))
+            self.volumes.remove(volume)
+            self._delete_volume(volume)
+        return a
+
+    def _bare(self, volumes):
+        """
+        Return the volumes that no snapshot of this thread depends on
+        """
+        parents = set(sp.volume_id for sp in self.snapshots)
+        return [v for v in volumes if v.id not in parents]
+
+    def run_scenario(self):
+        """
+        Do operations drawn from the scenario mix,  each followed by its
+        think time,  until the scenario duration is up.  Whatever is left
+        at the end is removed by the cleanup.
+        """
+        self._log_message("Thread(%s) - Will run scenario %s for %s seconds"
+                          % (self.threadid, args.scenario, args.duration))
+
+        attached = []
+        a = 0
+        deadline = mytime.time() + args.duration
+        while mytime.time() < deadline and not guard_pause():
+            detached = [v for v in self.volumes if v not in attached]
+            possible = []
+            if len(self.volumes) < self.num_volumes:
+                possible.append("create_volume")
+            if detached:
+                possible.append("create_snapshot")
+                if len(OpenStackThread.servers) >= self.num_servers:
+                    possible.append("attach_volume")
+            if attached:
+                possible.append("detach_volume")
+            if self.snapshots:
+                possible.append("delete_snapshot")
+            if self._bare(detached):
+                possible.append("delete_volume")
+
+            operation = scenario.operation(self.rng, possible)
+            if operation is None:
+                # only this thread changes its volumes,  so it never will be
+                self._log_message("Thread(%s) - nothing in the scenario mix "
+                                  "can be done any more" % (self.threadid))
+                break
+            try:
+                a = self._scenario_step(operation, attached, a)
+            except Exception as ex:
+                self._log_error("Thread(%s) - %s failed" %
+                                (self.threadid, operation), 1, operation, ex)
+            stop_run.wait(max(0, min(scenario.think(self.rng),
+                                     deadline - mytime.time())))
+
+        self._log_message("Thread(%s) - scenario done,  leaving %d volumes "
+                          "and %d snapshots to the cleanup" %
+                          (self.threadid, len(self.volumes),
+                           len(self.snapshots)))
+
     def run(self):
 #        pydevd.settrace('127.0.0.1',  suspend=True,
 #        stdoutToServer=True, stderrToServer=True)
@@ -1069,6 +3645,22 @@ class OpenStackThread(threading.Thread):
         #print "run called %s" % str(thread)
         self._log_message("Thread(%s) - Test started " % (self.threadid))
 
+        if open_loop is not None:
+            self.run_open_loop()
+            return
+
+        if self.resumed is not None:
+            self.run_resumed()
+            return
+
+        if scenario is not None:
+            self.run_scenario()
+            return
+
+        if args.pipeline or args.soak:
+            self.run_pipelined()
+            return
+
         self.create_volumes()
 
 #        mytime.sleep(randint(5,  10))
@@ -1081,7 +3673,7 @@ class OpenStackThread(threading.Thread):
 
         self._log_message("Thread(%s) - Sleeping for 30 seconds before start "
                           "detach" % (self.threadid))
-        mytime.sleep(30)
+        stop_run.wait(30)
 
 #        mytime.sleep(randint(5,  10))
 
@@ -1097,377 +3689,858 @@ class OpenStackThread(threading.Thread):
         #self.show_dep()
 
     def test_finished(self):
-
-        global totalRunActions
-        global totalRunAction_create
-        global totalRunAction_delete
-        global totalRunAction_create_sp
-        global totalRunAction_delete_sp
-        global totalRunAction_attach
-        global totalRunAction_detach
-
-        global totalRunErrors
-        global totalRunError_create
-        global totalRunError_delete
-        global totalRunError_create_sp
-        global totalRunError_delete_sp
-        global totalRunError_attach
-        global totalRunError_detach
-
-        OpenStackThread.lockit.acquire()
-        totalRunActions += self.total_actions
-        totalRunAction_create += self.action_create
-        totalRunAction_delete += self.action_delete
-        totalRunAction_create_sp += self.action_create_sp
-        totalRunAction_delete_sp += self.action_delete_sp
-        totalRunAction_attach += self.action_attach
-        totalRunAction_detach += self.action_detach
-
-        totalRunErrors += self.total_errors
-        totalRunError_create += self.error_create
-        totalRunError_delete += self.error_delete
-        totalRunError_create_sp += self.error_create_sp
-        totalRunError_delete_sp += self.error_delete_sp
-        totalRunError_attach += self.error_attach
-        totalRunError_detach += self.error_detach
-        OpenStackThread.lockit.release()
-
+        stats = self.stats
         self._log_message("Thread(%s) - test performed %s actions." %
-                          (self.threadid, self.total_actions))
-        self._log_message("Thread(%s) - test performed %s create volume "
-                          "actions." % (self.threadid, self.action_create))
-        self._log_message("Thread(%s) - test performed %s delete volume "
-                          "actions." % (self.threadid, self.action_delete))
-        self._log_message("Thread(%s) - test performed %s create snapshot "
-                          "actions." % (self.threadid, self.action_create_sp))
-        self._log_message("Thread(%s) - test performed %s delete snapshot "
-                          "actions." % (self.threadid, self.action_delete_sp))
-        self._log_message("Thread(%s) - test performed %s attach volume "
-                          "actions." % (self.threadid, self.action_attach))
-        self._log_message("Thread(%s) - test performed %s detach volume "
-                          "actions." % (self.threadid, self.action_detach))
+                          (self.threadid, stats.actions))
+        for action, label in ACTIONS:
+            self._log_message("Thread(%s) - test performed %s %s actions." %
+                              (self.threadid,
+                               stats.action_counts.get(action, 0), label))
 
         self._log_message("Thread(%s) - test observed %s errors" %
-                          (self.threadid, self.total_errors))
-        self._log_message("Thread(%s) - test observed %s create volume errors"
-                          % (self.threadid, self.error_create))
-        self._log_message("Thread(%s) - test observed %s delete volume "
-                          "errors" % (self.threadid, self.error_delete))
-        self._log_message("Thread(%s) - test observed %s create snapshot "
-                          "errors" % (self.threadid, self.error_create_sp))
-        self._log_message("Thread(%s) - test observed %s delete snapshot "
-                          "errors" % (self.threadid, self.error_delete_sp))
-        self._log_message("Thread(%s) - test observed %s attach volume errors"
-                          % (self.threadid,  self.error_attach))
-        self._log_message("Thread(%s) - test observed %s detach volume errors"
-                          % (self.threadid,  self.error_detach))
+                          (self.threadid, stats.errors))
+        for action, label in ACTIONS:
+            self._log_message("Thread(%s) - test observed %s %s errors" %
+                              (self.threadid,
+                               stats.error_counts.get(action, 0), label))
 
         self._log_message("Thread(%s) - test test time: %s " % (self.threadid,
                           mytimedelta(seconds=mytime.time()-self.clock_start)))
         self._log_message("Thread(%s) - test finished." % (self.threadid))
 
 
-def _finish_delete_snapshot(sp):
-    while True:
-        try:
-            OpenStackThread.log_message("Trying to delete snapshot %s" %
-                                        (sp.id))
-            cindercl.volume_snapshots.delete(sp)
-            OpenStackThread.log_message("Deleting snapshot %s" % (sp.id))
-
-            # confirm that the deletion occurred
-            if args.confirm is True:
-                OpenStackThread.log_message("Confirming deletion of snapshot "
-                                            "%s" % (sp.id))
-                w_time = mytime.time()
-                spStatus = cindercl.volume_snapshots.get(sp.id).status
-                while mytime.time() - w_time < WAIT_CONFIRM:
-                    if spStatus == "deleted":
-                        OpenStackThread.log_message("Confirmed deletion of "
-                                                    "snapshot % after % "
-                                                    "seconds" % (sp.id,
-                                                    str(mytime.time() -
-                                                    w_time)))
-                        return
-                    mytime.sleep(5)
-                    spStatus = cindercl.volume_snapshots.get(sp.id).status
-                OpenStackThread.log_message("Unable to confirm deletion of "
-                                            "snapshot %s after % seconds,  "
-                                            "status %s" % (sp.id,
-                                            str(mytime.time() - w_time),
-                                            spStatus))
-            return
+class CleanupItem(object):
+    """
+    A volume,  snapshot or server the cleanup has to get rid of
+    """
 
-        except cinderex.NotFound:
-            OpenStackThread.log_message("Confirmed deletion of snapshot % "
-                                        "after % seconds" %
-                                        (sp.id, str(mytime.time() - w_time)))
-            return
+    def __init__(self, kind, resource):
+        self.kind = kind
+        self.resource = resource
+        self.id = resource.id
+        # items that must be gone before this one can go,  and the items
+        # waiting for this one
+        self.blockers = 0
+        self.dependents = []
+        # (statuses,  True to wait until in them or False while in them)
+        self.wait = None
+        self.mark = None
+        self.w_time = None
 
-        except cinderex.RequestEntityTooLarge:
-            # wait and then retry
-            OpenStackThread.log_message("Deleting snapshot %s failed, "
-                                        "overlimit; will sleep and retry" %
-                                        (sp.id))
-            mytime.sleep(WAIT_RETRY)
-            continue
+    def name(self):
+        return "%s %s" % (self.kind, self.id)
 
-        except:
-            OpenStackThread.log_message("### Deleting snapshot exception")
-            OpenStackThread.log_message("### sp: %s" % (str(sp)))
-            OpenStackThread.log_message(traceback.format_exc())
-            return
 
+class CleanupEngine(object):
+    """
+    Deletes what the test left behind in dependency order: snapshots
+    before their volume,  and volumes,  detached first,  before the server
+    they are attached to.
+
+    Up to workers threads make the detach and delete calls,  so
+    independent resources go in parallel.  The calling thread checks
+    every resource waiting on a status change at once,  after each
+    watcher tick,  and hands each one that is gone on to its dependents.
+    """
 
-def _finish_delete_volume(vol):
-    while True:
-        try:
-            OpenStackThread.log_message("Trying to delete volume %s" %
-                                        (vol.id))
-            cindercl.volumes.delete(vol)
-            OpenStackThread.log_message("Deleted volume %s" % (vol.id))
-
-            # confirm that the deletion occurred
-            if args.confirm in True:
-                OpenStackThread.log_message("Confirming deletion of volume %s"
-                                            % (vol.id))
-                w_time = mytime.time()
-                volStatus = cindercl.volumes.get(vol.id).status
-                while mytime.time() - w_time < WAIT_CONFIRM:
-                    if volStatus == "deleted":
-                        OpenStackThread.log_message("Confirmed deletion of "
-                                                    "volume % after % seconds"
-                                                    % (vol.id,
-                                                    str(mytime.time() -
-                                                    w_time)))
-                        return
-                    mytime.sleep(5)
-                    volStatus = cindercl.volumes.get(vol.id).status
-                OpenStackThread.log_message("Unable to confirm deletion of "
-                                            "volume %s after % seconds, "
-                                            "status %s" % (vol.id,
-                                            str(mytime.time() - w_time),
-                                            volStatus))
-            return
+    # statuses a resource passes through on its own
+    BUSY = {"volume": ("creating", "attaching", "detaching", "downloading",
+                       "uploading", "backing-up", "restoring-backup"),
+            "snapshot": ("creating",),
+            "server": ()}
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.items = []
+        self.ready = Queue.Queue()
+        # items back from the workers,  waiting on a status or done
+        self.submitted = Queue.Queue()
+        self.remaining = 0
+
+    def add(self, kind, resource):
+        item = CleanupItem(kind, resource)
+        self.items.append(item)
+        return item
+
+    def depends(self, item, on):
+        """
+        Make item wait until on is gone
+        """
+        on.dependents.append(item)
+        item.blockers += 1
 
-        except cinderex.NotFound:
-            OpenStackThread.log_message("Confirmed deletion of volume % after "
-                                        "% seconds" % (vol.id,
-                                        str(mytime.time() - w_time)))
-            return
+    def run(self):
+        self.remaining = len(self.items)
+        threads = []
+        for x in xrange(min(self.workers, len(self.items))):
+            t = threading.Thread(target=self._work)
+            t.daemon = True
+            t.start()
+            threads.append(t)
+        for item in self.items:
+            if item.blockers == 0:
+                self.ready.put(item)
+
+        pending = []
+        while self.remaining:
+            if not pending:
+                # nothing to check until a worker hands something back
+                self._collect(self.submitted.get(), pending)
+            else:
+                watcher.wait_tick(WAIT_CONFIRM)
+            while True:
+                try:
+                    self._collect(self.submitted.get_nowait(), pending)
+                except Queue.Empty:
+                    break
+            pending = [item for item in pending if not self._check(item)]
 
-        except cinderex.RequestEntityTooLarge:
-            # wait and then retry
-            OpenStackThread.log_message("Deleting volume %s failed, "
-                                        "overlimit; will sleep and "
-                                        "retry" % (vol.id))
-            mytime.sleep(WAIT_RETRY)
-            continue
+        for t in threads:
+            self.ready.put(None)
+        # so none is still working when the interpreter shuts down
+        for t in threads:
+            t.join()
 
-        except:
-            OpenStackThread.log_message("### Deleting volume exception")
-            OpenStackThread.log_message("### vol: %s" % (str(vol)))
-            OpenStackThread.log_message(traceback.format_exc())
-            return
+    def _collect(self, item, pending):
+        if item.wait is None:
+            self._finish(item)
+        else:
+            item.mark = watcher.watch(item.kind, item.id)
+            item.w_time = mytime.time()
+            pending.append(item)
+
+    def _check(self, item):
+        """
+        Move item on if the status it waits on is reached.
+        Returns False while it is still waiting.
+        """
+        status = watcher.poll(item.kind, item.id, item.mark)
+        statuses, until = item.wait
+        elapsed = mytime.time() - item.w_time
+        if status is None or (status in statuses) != until:
+            if elapsed < WAIT_CONFIRM:
+                return False
+            OpenStackThread.log_message("### Unable to clean up %s,  still "
+                                        "%s after %s seconds" %
+                                        (item.name(), status, str(elapsed)))
+            watcher.unwatch(item.kind, item.id)
+            # let the dependents try anyway
+            self._finish(item)
+            return True
+
+        watcher.unwatch(item.kind, item.id)
+        item.wait = None
+        if item.kind == "volume" and status in ("available", "deleted"):
+            # detached or gone,  so is the device the run reserved for it
+            placement.release(item.id)
+        if status == "deleted":
+            OpenStackThread.log_message("Confirmed deletion of %s after %s "
+                                        "seconds" % (item.name(),
+                                                     str(elapsed)))
+            ledger_record("delete_" + item.kind, item.id, True)
+            self._finish(item)
+        else:
+            item.resource = watcher.get(item.kind, item.id) or item.resource
+            self.ready.put(item)
+        return True
+
+    def _finish(self, item):
+        self.remaining -= 1
+        for dependent in item.dependents:
+            dependent.blockers -= 1
+            if dependent.blockers == 0:
+                self.ready.put(dependent)
+
+    def _work(self):
+        while True:
+            item = self.ready.get()
+            if item is None:
+                return
+            try:
+                self._act(item)
+            except:
+                OpenStackThread.log_message("### Cleaning up %s failed: %s" %
+                                            (item.name(),
+                                             traceback.format_exc()))
+                item.wait = None
+            self.submitted.put(item)
+
+    def _call(self, item, action, call, *args):
+        """
+        Make the API call,  backing off while it is over limit.
+        Returns False if the resource is already gone.
+        """
+        attempt = 0
+        while True:
+            try:
+                rate_limiters.call(action, call, *args)
+                ledger_record(action, item.id)
+                return True
+            except (cinderex.NotFound, novaex.NotFound):
+                ledger_record("delete_" + item.kind, item.id, True)
+                return False
+            except (cinderex.RequestEntityTooLarge,
+                    novaex.RequestEntityTooLarge) as ex:
+                OpenStackThread.log_message("%s of %s failed,  overlimit; "
+                                            "will sleep and retry" %
+                                            (action, item.name()))
+                mytime.sleep(backoff_delay(attempt, ex))
+                attempt += 1
+
+    def _act(self, item):
+        """
+        Make the next call item needs and set what to wait for after it
+        """
+        resource = item.resource
+        status = resource.status
+        item.wait = None
+
+        if status in CleanupEngine.BUSY[item.kind]:
+            OpenStackThread.log_message("%s is %s,  wait" % (item.name(),
+                                                             status))
+            item.wait = (CleanupEngine.BUSY[item.kind], False)
+        elif status == "deleting":
+            item.wait = (("deleted",), True)
+        elif item.kind == "volume" and status == "in-use":
+            server_id = resource.attachments[0]['server_id']
+            OpenStackThread.log_message("Trying to detach volume %s from "
+                                        "server %s" % (item.id, server_id))
+            if self._call(item, "detach_volume",
+                          novacl.volumes.delete_server_volume,
+                          server_id, item.id):
+                item.wait = (("in-use", "detaching"), False)
+        elif item.kind == "server" or status in ("available", "error"):
+            OpenStackThread.log_message("Trying to delete %s" % (item.name()))
+            if item.kind == "volume":
+                gone = not self._call(item, "delete_volume",
+                                      cindercl.volumes.delete, resource)
+            elif item.kind == "snapshot":
+                gone = not self._call(item, "delete_snapshot",
+                                      cindercl.volume_snapshots.delete,
+                                      resource)
+            else:
+                gone = not self._call(item, "delete_server",
+                                      novacl.servers.delete, resource)
+            if not gone and args.confirm is True:
+                item.wait = (("deleted",), True)
+        else:
+            OpenStackThread.log_message("### Unable to delete %s,  status is "
+                                        "%s" % (item.name(), status))
 
 
-#keep track of threads so we can do clean up
-threads = []
-for x in xrange(args.threads):
+def create_threads(num_threads, num_volumes, threadbase=0):
+    threads = []
+    for x in xrange(threadbase, threadbase + num_threads):
 
-    ost = OpenStackThread(args.host, args.volumes,
-                          args.servers, args.logfile, x, args.voltype)
+        ost = OpenStackThread(args.host, num_volumes,
+                              args.servers, args.logfile, x, args.voltype)
 
-    # creating the first thread will create the logger so we can use now
-    if len(threads) == 0:
-        OpenStackThread.log_message("Number of threads: "+str(args.threads))
-        OpenStackThread.log_message("Number of servers: "+str(args.servers))
-        OpenStackThread.log_message("Number of volumes: "+str(args.volumes))
-        OpenStackThread.log_message("Enabled volume types: "+str(args.voltype))
-        OpenStackThread.log_message("Log file name: "+str(args.logfile))
-        OpenStackThread.log_message("Controller host: "+str(args.host))
+        # creating the first thread will create the logger so we can use now
+        if len(threads) == 0:
+            OpenStackThread.log_message("Number of threads: " +
+                                        str(num_threads))
+            OpenStackThread.log_message("Number of servers: " +
+                                        str(args.servers))
+            OpenStackThread.log_message("Number of volumes: " +
+                                        str(num_volumes))
+            OpenStackThread.log_message("Enabled volume types: " +
+                                        str(args.voltype))
+            OpenStackThread.log_message("Log file name: "+str(args.logfile))
+            OpenStackThread.log_message("Controller host: "+str(args.host))
+            OpenStackThread.log_message("Worker engine: "+str(args.engine))
+            OpenStackThread.log_message("Workload seed: "+str(args.seed))
 
-    # set thread name to a known value which is useful for debugging purposes
-    ost.name = "qaStressTest-thread-" + str(x)
-    ost.start()
-    threads.append(ost)
+        # set thread name to a known value which is useful for debugging
+        ost.name = "qaStressTest-thread-" + str(x)
+        threads.append(ost)
 
-for thread in threads:
-    thread.join()
-    thread.test_finished()
+    return threads
 
-#cleanup
 
-OpenStackThread.log_message("Start cleaning up...")
+def run_threads(threads):
+    if open_loop is not None:
+        open_loop.start()
 
-OpenStackThread.log_message("Clean up snapshots...")
-snapshots = cindercl.volume_snapshots.list(True)
-for sp in snapshots:
-    if OpenStackThread.SNAPSHOT_NAME in sp.display_name:
-        try:
-            sp = cindercl.volume_snapshots.get(sp.id)
-        except:
+    reporter = None
+    if args.soak:
+        reporter = SoakReporter(metrics, args.soak_window)
+        reporter.start()
+
+    guardrails = None
+    if guards:
+        guardrails = Guardrails(metrics, guards, args.guard_window)
+        guardrails.start()
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+        thread.test_finished()
+
+    if reporter is not None:
+        reporter.stop()
+    if guardrails is not None:
+        guardrails.stop()
+
+
+def cleanup(entries=None):
+    """
+    Delete the resources of the ledger entries,  fetched by id,  or
+    without entries those list_ours() lists.  Snapshots are only listed
+    by name,  so only those of the listed volumes are deleted.
+    """
+    OpenStackThread.log_message("Start cleaning up...")
+    engine = CleanupEngine(args.cleanup_workers)
+
+    if entries is None:
+        listed = {"volume": list_ours(cindercl.volumes, "volume"),
+                  "snapshot": list_ours(cindercl.volume_snapshots,
+                                        "snapshot"),
+                  "server": []}
+        if args.keepvm is False:
+            listed["server"] = list_ours(novacl.servers, "server")
+    else:
+        found = fetch_resources(entries)
+        listed = {"volume": [], "snapshot": [], "server": []}
+        for entry in entries:
+            resource = found.get((entry["kind"], entry["id"]))
+            if resource is not None and (entry["kind"] != "server" or
+                                         args.keepvm is False):
+                listed[entry["kind"]].append(resource)
+
+    volumes = {}
+    for vol in listed["volume"]:
+        volumes[vol.id] = engine.add("volume", vol)
+
+    for sp in listed["snapshot"]:
+        if entries is None and sp.volume_id not in volumes:
+            # listed by name only,  it is of another run's volume
             continue
-    if sp.status == "available" or sp.status == "error":
-        _finish_delete_snapshot(sp)
-    elif sp.status == "creating":
-        OpenStackThread.log_message("Snapshot %s in creating state,  wait" %
-                                    (sp.id))
-        w_time = mytime.time()
-        while sp.status == "creating" and(mytime.time() -
-                                          w_time < WAIT_TIME*60):
-            mytime.sleep(10)
-            sp = cindercl.volume_snapshots.get(sp.id)
+        item = engine.add("snapshot", sp)
+        if sp.volume_id in volumes:
+            engine.depends(volumes[sp.volume_id], item)
+
+    for sv in listed["server"]:
+        item = engine.add("server", sv)
+        for vol in volumes.values():
+            for attachment in vol.resource.attachments:
+                if attachment['server_id'] == sv.id:
+                    engine.depends(item, vol)
+
+    OpenStackThread.log_message("Clean up %d resources with %d workers..." %
+                                (len(engine.items), args.cleanup_workers))
+    w_time = mytime.time()
+    engine.run()
+    OpenStackThread.log_message("Finished cleaning up after %s seconds" %
+                                (str(mytime.time() - w_time)))
+
+
+def resume(threads, entries):
+    """
+    Hand the volumes of the ledger entries that are still there,  with
+    their snapshots,  to the threads in turn
+    """
+    found = fetch_resources(entries)
+    snapshots = {}
+    for entry in entries:
+        sp = found.get(("snapshot", entry["id"]))
+        if sp is not None:
+            snapshots.setdefault(sp.volume_id, []).append(sp)
+
+    for thread in threads:
+        thread.resumed = []
+    count = 0
+    for entry in entries:
+        vol = found.get(("volume", entry["id"]))
+        if vol is None:
+            continue
+        threads[count % len(threads)].resumed.append(
+            (vol, snapshots.get(vol.id, []), entry["state"]))
+        count += 1
+    OpenStackThread.log_message("Resuming %d volumes and %d snapshots of "
+                                "%s" % (count, sum(len(sps) for sps in
+                                                   snapshots.values()),
+                                        args.resume))
 
-        if sp.status == "available" or sp.status == "error":
-            _finish_delete_snapshot(sp)
-        else:
-            OpenStackThread.log_message("Unable to delete snapshot %s after "
-                                        "wait" % (sp.id))
+
+def merge_open_loop(stats, into):
+    for key in ("offered", "started", "shed", "finished", "lag_total"):
+        into[key] = into.get(key, 0) + stats[key]
+    for key in ("lag_max", "window"):
+        into[key] = max(into.get(key, 0), stats[key])
+
+
+def log_open_loop(stats, rate, arrival):
+    """
+    Report how far the achieved throughput fell short of the target.
+
+    Both are taken over the window the arrivals were generated in.  The
+    target is the arrivals offered,  poisson arrivals offer more or fewer
+    than rate times the window,  and only the lifecycles of those count
+    as achieved,  however long they took to finish.
+    """
+    if not stats:
+        OpenStackThread.log_message("### No open loop results,  no agent "
+                                    "reported any")
+        return
+    OpenStackThread.log_message("Open loop target rate: %s lifecycles per "
+                                "second,  %s arrivals" % (rate, arrival))
+    OpenStackThread.log_message("Open loop arrivals offered: %d,  started: "
+                                "%d,  shed at the in-flight limit or by a "
+                                "guardrail: %d" %
+                                (stats["offered"], stats["started"],
+                                 stats["shed"]))
+    if stats["started"]:
+        OpenStackThread.log_message("Open loop start lag: mean %.3f,  max "
+                                    "%.3f seconds" %
+                                    (stats["lag_total"] / stats["started"],
+                                     stats["lag_max"]))
+
+    window = float(stats["window"] or 1)
+    offered = max(stats["offered"], 1)
+    OpenStackThread.log_message("Open loop window %.1f seconds: offered "
+                                "%.3f/s,  achieved %.3f/s,  %d of %d "
+                                "lifecycles finished,  shortfall %.1f%%" %
+                                (window, stats["offered"] / window,
+                                 stats["finished"] / window,
+                                 stats["finished"], stats["offered"],
+                                 100.0 * (1 - stats["finished"] /
+                                          float(offered))))
+
+    # every lifecycle does each action once,  so each has the same target.
+    # Only lifecycles of -resume could do more,  they are not offered.
+    totals = metrics.snapshot()
+    for action, label in ACTIONS:
+        done = min(totals.action_counts.get(action, 0), stats["offered"])
+        OpenStackThread.log_message("Open loop action %s: achieved %.3f/s,"
+                                    "  %d of %d done,  shortfall %.1f%%" %
+                                    (label, done / window, done,
+                                     stats["offered"],
+                                     100.0 * (1 - done / float(offered))))
+
+
+def log_ramp(ramp):
+    """
+    Report the capacity curve and where its knee is
+    """
+    OpenStackThread.log_message("Ramp capacity curve (lifecycles/s offered,"
+                                "  confirmed actions/s,  confirm p99,  "
+                                "errors per action):")
+    for point in ramp.curve:
+        OpenStackThread.log_message("    %.3f  %.3f  %.3f  %.3f" %
+                                    (point["rate"], point["throughput"],
+                                     point["p99"], point["error_rate"]))
+    knee = ramp.knee
+    if knee is None:
+        OpenStackThread.log_message("Ramp reached its top rate without a "
+                                    "knee,  the capacity is higher")
+    elif knee["cause"] == "shed":
+        OpenStackThread.log_message("### Ramp stopped at step %d,  %.3f "
+                                    "lifecycles/s offered,  because %d "
+                                    "arrivals were shed at the in-flight "
+                                    "limit or by a guardrail.  That is the "
+                                    "harness's limit,  not the backend's "
+                                    "knee." % (knee["step"], knee["rate"],
+                                               knee["shed"]))
     else:
-        OpenStackThread.log_message("Unable to delete snapshot %s,  status "
-                                    "is %s" % (sp.id,  sp.status))
-
-OpenStackThread.log_message("Finished cleaning up snapshots")
-
-OpenStackThread.log_message("Clean up volumes...")
-volumes = cindercl.volumes.list(True)
-for vol in volumes:
-    if OpenStackThread.VOLUME_NAME in vol.display_name:
-        if vol.status == "available" or vol.status == "error":
-            _finish_delete_volume(vol)
-        elif vol.status == "in-use":
-            while True:
-                try:
-                    OpenStackThread.log_message("Trying to detach volume %s "
-                                                "from server %s" % (vol.id,
-                                                vol.attachments[0]
-                                                ['server_id']))
-                    novacl.volumes.delete_server_volume(vol.attachments[0]
-                                                        ['server_id'],  vol.id)
-
-                    # wait for detach to occur
-                    w_time = mytime.time()
-                    while vol.status == "in-use" and(mytime.time() -
-                                                     w_time < WAIT_TIME*60):
-                        mytime.sleep(10)
-                        vol = cindercl.volumes.get(vol.id)
-
-                    if vol.status == "available" or vol.status == "error":
-                        _finish_delete_volume(vol)
-                    else:
-                        OpenStackThread.log_message("### Unable to detach "
-                                                    "volume %s from server "
-                                                    "%s,  status is %s" %
-                                                    (vol.id, vol.attachments[0]
-                                                    ['server_id'], vol.status))
-                        OpenStackThread.log_message("Will try to delete "
-                                                    "volume %s anyway" %
-                                                    (vol.id))
-
-                        # lets just try to delete the volume anyway
-                        _finish_delete_volume(vol)
+        reason = "its throughput grew less than %d%%" % (RAMP_GAIN * 100)
+        if knee["cause"] == "p99":
+            reason = "its confirm p99 was over %s times that of the first " \
+                     "step" % (RAMP_P99)
+        elif knee["cause"] == "errors":
+            reason = "its errors per action were %.3f against %.3f in the " \
+                     "first step" % (knee["error_rate"],
+                                     ramp.curve[0]["error_rate"])
+        OpenStackThread.log_message("Ramp knee at step %d,  %.3f "
+                                    "lifecycles/s offered,  where %s" %
+                                    (knee["step"], knee["rate"], reason))
+    if ramp.best is not None:
+        # shedding kept the ramp from finding where the backend gives out
+        at_least = ""
+        if knee is not None and knee["cause"] == "shed":
+            at_least = "at least "
+        OpenStackThread.log_message("Estimated maximum sustainable "
+                                    "throughput: %s%.3f confirmed actions/s "
+                                    "at %.3f lifecycles/s" %
+                                    (at_least, ramp.best["throughput"],
+                                     ramp.best["rate"]))
+
+
+def log_totals():
+    totals = metrics.snapshot()
+    OpenStackThread.log_message("Total run actions: " +
+                                str(totals.actions))
+    for action, label in ACTIONS:
+        OpenStackThread.log_message("Total run action %s: %s" %
+                                    (label,
+                                     totals.action_counts.get(action, 0)))
+
+    OpenStackThread.log_message("Total run errors: " +
+                                str(totals.errors))
+    for action, label in ACTIONS:
+        OpenStackThread.log_message("Total run %s errors: %s" %
+                                    (label,
+                                     totals.error_counts.get(action, 0)))
+
+    OpenStackThread.log_message("Attachment distribution:" +
+                                str(placement.attach_counts))
+
+
+def log_latencies():
+    """
+    Log the latency percentiles of every action,  in seconds.  "api" is
+    the time the request took,  "confirm" the time until the volume or
+    snapshot reached the status the request asked for.
+    """
+    latencies = metrics.snapshot().latencies
+    for kind in ("api", "confirm"):
+        for action, label in ACTIONS:
+            hist = latencies.get((action, kind))
+            if hist is not None:
+                OpenStackThread.log_message("Latency %s %s: %s" %
+                                            (kind, action, hist.summary()))
 
-                    break
-                except novaex.RequestEntityTooLarge:
-                    # wait and then retry
-                    OpenStackThread.log_message("Detaching volume %s from "
-                                                "server %s failed, "
-                                                "overlimit; will sleep and "
-                                                "retry" % (vol.id,
-                                                vol.attachments[0]
-                                                ['server_id']))
-                    mytime.sleep(WAIT_RETRY)
-                    continue
-                except:
-                    OpenStackThread.log_message("### Detach failed: %s" %
-                                                (traceback.format_exc()))
-                    OpenStackThread.log_message("### Cannot detach volume %s "
-                                                "from server %s" %
-                                                (vol.id,
-                                                vol.attachments[0]
-                                                ['server_id']))
-                    break
 
-OpenStackThread.log_message("Finished cleaning up volumes")
+def _send(wfile, msg):
+    wfile.write(json.dumps(msg) + "\n")
+    wfile.flush()
 
-if args.keepvm is False:
-    servers = novacl.servers.list(True)
-    if len(servers) > 0:
-        OpenStackThread.log_message("Clean up servers...")
-        for sv in servers:
-            if OpenStackThread.SERVERS_NAME in sv.name:
-                try:
-                    OpenStackThread.log_message("Trying to delete server %s "
-                                                "with ID %s" %
-                                                (sv.name,  sv.id))
-                    novacl.servers.delete(sv)
-                    OpenStackThread.log_message("Deleted server %s" %
-                                                (sv.name))
-
-                    # wait until the server is really
-                    #deleted which will cause an exception error
-                    ctr = 0
-                    while True:
-                        server = novacl.servers.get(sv.id)
-                        status = server._info.get("status")
-                        OpenStackThread.log_message("Server %s status: %s" %
-                                                    (sv.name,  status))
-                        if status == "DELETED":
-                            break
-                        mytime.sleep(5)
-                        ctr += 1
-                        if ctr > 12:
-                            # something is wrong
-                            OpenStackThread.log_message("### Something is "
-                                                        "wrong, Server %s "
-                                                        "status %s is not "
-                                                        "changing" %
-                                                        (sv.name,  status))
-                            break
-
-                except novaex.NotFound:
-                    OpenStackThread.log_message("NotFound exception,  meaning "
-                                                "the server %s is deleted" %
-                                                (sv.name))
-                except:
-                    OpenStackThread.log_message("### Exception error in trying"
-                                                "to delete server %s:" %
-                                                (sv.name))
-                    OpenStackThread.log_message(traceback.format_exc())
-                    continue
-        OpenStackThread.log_message("Finished cleaning up servers")
-
-OpenStackThread.log_message("Total run actions: " +
-                            str(totalRunActions))
-OpenStackThread.log_message("Total run action create: " +
-                            str(totalRunAction_create))
-OpenStackThread.log_message("Total run action delete: " +
-                            str(totalRunAction_delete))
-OpenStackThread.log_message("Total run action create snapshot: " +
-                            str(totalRunAction_create_sp))
-OpenStackThread.log_message("Total run action delete snapshot: " +
-                            str(totalRunAction_delete_sp))
-OpenStackThread.log_message("Total run action attach: " +
-                            str(totalRunAction_attach))
-OpenStackThread.log_message("Total run action detach: " +
-                            str(totalRunAction_detach))
-
-OpenStackThread.log_message("Total run errors: " +
-                            str(totalRunErrors))
-OpenStackThread.log_message("Total run create volume errors:" +
-                            str(totalRunError_create))
-OpenStackThread.log_message("Total run delete volume errors:" +
-                            str(totalRunError_delete))
-OpenStackThread.log_message("Total run create snapshot errors:" +
-                            str(totalRunError_create_sp))
-OpenStackThread.log_message("Total run delete snapshot errors:" +
-                            str(totalRunError_delete_sp))
-OpenStackThread.log_message("Total run attach volume errors:" +
-                            str(totalRunError_attach))
-OpenStackThread.log_message("Total run detach volume errors:" +
-                            str(totalRunError_detach))
-
-OpenStackThread.log_message("Attachment distribution:" +
-                            str(OpenStackThread.attachCounters))
-OpenStackThread.log_message("Done")
+
+def _recv(rfile):
+    line = rfile.readline()
+    if not line:
+        raise EOFError("connection closed")
+    return json.loads(line)
+
+
+def run_agent(port):
+    """
+    Serve one coordinator session: build the threads it asks for, start
+    them when told to and send back the totals once they are done.
+    The coordinator does the tenant cleanup, so the agent does not,
+    except with -backend fake: its fake cloud lives in this process,
+    where the coordinator cannot see it, so the agent cleans up itself
+    and reports the ledger of what it could not delete.
+    """
+    global open_loop
+
+    if OpenStackThread.logger is None:
+        OpenStackThread.setup_logging(args.logfile)
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("", port))
+    listener.listen(1)
+
+    # the coordinator reads the port from the first line of stdout
+    print("qaStressTest agent listening on port %d" %
+          listener.getsockname()[1])
+    sys.stdout.flush()
+
+    conn, addr = listener.accept()
+    listener.close()
+    OpenStackThread.log_message("Agent - coordinator connected from %s:%s"
+                                % addr)
+    rfile = conn.makefile("r")
+    wfile = conn.makefile("w")
+
+    try:
+        msg = _recv(rfile)
+        # the coordinator's cleanup lists the volumes by its tag
+        args.tag = msg.get("tag", args.tag)
+        threads = create_threads(msg["threads"], msg["volumes"],
+                                 msg["threadbase"])
+        if msg.get("rate"):
+            open_loop = OpenLoopGenerator(msg["rate"], args.duration,
+                                          args.arrival, msg["inflight"],
+                                          "%s/%s" % (args.seed,
+                                                     msg["threadbase"]))
+        _send(wfile, {"status": "ready"})
+
+        msg = _recv(rfile)
+        if msg.get("cmd") != "go":
+            OpenStackThread.log_message("### Agent - coordinator sent %s "
+                                        "instead of go" % (msg))
+            return
+
+        run_threads(threads)
+        if fake_cloud is not None:
+            if ledger is not None and not ledger.partial:
+                cleanup(ledger.entries())
+            else:
+                cleanup()
+        log_totals()
+        done = {"status": "done", "metrics": metrics.snapshot().to_dict(),
+                "attachCounters": placement.attach_counts,
+                "guardrail": stop_reason}
+        if ledger is not None:
+            done["ledger"] = ledger.entries()
+        if open_loop is not None:
+            done["openLoop"] = open_loop.stats()
+        _send(wfile, done)
+    finally:
+        conn.close()
+
+
+def _start_local_agents(count):
+    """
+    Start count agent processes on this host and return their addresses
+    """
+    # pass our own options on,  minus the coordinator ones
+    argv = []
+    skip = False
+    for arg in sys.argv[1:]:
+        if skip:
+            skip = False
+            continue
+        if arg.split("=")[0] in ("-processes", "-agents", "-logfile",
+                                 "-metrics-port", "-events", "-seed",
+                                 "-record", "-ledger"):
+            skip = "=" not in arg
+            continue
+        argv.append(arg)
+
+    agents = []
+    for i in xrange(count):
+        logfile = "%s.agent%d" % (args.logfile, i)
+        agent_argv = argv + ["-agent", "0", "-logfile", logfile,
+                             "-seed", str(args.seed)]
+        if args.events:
+            agent_argv += ["-events", "%s.agent%d" % (args.events, i)]
+        if args.record:
+            agent_argv += ["-record", "%s.agent%d" % (args.record, i)]
+        if args.ledger:
+            agent_argv += ["-ledger", "%s.agent%d" % (args.ledger, i)]
+        proc = subprocess.Popen([sys.executable, os.path.abspath(__file__)] +
+                                agent_argv, stdout=subprocess.PIPE)
+        line = proc.stdout.readline()
+        if not line:
+            raise Exception("agent process %d exited before listening" % i)
+        agents.append(("127.0.0.1", int(line.split()[-1]), proc))
+    return agents
+
+
+def _connect_agent(host, port):
+    w_time = mytime.time()
+    while True:
+        try:
+            return socket.create_connection((host, port), WAIT_CONFIRM)
+        except socket.error:
+            # remote agents may still be starting up
+            if mytime.time() - w_time > WAIT_TIME * 60:
+                raise
+            mytime.sleep(5)
+
+
+def run_coordinator():
+    """
+    Split the thread budget across the agents,  start them together and
+    merge what they report into the totals of this process.
+    Returns the merged open loop stats.
+    """
+    open_loop_stats = {}
+    OpenStackThread.setup_logging(args.logfile)
+
+    agents = []
+    if args.agents:
+        for addr in args.agents.split(","):
+            host, port = addr.rsplit(":", 1)
+            agents.append((host, int(port), None))
+    if args.processes:
+        agents.extend(_start_local_agents(args.processes))
+
+    # make the servers up front so the agents do not race to create them,
+    # a fake cloud of this process is of no use to the agents though
+    if fake_cloud is None:
+        OpenStackThread(args.host, 0, args.servers, args.logfile,
+                        "coordinator", False)
+    OpenStackThread.log_message("Coordinator - %s agents,  %s threads,  "
+                                "%s volumes per thread" %
+                                (len(agents), args.threads, args.volumes))
+
+    sessions = []
+    threadbase = 0
+    for i, (host, port, proc) in enumerate(agents):
+        share = args.threads // len(agents)
+        if i < args.threads % len(agents):
+            share += 1
+        if share == 0:
+            continue
+        try:
+            conn = _connect_agent(host, port)
+            rfile = conn.makefile("r")
+            wfile = conn.makefile("w")
+            start = {"cmd": "start", "threads": share,
+                     "volumes": args.volumes, "threadbase": threadbase,
+                     "tag": args.tag}
+            if args.rate:
+                # each agent gets the share of the rate its threads have
+                start["rate"] = args.rate * share / args.threads
+                start["inflight"] = max(1, max_inflight() * share //
+                                        args.threads)
+            _send(wfile, start)
+            sessions.append((host, port, conn, rfile, wfile))
+            OpenStackThread.log_message("Coordinator - agent %s:%s runs "
+                                        "threads %s to %s" %
+                                        (host, port, threadbase,
+                                         threadbase + share - 1))
+        except:
+            OpenStackThread.log_message("### Coordinator - cannot start agent"
+                                        " %s:%s: %s" % (host, port,
+                                        traceback.format_exc()))
+        threadbase += share
+
+    ready = []
+    for session in sessions:
+        try:
+            _recv(session[3])
+            ready.append(session)
+        except:
+            OpenStackThread.log_message("### Coordinator - agent %s:%s did "
+                                        "not get ready: %s" % (session[0],
+                                        session[1], traceback.format_exc()))
+
+    # tell everyone to go at the same time
+    for session in ready:
+        _send(session[4], {"cmd": "go"})
+
+    for host, port, conn, rfile, wfile in ready:
+        try:
+            msg = _recv(rfile)
+            metrics.add(MetricsShard.from_dict(msg["metrics"]))
+            placement.merge_attach_counts(msg["attachCounters"])
+            if "openLoop" in msg:
+                merge_open_loop(msg["openLoop"], open_loop_stats)
+            if msg.get("guardrail") and not stop_reason:
+                stop_reason.update(msg["guardrail"], agent="%s:%s" %
+                                   (host, port))
+            if ledger is not None:
+                # the end of run cleanup then covers the agents' resources
+                if "ledger" in msg:
+                    ledger.adopt(msg["ledger"])
+                else:
+                    ledger.partial = True
+            OpenStackThread.log_message("Coordinator - agent %s:%s finished"
+                                        % (host, port))
+        except:
+            OpenStackThread.log_message("### Coordinator - lost agent %s:%s:"
+                                        " %s" % (host, port,
+                                        traceback.format_exc()))
+            if ledger is not None:
+                ledger.partial = True
+        conn.close()
+
+    for host, port, proc in agents:
+        if proc is not None:
+            proc.wait()
+
+    return open_loop_stats
+
+
+def max_inflight():
+    if args.inflight:
+        return args.inflight
+    if ramp_rates:
+        # threads times volumes would shed a ramp's arrivals long before
+        # the backend is stressed,  so only cap it at all it can offer
+        return int(sum(ramp_rates) * args.ramp_step) + 1
+    return args.threads * args.volumes
+
+
+# set when running open loop,  the threads take their arrivals from it
+open_loop = None
+
+# set with -record
+trace_recorder = None
+if args.record:
+    trace_recorder = TraceRecorder(args.record, args.seed)
+
+# set with -ledger,  -resume or -cleanup-from,  which append to their file
+ledger = None
+if args.ledger or args.resume or args.cleanup_from:
+    ledger = Ledger(args.ledger or args.resume or args.cleanup_from)
+    ledger.start()
+
+if args.tag is None:
+    args.tag = mytime.strftime("qastress-%Y%m%d-%H%M%S-") + str(os.getpid())
+    if args.resume or args.cleanup_from:
+        # the ledger's volumes are listed by the tag they were created with,
+        # or all of them by name when they do not share one
+        tags = set(entry.get("tag", "") for entry in ledger.entries()
+                   if entry["kind"] == "volume")
+        if tags:
+            args.tag = tags.pop() if len(tags) == 1 else ""
+
+# the watcher does all the status polling for the threads and the cleanup
+watcher = StatusWatcher(cindercl, novacl)
+snapshot_index = SnapshotIndex()
+watcher.subscribe("snapshot", snapshot_index.update)
+watcher.start()
+
+if args.metrics_port:
+    MetricsExporter(args.metrics_port, metrics).start()
+
+if args.agent is not None:
+    run_agent(args.agent)
+elif args.cleanup_from:
+    OpenStackThread.setup_logging(args.logfile)
+    cleanup(ledger.entries())
+    OpenStackThread.log_message("Done")
+else:
+    if args.processes or args.agents:
+        open_loop_stats = run_coordinator()
+    else:
+        threads = create_threads(args.threads, args.volumes)
+        if args.resume:
+            resume(threads, ledger.entries())
+        if args.replay:
+            open_loop = TraceReplay(args.replay, args.replay_speed,
+                                    max_inflight())
+        elif ramp_rates:
+            open_loop = RampGenerator(ramp_rates, args.ramp_step,
+                                      args.arrival, max_inflight(), metrics,
+                                      args.seed)
+        elif args.rate:
+            open_loop = OpenLoopGenerator(args.rate, args.duration,
+                                          args.arrival, max_inflight(),
+                                          args.seed)
+        run_threads(threads)
+        if open_loop is not None:
+            open_loop_stats = open_loop.stats()
+    if ledger is not None and not ledger.partial:
+        cleanup(ledger.entries())
+    else:
+        cleanup()
+    log_totals()
+    log_latencies()
+    OpenStackThread.log_message("Keystone authentications: %d" %
+                                (keystone.auth_calls))
+    http_pools.log_stats()
+    rate_limiters.log_stats()
+    if fake_cloud is not None:
+        OpenStackThread.log_message("Fake backend calls: %s" %
+                                    (sorted(fake_cloud.calls.items())))
+    if args.replay:
+        log_open_loop(open_loop_stats, open_loop.rate, "replayed")
+    elif ramp_rates:
+        log_ramp(open_loop)
+    elif args.rate:
+        log_open_loop(open_loop_stats, args.rate, args.arrival)
+    if trace_recorder is not None:
+        OpenStackThread.log_message("Recorded %d lifecycles to %s" %
+                                    (trace_recorder.count, args.record))
+    if stop_reason:
+        OpenStackThread.log_message("### Run stopped by a guardrail: %s" %
+                                    (json.dumps(stop_reason,
+                                                sort_keys=True)))
+    OpenStackThread.log_message("Done")
+
+if trace_recorder is not None:
+    trace_recorder.close()
+if ledger is not None:
+    ledger.close()
+if OpenStackThread.events is not None:
+    OpenStackThread.events.close()
+if stop_reason:
+    sys.exit(GUARD_EXIT)
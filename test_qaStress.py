@@ -0,0 +1,248 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+#    Licensed under the Apache License,  Version 2.0(the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing,  software
+#    distributed under the License is distributed on an "AS IS" BASIS,  WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND,  either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+"""
+Unit tests of the qaStressTest modules that do not talk to OpenStack.
+
+Run with:  python -m unittest test_qaStress
+"""
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from qaStressAnalyze import Timeline, read_events
+from qaStressMetrics import LatencyHistogram, MetricsShard
+from qaStressMetrics import parse_guards, parse_latency, parse_ramp
+from qaStressPlacement import Placement, device_name
+from qaStressScenario import Scenario, pick
+
+
+class LatencyHistogramTest(unittest.TestCase):
+
+    def test_index_and_highest(self):
+        values = list(range(0, 1024)) + [10 ** n for n in range(3, 10)]
+        for value in values:
+            index = LatencyHistogram._index(value)
+            highest = LatencyHistogram._highest(index)
+            self.assertTrue(highest >= value)
+            self.assertEqual(LatencyHistogram._index(highest), index)
+            # buckets are never more than 1% wide
+            self.assertTrue(highest - value <= max(1, value / 100.0))
+        self.assertEqual(LatencyHistogram._index(255), 255)
+
+    def test_percentile(self):
+        hist = LatencyHistogram()
+        self.assertEqual(hist.percentile(50), 0.0)
+        for ms in range(1, 101):
+            hist.record(ms / 1000.0)
+        self.assertEqual(hist.count, 100)
+        self.assertAlmostEqual(hist.percentile(50), 0.050, delta=0.0005)
+        self.assertAlmostEqual(hist.percentile(99), 0.099, delta=0.001)
+        self.assertEqual(hist.percentile(100), 0.1)
+        self.assertAlmostEqual(hist.mean(), 0.0505, places=6)
+
+    def test_subtract(self):
+        hist = LatencyHistogram()
+        for seconds in (0.1, 0.2, 0.3):
+            hist.record(seconds)
+        earlier = LatencyHistogram.from_dict(hist.to_dict())
+        hist.record(0.2)
+        hist.record(5)
+
+        since = hist.subtract(earlier)
+        self.assertEqual(since.count, 2)
+        self.assertEqual(sum(since.counts.values()), 2)
+        self.assertAlmostEqual(since.percentile(50), 0.2, delta=0.002)
+        self.assertEqual(since.max, 5000000)
+        self.assertEqual(hist.subtract(hist).count, 0)
+
+
+class MetricsShardTest(unittest.TestCase):
+
+    def test_subtract(self):
+        shard = MetricsShard("thread-1")
+        shard.count_action("create_volume", 2)
+        shard.count_error("delete_volume")
+        shard.record("create_volume", "api", 0.5)
+        earlier = MetricsShard.from_dict(shard.to_dict())
+
+        shard.count_action("create_volume")
+        shard.record("create_volume", "confirm", 2)
+        since = shard.subtract(earlier)
+        self.assertEqual(since.actions, 1)
+        self.assertEqual(since.errors, 0)
+        self.assertEqual(since.action_counts, {"create_volume": 1})
+        self.assertEqual(since.error_counts, {"delete_volume": 0})
+        # histograms with nothing new are left out
+        self.assertEqual(list(since.latencies),
+                         [("create_volume", "confirm")])
+
+
+class ParseTest(unittest.TestCase):
+
+    def test_parse_latency(self):
+        rng = random.Random(1)
+        self.assertEqual(parse_latency("0.5")(rng), 0.5)
+        self.assertEqual(parse_latency(0)(rng), 0.0)
+        for _ in range(100):
+            self.assertTrue(1 <= parse_latency("uniform:1:2")(rng) <= 2)
+            self.assertTrue(parse_latency("exp:2")(rng) >= 0)
+            self.assertTrue(parse_latency("normal:0:1")(rng) >= 0)
+        self.assertRaises(ValueError, parse_latency, "exp:x")
+        self.assertRaises(ValueError, parse_latency, "pareto:1")
+
+    def test_parse_ramp(self):
+        self.assertEqual(parse_ramp("1:2:7"), [1, 3, 5, 7])
+        rates = parse_ramp("0.1:0.1:0.3")
+        self.assertEqual(len(rates), 3)
+        self.assertAlmostEqual(rates[-1], 0.3)
+        self.assertEqual(parse_ramp("2:1:2"), [2])
+        for spec in ("1:2", "a:1:2", "0:1:2", "1:0:2", "3:1:2"):
+            self.assertRaises(ValueError, parse_ramp, spec)
+
+    def test_parse_guards(self):
+        self.assertEqual(parse_guards(""), [])
+        self.assertEqual(parse_guards("errors=0.1,p99.9=30:shed,stuck=5"),
+                         [("errors", 0.1, "stop"), ("p99.9", 30, "shed"),
+                          ("stuck", 5, "stop")])
+        for spec in ("errors", "errors=x", "p9x=1", "latency=1",
+                     "errors=0.1:pause"):
+            self.assertRaises(ValueError, parse_guards, spec)
+
+
+class ScenarioTest(unittest.TestCase):
+
+    def test_pick(self):
+        rng = random.Random(1)
+        self.assertEqual(pick(rng, []), None)
+        self.assertEqual(pick(rng, [("a", 0)]), None)
+        self.assertEqual(set(pick(rng, [("a", 0), ("b", 1)])
+                             for _ in range(50)), set(["b"]))
+        picks = [pick(rng, [("a", 1), ("b", 3)]) for _ in range(4000)]
+        self.assertAlmostEqual(picks.count("b") / 4000.0, 0.75, delta=0.05)
+
+    def test_defaults(self):
+        scenario = Scenario({})
+        self.assertEqual(scenario.threads, None)
+        self.assertEqual(len(scenario.mix), 6)
+        self.assertEqual([size for size, weight in scenario.sizes],
+                         [1, 2, 3, 4, 5])
+        self.assertEqual(scenario.types, None)
+        self.assertEqual(scenario.think(random.Random(1)), 0)
+
+    def test_scenario(self):
+        scenario = Scenario({"threads": 4,
+                             "mix": {"create_volume": 1, "attach_volume": 2},
+                             "sizes": {"10": 1}, "types": {"": 1},
+                             "think": "uniform:1:2"})
+        rng = random.Random(1)
+        self.assertEqual(scenario.threads, 4)
+        self.assertEqual(scenario.size(rng), 10)
+        self.assertEqual(scenario.volume_type(rng), None)
+        self.assertEqual(scenario.operation(rng, ["create_volume",
+                                                  "delete_volume"]),
+                         "create_volume")
+        self.assertEqual(scenario.operation(rng, ["delete_volume"]), None)
+
+    def test_bad_scenario(self):
+        for data in ({"thread": 1}, {"mix": {"resize_volume": 1}},
+                     {"mix": []}, {"sizes": {}}, {"sizes": {"big": 1}},
+                     {"mix": {"create_volume": 0}}):
+            self.assertRaises(ValueError, Scenario, data)
+
+
+class TimelineTest(unittest.TestCase):
+
+    def test_timeline(self):
+        rows = []
+
+        class Writer(object):
+            def writerow(self, row):
+                rows.append(row)
+
+        timeline = Timeline(Writer(), 1, 2)
+        timeline.add(100.0, "create_volume", 1, 0)
+        timeline.add(100.5, "create_volume", 0, 1)
+        timeline.add(101.2, "delete_volume", 1, 0)
+        self.assertEqual(rows, [])
+        timeline.add(103.5, "create_volume", 1, 0)
+        self.assertEqual(rows, [[0, "create_volume", 1, 1, "0.5000"]])
+
+        # second 0 is written,  an event that late is dropped
+        timeline.add(100.9, "create_volume", 1, 0)
+        self.assertEqual(timeline.dropped, 1)
+        timeline.close()
+        self.assertEqual(rows[1:], [[1, "delete_volume", 1, 0, "0.0000"],
+                                    [3, "create_volume", 1, 0, "0.0000"]])
+
+    def test_read_events(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, "events")
+            with open(path, "w") as f:
+                f.write('{"ts": 1, "event": "log"}\n\n'
+                        '{"ts": 2, "event": "api"}\n{"ts": 3, "ev')
+            skipped = {}
+            events = list(read_events(path, 0, skipped))
+            self.assertEqual([ts for ts, index, number, event in events],
+                             [1, 2])
+            self.assertEqual(skipped, {path: 1})
+        finally:
+            shutil.rmtree(tmp)
+
+
+class PlacementTest(unittest.TestCase):
+
+    class Server(object):
+        def __init__(self, server_id):
+            self.id = server_id
+
+    def test_device_name(self):
+        self.assertEqual(device_name(1), "/dev/vdb")
+        self.assertEqual(device_name(25), "/dev/vdz")
+
+    def test_spreads_volumes(self):
+        placement = Placement(2)
+        self.assertEqual(placement.acquire("v0"), None)
+        placement.add_server(self.Server("s1"))
+        placement.add_server(self.Server("s2"))
+        placement.add_server(self.Server("s1"))
+
+        placed = [placement.acquire("v%d" % (i)) for i in range(4)]
+        self.assertEqual(sorted((server.id, device) for server, device in
+                                placed),
+                         [("s1", "/dev/vdb"), ("s1", "/dev/vdc"),
+                          ("s2", "/dev/vdb"), ("s2", "/dev/vdc")])
+        self.assertEqual(placement.acquire("v4"), None)
+        self.assertEqual(placement.attach_counts, {"s1": 2, "s2": 2})
+
+    def test_release(self):
+        placement = Placement(2)
+        placement.add_server(self.Server("s1"))
+        self.assertEqual(placement.acquire("v1")[1], "/dev/vdb")
+        self.assertEqual(placement.acquire("v2")[1], "/dev/vdc")
+        placement.release("v1")
+        # released twice,  or never held,  gives nothing back
+        placement.release("v1")
+        placement.release("v9")
+        self.assertEqual(placement.attached, {"s1": 1})
+        self.assertEqual(placement.acquire("v3")[1], "/dev/vdb")
+        self.assertEqual(placement.acquire("v4"), None)
+
+
+if __name__ == "__main__":
+    unittest.main()